@@ -0,0 +1,76 @@
+"""
+Micro-benchmark comparing `Codec` date and timestamp decoding with the
+`datetime.datetime.strptime` implementation it replaced.
+
+The input mimics a diary response - thousands of entries sharing a few
+hundred distinct dates.
+
+Usage:
+    $ python benchmarks/dates.py [ENTRY_COUNT] [DISTINCT_DATE_COUNT]
+"""
+
+import datetime
+import random
+import sys
+import timeit
+
+from mfpsync import codec
+from mfpsync.codec import Codec
+
+def get_strings(entry_count, distinct_count):
+    """
+    Return `(date_strings, timestamp_strings)` lists of `entry_count` items,
+    drawn from `distinct_count` distinct values.
+    """
+
+    start = datetime.datetime(2014, 1, 1, 8, 30, 0)
+    values = [start + datetime.timedelta(days=day) for day in xrange(distinct_count)]
+    chosen = [random.choice(values) for _ in xrange(entry_count)]
+    return (
+        [value.strftime('%Y-%m-%d') for value in chosen],
+        [value.strftime('%Y-%m-%d %H:%M:%S') for value in chosen]
+    )
+
+def strptime_dates(date_strings):
+    for date_string in date_strings:
+        datetime.datetime.strptime(date_string, '%Y-%m-%d').date()
+
+def strptime_timestamps(timestamp_strings):
+    for timestamp_string in timestamp_strings:
+        datetime.datetime.strptime(timestamp_string, '%Y-%m-%d %H:%M:%S')
+
+def codec_dates(date_strings, clear_cache):
+    decoder = Codec(None)
+    if clear_cache:
+        codec._date_cache.clear()
+    for date_string in date_strings:
+        decoder.decode_date(date_string)
+
+def codec_timestamps(timestamp_strings, clear_cache):
+    decoder = Codec(None)
+    if clear_cache:
+        codec._timestamp_cache.clear()
+    for timestamp_string in timestamp_strings:
+        decoder.decode_timestamp(timestamp_string)
+
+def main():
+    entry_count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    distinct_count = int(sys.argv[2]) if len(sys.argv) > 2 else 300
+    date_strings, timestamp_strings = get_strings(entry_count, distinct_count)
+
+    benchmarks = (
+        ('date: strptime', lambda: strptime_dates(date_strings)),
+        ('date: Codec, cold cache', lambda: codec_dates(date_strings, True)),
+        ('date: Codec, warm cache', lambda: codec_dates(date_strings, False)),
+        ('timestamp: strptime', lambda: strptime_timestamps(timestamp_strings)),
+        ('timestamp: Codec, cold cache', lambda: codec_timestamps(timestamp_strings, True)),
+        ('timestamp: Codec, warm cache', lambda: codec_timestamps(timestamp_strings, False)),
+    )
+
+    print '{} entries, {} distinct values'.format(entry_count, distinct_count)
+    for name, function in benchmarks:
+        seconds = min(timeit.repeat(function, number=1, repeat=5))
+        print '{:<30} {:8.2f} ms'.format(name, seconds * 1000)
+
+if __name__ == '__main__':
+    main()
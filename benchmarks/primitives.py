@@ -0,0 +1,100 @@
+"""
+Micro-benchmark comparing `BinaryObject.to_primitive` with the reflective
+conversion `JSONEncoder.default` used before it - `getattr` over each
+object's `repr_names`, with `OrderedDict`s and `strftime`.
+
+The input mimics a diary response - food entries, each embedding a food with
+nutrients and a couple of portions, over a few hundred distinct dates.
+
+Usage:
+    $ python benchmarks/primitives.py [ENTRY_COUNT] [DISTINCT_DATE_COUNT]
+"""
+
+from collections import OrderedDict
+import cPickle as pickle
+import datetime
+import random
+import sys
+import timeit
+
+from mfpsync.codec.objects import (
+    BinaryObject, Food, FoodEntry, FoodPortion, Nutrients
+)
+
+def get_entries(entry_count, distinct_count):
+    """
+    Return a list of `entry_count` `FoodEntry` objects, dated from
+    `distinct_count` distinct dates.
+    """
+
+    start = datetime.date(2014, 1, 1)
+    dates = [start + datetime.timedelta(days=day) for day in xrange(distinct_count)]
+
+    entries = []
+    for number in xrange(entry_count):
+        food = Food()
+        food.master_food_id = number
+        food.description = 'Food {}'.format(number)
+        food.brand = 'Brand'
+        food.nutrients = Nutrients([float(index) for index in xrange(len(Nutrients.nutrient_names))])
+        food.grams = 100.0
+        for gram_weight in (30.0, 100.0):
+            portion = FoodPortion()
+            portion.amount = 1.0
+            portion.gram_weight = gram_weight
+            portion.description = '{:g} g'.format(gram_weight)
+            food.portions.append(portion)
+
+        entry = FoodEntry()
+        entry.master_food_id = number
+        entry.food = food
+        entry.date = random.choice(dates)
+        entry.meal_name = 'Breakfast'
+        entry.quantity = 1.5
+        entries.append(entry)
+    return entries
+
+def reflective(value):
+    """
+    Convert `value` as `JSONEncoder.default` did, recursively.
+    """
+
+    if isinstance(value, BinaryObject):
+        return OrderedDict((
+            ('type', value.__class__.__name__),
+            ('data', {
+                name: reflective(getattr(value, name))
+                for name in value.repr_names
+            })
+        ))
+    if isinstance(value, Nutrients):
+        return value.to_dict()
+    if isinstance(value, datetime.datetime):
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    if isinstance(value, datetime.date):
+        return value.strftime('%Y-%m-%d')
+    if isinstance(value, (list, tuple)):
+        return [reflective(item) for item in value]
+    return value
+
+def main():
+    entry_count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    distinct_count = int(sys.argv[2]) if len(sys.argv) > 2 else 300
+    entries = get_entries(entry_count, distinct_count)
+
+    benchmarks = (
+        ('reflective', lambda: [reflective(entry) for entry in entries]),
+        ('to_primitive', lambda: [entry.to_primitive() for entry in entries]),
+        ('pickle objects', lambda: pickle.dumps(entries, 2)),
+        ('pickle primitives', lambda: pickle.dumps(
+            [entry.to_primitive() for entry in entries], 2
+        )),
+    )
+
+    print '{} entries, {} distinct dates'.format(entry_count, distinct_count)
+    for name, function in benchmarks:
+        seconds = min(timeit.repeat(function, number=1, repeat=3))
+        print '{:<30} {:8.2f} ms'.format(name, seconds * 1000)
+
+if __name__ == '__main__':
+    main()
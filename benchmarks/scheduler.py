@@ -0,0 +1,313 @@
+"""
+Benchmark comparing `FleetScheduler` with round robin syncing, against a
+local stand-in for the sync API.
+
+The stand-in serves a fleet of accounts, a few busy and most quiet, each
+gaining `MeasurementValue` packets at random times. Its latency grows once
+more than `--capacity` requests are in flight, and it fails requests with
+503 errors beyond three times that. For each packet, it records the lag
+between the packet being added and it being synced - packets still unsynced
+at the end count their age.
+
+Requests and packets within the first `--warmup` seconds aren't measured,
+while the scheduler learns which accounts are busy.
+
+Three strategies sync the fleet for the same duration:
+
+    round robin
+        `BatchSync` cycling through every account, at a fixed concurrency.
+    round robin, rate-matched
+        As above, but limited to the request rate the scheduler used.
+    scheduler
+        `FleetScheduler`, adapting concurrency and prioritising busy
+        accounts.
+
+Usage:
+    $ python benchmarks/scheduler.py [--accounts N] [--duration SECONDS] ...
+"""
+
+import argparse
+import BaseHTTPServer
+import cStringIO
+import random
+import shutil
+import SocketServer
+import tempfile
+import threading
+import time
+
+from mfpsync import Sync
+from mfpsync.batch import Account, BatchSync
+from mfpsync.codec import Codec
+from mfpsync.codec.objects import MeasurementValue, SyncResult
+from mfpsync.http import HttpRequestParams
+from mfpsync.scheduler import FleetScheduler, TokenBucket
+
+class Feed(object):
+    """
+    The packets of a single account, added at random with `rate` per second
+    on average.
+    """
+
+    def __init__(self, rate, duration, rng):
+        self.arrival_times = []
+        arrival_time = rng.expovariate(rate)
+        while arrival_time < duration:
+            self.arrival_times.append(arrival_time)
+            arrival_time += rng.expovariate(rate)
+
+        # Number of packets synced, and their lags in seconds.
+        self.synced_count = 0
+        self.lags = []
+
+    def get_available_count(self, elapsed):
+        """
+        Return the number of packets added within `elapsed` seconds.
+        """
+
+        count = 0
+        for arrival_time in self.arrival_times:
+            if arrival_time > elapsed:
+                break
+            count += 1
+        return count
+
+class StandInServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, feeds, capacity, base_latency, overload_latency, page_size, warmup):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0), StandInHandler)
+        self.feeds = feeds
+        self.capacity = capacity
+        self.base_latency = base_latency
+        self.overload_latency = overload_latency
+        self.page_size = page_size
+        self.warmup = warmup
+
+        self.start_time = time.time()
+        self.in_flight = 0
+        self.request_count = 0
+        self.error_count = 0
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{}/iphone_api/synchronize'.format(self.server_address[1])
+
+    def get_lags(self, end_time):
+        """
+        Return a list of the lags of every packet added between the warmup
+        and `end_time`, counting unsynced packets' ages.
+        """
+
+        elapsed = end_time - self.start_time
+        lags = []
+        for feed in self.feeds.itervalues():
+            lags.extend(feed.lags)
+            for arrival_time in feed.arrival_times[feed.synced_count:]:
+                if arrival_time > elapsed:
+                    break
+                if arrival_time >= self.warmup:
+                    lags.append(elapsed - arrival_time)
+        return lags
+
+class StandInHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        data = body.split('\r\n\r\n', 1)[1].rsplit('\r\n--', 1)[0]
+        sync_request = next(iter(Codec(cStringIO.StringIO(data)).read_packets()))
+
+        server = self.server
+        is_measured = time.time() - server.start_time >= server.warmup
+        with server.lock:
+            server.request_count += is_measured
+            server.in_flight += 1
+            in_flight = server.in_flight
+        try:
+            overload = max(0, in_flight - server.capacity)
+            time.sleep(server.base_latency + server.overload_latency * overload)
+            if in_flight > server.capacity * 3:
+                with server.lock:
+                    server.error_count += is_measured
+                self.respond(503, '')
+                return
+
+            response_data = self.get_response_data(
+                server.feeds[sync_request.username],
+                int(sync_request.last_sync_pointers.get('cursor', 0))
+            )
+            self.respond(200, response_data)
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+    def get_response_data(self, feed, cursor):
+        """
+        Return a response with the page of `feed` packets after `cursor`.
+        """
+
+        server = self.server
+        elapsed = time.time() - server.start_time
+        available_count = feed.get_available_count(elapsed)
+        end = min(available_count, cursor + server.page_size)
+
+        with server.lock:
+            for index in xrange(max(cursor, feed.synced_count), end):
+                if feed.arrival_times[index] >= server.warmup:
+                    feed.lags.append(elapsed - feed.arrival_times[index])
+            feed.synced_count = max(feed.synced_count, end)
+
+        sync_result = SyncResult()
+        sync_result.expected_packet_count = end - cursor
+        sync_result.last_sync_pointers = {'cursor': str(end)}
+        sync_result.more_data_to_sync = end < available_count
+
+        fp = cStringIO.StringIO()
+        codec = Codec(fp)
+        sync_result.write_packet_to_codec(codec)
+        for index in xrange(cursor, end):
+            measurement = MeasurementValue()
+            measurement.master_measurement_id = index
+            measurement.type_name = 'Weight'
+            measurement.value = 70.0
+            measurement.write_packet_to_codec(codec)
+        return fp.getvalue()
+
+    def respond(self, status, data):
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+class RateLimitedSync(Sync):
+    """
+    `Sync` limited by a shared `TokenBucket`, if set.
+    """
+
+    token_bucket = None
+
+    def post_http(self, url, headers, body):
+        if self.token_bucket is not None:
+            self.token_bucket.acquire()
+        return super(RateLimitedSync, self).post_http(url, headers, body)
+
+class RoundRobin(BatchSync):
+    """
+    `BatchSync` run repeatedly over every account, optionally rate limited.
+    """
+
+    token_bucket = None
+
+    def get_sync(self, account):
+        sync = RateLimitedSync(account.username, account.password)
+        sync.connection_pool = self.connection_pool
+        sync.token_bucket = self.token_bucket
+        return sync
+
+    def run_for(self, accounts, duration):
+        end_time = time.time() + duration
+        while time.time() < end_time:
+            self.run(accounts)
+
+def get_feeds(args):
+    rng = random.Random(args.seed)
+    feeds = {}
+    for number in xrange(args.accounts):
+        is_busy = number < args.accounts * args.busy_fraction
+        rate = args.busy_rate if is_busy else args.quiet_rate
+        feeds['user{}'.format(number)] = Feed(rate, (args.warmup + args.duration) * 2, rng)
+    return feeds
+
+def measure(args, name, run):
+    """
+    Run the strategy `run` against a new stand-in server, printing and
+    returning its request rate.
+    """
+
+    server = StandInServer(
+        get_feeds(args), args.capacity, args.base_latency, args.overload_latency,
+        args.page_size, args.warmup
+    )
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    HttpRequestParams.url = server.url
+
+    accounts = [Account(username, 'password') for username in sorted(server.feeds)]
+    output_directory = tempfile.mkdtemp()
+    try:
+        run(accounts, output_directory)
+    finally:
+        shutil.rmtree(output_directory)
+        server.shutdown()
+
+    end_time = time.time()
+    lags = sorted(server.get_lags(end_time))
+    request_rate = server.request_count / (end_time - server.start_time - args.warmup)
+    print '{:<28} {:>8} {:>7.1f} {:>7} {:>8.2f} {:>8.2f} {:>8.2f}'.format(
+        name, server.request_count, request_rate, server.error_count,
+        sum(lags) / len(lags), lags[int(len(lags) * 0.95)], lags[-1]
+    )
+    return request_rate
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--accounts', type=int, default=300)
+    parser.add_argument('--busy-fraction', type=float, default=0.1)
+    parser.add_argument('--busy-rate', type=float, default=0.5,
+                        help='packets per second added to busy accounts')
+    parser.add_argument('--quiet-rate', type=float, default=1 / 120.0,
+                        help='packets per second added to quiet accounts')
+    parser.add_argument('--warmup', type=float, default=30.0)
+    parser.add_argument('--duration', type=float, default=40.0,
+                        help='seconds measured after the warmup')
+    parser.add_argument('--capacity', type=int, default=8,
+                        help='requests in flight before the server slows')
+    parser.add_argument('--base-latency', type=float, default=0.05)
+    parser.add_argument('--overload-latency', type=float, default=0.05,
+                        help='latency added per request in flight beyond --capacity')
+    parser.add_argument('--page-size', type=int, default=20)
+    parser.add_argument('--concurrency', type=int, default=16,
+                        help='round robin concurrency')
+    parser.add_argument('--min-interval', type=float, default=2.0)
+    parser.add_argument('--max-interval', type=float, default=20.0)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    print '{} accounts, {:.0f}% busy, {:.0f}s measured after {:.0f}s warmup'.format(
+        args.accounts, args.busy_fraction * 100, args.duration, args.warmup
+    )
+    print '{:<28} {:>8} {:>7} {:>7} {:>8} {:>8} {:>8}'.format(
+        'strategy', 'requests', 'per sec', 'errors', 'mean lag', 'p95 lag', 'max lag'
+    )
+
+    def round_robin(accounts, output_directory):
+        RoundRobin(output_directory, concurrency=args.concurrency).run_for(
+            accounts, args.warmup + args.duration
+        )
+    measure(args, 'round robin', round_robin)
+
+    def scheduled(accounts, output_directory):
+        scheduler = FleetScheduler(
+            output_directory, max_concurrency=args.concurrency * 2,
+            request_rate=args.accounts
+        )
+        scheduler.min_interval = args.min_interval
+        scheduler.max_interval = args.max_interval
+        scheduler.run(accounts, duration=args.warmup + args.duration)
+    request_rate = measure(args, 'scheduler', scheduled)
+
+    def rate_matched(accounts, output_directory):
+        round_robin = RoundRobin(output_directory, concurrency=args.concurrency)
+        round_robin.token_bucket = TokenBucket(request_rate)
+        round_robin.run_for(accounts, args.warmup + args.duration)
+    measure(args, 'round robin, rate-matched', rate_matched)
+
+if __name__ == '__main__':
+    main()
@@ -11,6 +11,9 @@ setup(
     author='Nathan Reynolds',
     author_email='email@nreynolds.co.uk',
     url='https://github.com/nathforge/mfpsync',
+    extras_require={
+        'tables': ['numpy']
+    },
     entry_points={
         'console_scripts': [
             'mfpsync = mfpsync.main:main'
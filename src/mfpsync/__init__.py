@@ -1,11 +1,9 @@
 import cStringIO
-import shutil
-import urllib2
 import uuid
 
-from mfpsync.codec import Codec
-from mfpsync.codec.objects import SyncRequest
-from mfpsync.http import HttpRequestParams
+from mfpsync.codec import Codec, StreamCodec, get_packet_types
+from mfpsync.codec.objects import SyncRequest, SyncResult
+from mfpsync.http import DecompressingReader, HttpRequestParams, default_connection_pool
 
 class Sync(object):
     """
@@ -16,8 +14,8 @@ class Sync(object):
         ...     print packet
 
     To aid debugging, `save_response_fp` can be set. This will save the
-    response data before further processing. This data can be passed to a
-    `Codec` object for offline testing. Example:
+    response data as it's received. This data can be passed to a `Codec`
+    object for offline testing. Example:
 
         >>> sync = Sync(username, password)
         >>> with open('/tmp/response', 'wb') as sync.save_response_fp:
@@ -25,10 +23,39 @@ class Sync(object):
         ...         print packet
     """
 
-    # If set, responses will be saved to this file object before processing.
+    # If set, responses will be saved to this file object as they're read.
     # Useful for debugging.
     save_response_fp = None
 
+    # If set, responses are requested with gzip or deflate compression, and
+    # decompressed as they're read.
+    compress = False
+
+    # If set, compressed responses are saved to `save_response_fp` as
+    # received rather than decompressed.
+    save_compressed_response = False
+
+    # Optional `mfpsync.codec.cache.StringTable`. If set, repeated strings in
+    # responses are decoded once and shared.
+    string_table = None
+
+    # Optional `mfpsync.codec.cache.FoodRegistry`. If set, identical foods
+    # embedded in `FoodEntry` packets are decoded once and shared.
+    food_registry = None
+
+    # Optional dict mapping `BinaryPacket` subclasses to the attribute names
+    # to decode, e.g. `{FoodEntry: ('date', 'quantity', 'food.nutrients')}`.
+    # See `Codec.projections`.
+    projections = None
+
+    # Optional `mfpsync.codec.cache.PacketCache`. If set, packets identical to
+    # ones already decoded are copied from the cache.
+    packet_cache = None
+
+    # `ConnectionPool` used for HTTP requests. Shared between `Sync` objects
+    # by default, so connections are kept alive across pages and users.
+    connection_pool = default_connection_pool
+
     def __init__(self, username, password, installation_uuid=None):
         """
         Create a `Sync` object for the given user. Optionally takes an
@@ -40,13 +67,41 @@ class Sync(object):
         self.password = password
         self.installation_uuid = installation_uuid or uuid.uuid4()
 
-    def get_packets(self, last_sync_pointers={}):
+    def get_packets(self, last_sync_pointers={}, types=None):
         """
         Returns an iterator yielding decoded packets from the sync API.
 
         If given an optional `last_sync_pointers` as returned in the
         `SyncResultPacket` of a previous sync call, a partial sync will be
         performed. Otherwise, all data will be returned.
+
+        If given an optional `types` - an iterable of `BinaryPacket`
+        subclasses or `packet_type` numbers - only packets of those types are
+        decoded and returned.
+        """
+
+        response_data_fp, save_response_fp = self.get_response(last_sync_pointers)
+        for packet in self.decode_response(response_data_fp, save_response_fp, types):
+            yield packet
+
+    def get_response(self, last_sync_pointers={}):
+        """
+        Call the sync API. Returns a `(response_data_fp, save_response_fp)`
+        tuple - see `open_response`.
+        """
+
+        http_request_params = self.get_request_params(last_sync_pointers)
+
+        # Call the API.
+        response_code, response_headers, response_data_fp = self.post_http(
+            http_request_params.url, http_request_params.headers, http_request_params.body
+        )
+
+        return self.open_response(response_headers, response_data_fp)
+
+    def get_request_params(self, last_sync_pointers={}):
+        """
+        Return the `HttpRequestParams` for a sync API request.
         """
 
         # Write a `SyncRequest` packet to `request_data_fp`.
@@ -60,27 +115,49 @@ class Sync(object):
         sync_request.write_packet_to_codec(encoder)
 
         # Create `HttpRequestParams` from the encoded `SyncRequest`.
-        http_request_params = HttpRequestParams(request_data_fp.getvalue())
+        return HttpRequestParams(request_data_fp.getvalue(), compress=self.compress)
 
-        # Call the API.
-        response_code, response_headers, response_data_fp = self.post_http(
-            http_request_params.url, http_request_params.headers, http_request_params.body
-        )
+    def open_response(self, response_headers, response_data_fp):
+        """
+        Given the headers and body file object of a sync API response, return
+        a `(response_data_fp, save_response_fp)` tuple - a file object reading
+        the response, decompressed if the server compressed it, and the file
+        object the decompressed response should be saved to as it's read, if
+        any. See `decode_response`.
+        """
 
-        # Create a StringIO from the response data, as `Codec` requires a
-        # `tell()` method.
-        response_data_fp = cStringIO.StringIO(response_data_fp.read())
+        # Decompress the response as it's read, if the server compressed it.
+        save_response_fp = self.save_response_fp
+        content_encoding = response_headers.get('Content-Encoding', 'identity').strip().lower()
+        if content_encoding != 'identity':
+            response_data_fp = DecompressingReader(
+                response_data_fp, content_encoding,
+                tee_fp=save_response_fp if self.save_compressed_response else None
+            )
+            if self.save_compressed_response:
+                save_response_fp = None
 
-        # If requested, save this response to `self.save_response_fp` before
-        # processing.
-        if self.save_response_fp:
-            shutil.copyfileobj(response_data_fp, self.save_response_fp)
-            response_data_fp.seek(0)
+        return response_data_fp, save_response_fp
 
-        # Yield decoded packets.
-        decoder = Codec(response_data_fp)
-        for packet in decoder.read_packets():
-            yield packet
+    def decode_response(self, response_data_fp, save_response_fp=None, types=None):
+        """
+        Returns an iterator yielding decoded packets read from the file object
+        `response_data_fp`, which is closed once read. If `save_response_fp`
+        is given, the response is also saved to it as it's read. `types` is
+        as for `get_packets`.
+        """
+
+        # Yield packets as they're received.
+        decoder = StreamCodec(response_data_fp, tee_fp=save_response_fp)
+        decoder.string_table = self.string_table
+        decoder.food_registry = self.food_registry
+        decoder.projections = self.projections
+        decoder.packet_cache = self.packet_cache
+        try:
+            for packet in decoder.read_packets(types):
+                yield packet
+        finally:
+            response_data_fp.close()
 
     def post_http(self, url, headers, body):
         """
@@ -88,16 +165,62 @@ class Sync(object):
         response headers, and the response body as a file object.
         """
 
-        request = urllib2.Request(url)
+        response = self.connection_pool.request('POST', url, headers, body)
 
-        for key, value in headers.iteritems():
-            request.add_header(key, value)
+        return response.getcode(), response.headers, response
 
-        request.add_data(body)
+class AllPackets(object):
+    def __init__(self, sync, last_sync_pointers={}, types=None):
+        self.sync = sync
+        self.last_sync_pointers = last_sync_pointers
 
-        response = urllib2.urlopen(request)
+        # `SyncResult` of the current page.
+        self.sync_result = None
 
-        return response.getcode(), response.headers, response
+        # `SyncResult` packets are always requested, as they're needed to
+        # fetch the next page - but are only yielded if wanted.
+        self.wanted_types = get_packet_types(types) if types is not None else None
+        self.request_types = None
+        if self.wanted_types is not None:
+            self.request_types = self.wanted_types | {SyncResult.packet_type}
+
+    def __iter__(self):
+        for page in self.pages():
+            for packet in page:
+                yield packet
+
+    def pages(self):
+        """
+        Return an iterator yielding an iterator of packets for each page.
+
+        Each page must be read to the end before the next is requested. Its
+        `SyncResult` is then available as `sync_result`, and
+        `last_sync_pointers` is updated once the next page is requested.
+        """
+
+        while True:
+            self.sync_result = None
+            yield self.read_page()
+
+            self.last_sync_pointers = self.sync_result.last_sync_pointers
+            if not self.sync_result.more_data_to_sync:
+                break
+
+    def read_page(self):
+        """
+        Return an iterator yielding the packets of the next page.
+        """
+
+        packets = self.sync.get_packets(
+            last_sync_pointers=self.last_sync_pointers, types=self.request_types
+        )
+        for packet in packets:
+            if isinstance(packet, SyncResult):
+                self.sync_result = packet
+                if self.wanted_types is not None \
+                        and SyncResult.packet_type not in self.wanted_types:
+                    continue
+            yield packet
 
 if __name__ == '__main__':
     """
@@ -0,0 +1,1367 @@
+"""
+Non-blocking sync client, for syncing many accounts from a single thread.
+
+`AsyncSync` is the counterpart to `Sync`, and `AsyncAllPackets` to
+`mfpsync.AllPackets`. Requests are made over non-blocking sockets by an
+`EventLoop`, and large responses are decoded by an executor thread pool once
+received, so the loop stays responsive.
+
+Coroutines are generators run as a `Task`. They yield a `Future` to wait for
+its result, and raise `Return` to return a value. Example:
+
+    >>> loop = EventLoop()
+    >>> def sync_user(username, password):
+    ...     all_packets = AsyncAllPackets(AsyncSync(Sync(username, password), loop))
+    ...     while True:
+    ...         packets = yield all_packets.next_page()
+    ...         if packets is None:
+    ...             break
+    ...         for packet in packets:
+    ...             print packet
+    >>> tasks = [Task(loop, sync_user(username, password)) for username, password in accounts]
+    >>> loop.run_until_complete(gather(loop, tasks))
+
+Requests are made by a transport - by default a `SocketTransport`. Any object
+with a `request(method, url, headers, body)` method returning a `Future` of
+an `HttpResponse` can be used instead, e.g. to serve saved responses. Response
+bodies are a `BodyStream`, which can be read as it arrives.
+"""
+
+import collections
+import cStringIO
+import errno
+import fcntl
+import heapq
+import httplib
+from multiprocessing.pool import ThreadPool
+import os
+import select
+import socket
+import ssl
+import sys
+import threading
+import time
+import urllib2
+import urlparse
+import weakref
+
+from mfpsync.codec import get_packet_types
+from mfpsync.codec.objects import SyncResult
+
+# `socket.error` numbers meaning an operation would block.
+WOULD_BLOCK_ERRORS = (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINPROGRESS)
+
+class CancelledError(Exception):
+    """
+    Raised by a cancelled `Future`, and within a cancelled `Task`'s
+    coroutine.
+    """
+
+class Return(Exception):
+    """
+    Raised by a coroutine to return `value`.
+    """
+
+    def __init__(self, value=None):
+        super(Return, self).__init__(value)
+        self.value = value
+
+class Future(object):
+    """
+    The result of an operation that hasn't necessarily completed. Callbacks
+    added with `add_done_callback` are called on `loop` once it has.
+    """
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.callbacks = []
+        self._done = False
+        self._result = None
+
+        # `sys.exc_info()` style tuple, if the operation failed.
+        self._exc_info = None
+
+    def done(self):
+        return self._done
+
+    def result(self):
+        """
+        Return the result, or raise the exception, of a completed future.
+        """
+
+        if not self._done:
+            raise Exception('Future is not done')
+        if self._exc_info is not None:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+        return self._result
+
+    def exception(self):
+        """
+        Return the exception of a completed future, or `None`.
+        """
+
+        if not self._done:
+            raise Exception('Future is not done')
+        return self._exc_info[1] if self._exc_info is not None else None
+
+    def add_done_callback(self, callback):
+        """
+        Call `callback` with the future once it's done.
+        """
+
+        if self._done:
+            self.loop.call_soon(callback, self)
+        else:
+            self.callbacks.append(callback)
+
+    def set_result(self, result):
+        self._result = result
+        self._finish()
+
+    def set_exception(self, exception):
+        self.set_exc_info((type(exception), exception, None))
+
+    def set_exc_info(self, exc_info):
+        self._exc_info = exc_info
+        self._finish()
+
+    def cancel(self):
+        """
+        Fail the future with `CancelledError`, unless it's done. Returns
+        whether it was cancelled.
+        """
+
+        if self._done:
+            return False
+        self.set_exception(CancelledError())
+        return True
+
+    def _finish(self):
+        if self._done:
+            raise Exception('Future is already done')
+        self._done = True
+        callbacks, self.callbacks = self.callbacks, []
+        for callback in callbacks:
+            self.loop.call_soon(callback, self)
+
+class Task(Future):
+    """
+    Runs the coroutine `generator` on `loop`, completing with its result.
+    """
+
+    def __init__(self, loop, generator):
+        super(Task, self).__init__(loop)
+        self.generator = generator
+
+        # `Future` the coroutine is waiting for.
+        self.waiting = None
+
+        loop.call_soon(self._step, None, None)
+
+    def cancel(self):
+        """
+        Raise `CancelledError` within the coroutine, at the point it's
+        waiting, and cancel the future it's waiting for. Returns whether the
+        task is still running.
+        """
+
+        if self._done:
+            return False
+        waiting, self.waiting = self.waiting, None
+        if waiting is not None:
+            waiting.cancel()
+        self.loop.call_soon(self._step, None, (CancelledError, CancelledError(), None))
+        return True
+
+    def _step(self, value, exc_info):
+        if self._done:
+            return
+
+        self.waiting = None
+        try:
+            if exc_info is not None:
+                future = self.generator.throw(*exc_info)
+            else:
+                future = self.generator.send(value)
+        except StopIteration:
+            self.set_result(None)
+        except Return as return_:
+            self.set_result(return_.value)
+        except Exception:
+            self.set_exc_info(sys.exc_info())
+        else:
+            if not isinstance(future, Future):
+                self.loop.call_soon(self._step, None, (
+                    TypeError, TypeError('Coroutine yielded {!r}, not a Future'.format(future)), None
+                ))
+                return
+            self.waiting = future
+            future.add_done_callback(self._wakeup)
+
+    def _wakeup(self, future):
+        if future is not self.waiting:
+            return
+        if future._exc_info is not None:
+            self._step(None, future._exc_info)
+        else:
+            self._step(future._result, None)
+
+def gather(loop, futures):
+    """
+    Return a `Future` of a list of the results of `futures`, once all are
+    done. Fails with the first exception, in order.
+    """
+
+    futures = list(futures)
+    gathered = Future(loop)
+    remaining = [len(futures)]
+
+    def on_done(future):
+        remaining[0] -= 1
+        if not remaining[0]:
+            try:
+                gathered.set_result([item.result() for item in futures])
+            except Exception:
+                gathered.set_exc_info(sys.exc_info())
+
+    if not futures:
+        gathered.set_result([])
+    for future in futures:
+        future.add_done_callback(on_done)
+    return gathered
+
+def wait_for(loop, future, timeout):
+    """
+    Return a `Future` of the result of `future`, failing with
+    `socket.timeout` and cancelling `future` if it isn't done within
+    `timeout` seconds.
+    """
+
+    waited = Future(loop)
+
+    def on_timeout():
+        if not waited.done():
+            waited.set_exception(socket.timeout('timed out'))
+            future.cancel()
+
+    def on_done(future):
+        timer.cancel()
+        if waited.done():
+            return
+        if future._exc_info is not None:
+            waited.set_exc_info(future._exc_info)
+        else:
+            waited.set_result(future._result)
+
+    timer = loop.call_later(timeout, on_timeout)
+    future.add_done_callback(on_done)
+    return waited
+
+def call_function(function, args):
+    """
+    Call `function` with `args`, returning a `(succeeded, result)` tuple -
+    `result` is a `sys.exc_info()` tuple on failure. Runs in an executor
+    thread.
+    """
+
+    try:
+        return True, function(*args)
+    except Exception:
+        return False, sys.exc_info()
+
+class Timer(object):
+    """
+    A callback scheduled by `EventLoop.call_later`.
+    """
+
+    def __init__(self, when, callback, args):
+        self.when = when
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+class EventLoop(object):
+    """
+    Runs callbacks as sockets become readable or writable, as timers expire,
+    and as executor jobs complete. Uses `select.poll` where available, and
+    `select.select` otherwise.
+
+    Not thread-safe, other than `call_soon_threadsafe`.
+    """
+
+    # Number of threads in the default executor, created on first use.
+    default_executor_size = 4
+
+    def __init__(self):
+        self.ready = collections.deque()
+        self.timers = []
+        self.timer_count = 0
+
+        # Dicts mapping file descriptors to `(callback, args)` tuples.
+        self.readers = {}
+        self.writers = {}
+
+        self.poller = select.poll() if hasattr(select, 'poll') else None
+        self.running = False
+        self.default_executor = None
+
+        # `call_soon_threadsafe` writes to a pipe to wake the loop.
+        self.lock = threading.Lock()
+        self.threadsafe_calls = []
+        self.wakeup_read_fd, self.wakeup_write_fd = os.pipe()
+        for fd in (self.wakeup_read_fd, self.wakeup_write_fd):
+            set_nonblocking(fd)
+        self.add_reader(self.wakeup_read_fd, self._wakeup)
+
+    def call_soon(self, callback, *args):
+        """
+        Call `callback` with `args` on the next iteration of the loop.
+        """
+
+        self.ready.append((callback, args))
+
+    def call_soon_threadsafe(self, callback, *args):
+        """
+        As `call_soon`, but may be called from any thread.
+        """
+
+        with self.lock:
+            self.threadsafe_calls.append((callback, args))
+        try:
+            os.write(self.wakeup_write_fd, 'x')
+        except OSError as error:
+            if error.errno not in WOULD_BLOCK_ERRORS:
+                raise
+
+    def call_later(self, delay, callback, *args):
+        """
+        Call `callback` with `args` after `delay` seconds. Returns a `Timer`,
+        which can be cancelled.
+        """
+
+        timer = Timer(time.time() + delay, callback, args)
+        self.timer_count += 1
+        heapq.heappush(self.timers, (timer.when, self.timer_count, timer))
+        return timer
+
+    def add_reader(self, fd, callback, *args):
+        """
+        Call `callback` with `args` whenever the file descriptor `fd` is
+        readable, until `remove_reader` is called.
+        """
+
+        self.readers[fd] = (callback, args)
+        self._update(fd)
+
+    def remove_reader(self, fd):
+        if self.readers.pop(fd, None) is not None:
+            self._update(fd)
+
+    def add_writer(self, fd, callback, *args):
+        """
+        Call `callback` with `args` whenever the file descriptor `fd` is
+        writable, until `remove_writer` is called.
+        """
+
+        self.writers[fd] = (callback, args)
+        self._update(fd)
+
+    def remove_writer(self, fd):
+        if self.writers.pop(fd, None) is not None:
+            self._update(fd)
+
+    def run_in_executor(self, executor, function, *args):
+        """
+        Call `function` with `args` in `executor`, returning a `Future` of
+        the result. `executor` is a thread pool as
+        `multiprocessing.pool.ThreadPool`, or `None` for the default executor.
+        """
+
+        if executor is None:
+            if self.default_executor is None:
+                self.default_executor = ThreadPool(self.default_executor_size)
+            executor = self.default_executor
+
+        future = Future(self)
+
+        def on_complete(outcome):
+            self.call_soon_threadsafe(self._set_outcome, future, outcome)
+
+        executor.apply_async(call_function, (function, args), callback=on_complete)
+        return future
+
+    def run_until_complete(self, future):
+        """
+        Run the loop until `future` is done, returning its result.
+        """
+
+        self.running = True
+        try:
+            while not future.done():
+                self.run_once()
+        finally:
+            self.running = False
+        return future.result()
+
+    def run_once(self):
+        """
+        Wait for, and run, the next ready callbacks.
+        """
+
+        timeout = None
+        if self.ready:
+            timeout = 0
+        elif self.timers:
+            timeout = max(0, self.timers[0][0] - time.time())
+
+        # Handlers are looked up as they're called, as earlier handlers may
+        # remove them.
+        for fd, is_readable, is_writable in self._poll(timeout):
+            if is_readable and fd in self.readers:
+                callback, args = self.readers[fd]
+                callback(*args)
+            if is_writable and fd in self.writers:
+                callback, args = self.writers[fd]
+                callback(*args)
+
+        now = time.time()
+        while self.timers and self.timers[0][0] <= now:
+            _, _, timer = heapq.heappop(self.timers)
+            if not timer.cancelled:
+                self.ready.append((timer.callback, timer.args))
+
+        for _ in xrange(len(self.ready)):
+            callback, args = self.ready.popleft()
+            callback(*args)
+
+    def close(self):
+        """
+        Close the loop's pipe, and the default executor.
+        """
+
+        self.remove_reader(self.wakeup_read_fd)
+        os.close(self.wakeup_read_fd)
+        os.close(self.wakeup_write_fd)
+        if self.default_executor is not None:
+            self.default_executor.close()
+            self.default_executor.join()
+            self.default_executor = None
+
+    def _set_outcome(self, future, outcome):
+        succeeded, result = outcome
+        if future.done():
+            return
+        if succeeded:
+            future.set_result(result)
+        else:
+            future.set_exc_info(result)
+
+    def _wakeup(self):
+        try:
+            while os.read(self.wakeup_read_fd, 4096):
+                pass
+        except OSError as error:
+            if error.errno not in WOULD_BLOCK_ERRORS:
+                raise
+
+        with self.lock:
+            calls, self.threadsafe_calls = self.threadsafe_calls, []
+        self.ready.extend(calls)
+
+    def _update(self, fd):
+        """
+        Update the poll registration of `fd`.
+        """
+
+        if self.poller is None:
+            return
+
+        events = 0
+        if fd in self.readers:
+            events |= select.POLLIN
+        if fd in self.writers:
+            events |= select.POLLOUT
+
+        if events:
+            self.poller.register(fd, events)
+        else:
+            try:
+                self.poller.unregister(fd)
+            except KeyError:
+                pass
+
+    def _poll(self, timeout):
+        """
+        Return a list of `(fd, is_readable, is_writable)` tuples, waiting up
+        to `timeout` seconds - or indefinitely if `None`.
+        """
+
+        try:
+            if self.poller is not None:
+                events = self.poller.poll(None if timeout is None else timeout * 1000)
+                return [
+                    (
+                        fd,
+                        bool(event & (select.POLLIN | select.POLLHUP | select.POLLERR)),
+                        bool(event & (select.POLLOUT | select.POLLHUP | select.POLLERR))
+                    )
+                    for fd, event in events
+                ]
+
+            readable, writable, _ = select.select(
+                self.readers.keys(), self.writers.keys(), [], timeout
+            )
+        except (select.error, IOError, OSError) as error:
+            if error.args[0] == errno.EINTR:
+                return []
+            raise
+
+        return (
+            [(fd, True, False) for fd in readable] +
+            [(fd, False, True) for fd in writable]
+        )
+
+def set_nonblocking(fd):
+    """
+    Put the file descriptor `fd` in non-blocking mode.
+    """
+
+    fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+
+class Connection(object):
+    """
+    A non-blocking socket connection, read and written via futures.
+
+    If `timeout` is given, an operation waiting that many seconds for the
+    socket fails with `socket.timeout` - so the limit applies to each read or
+    write making no progress, rather than to a whole response.
+    """
+
+    def __init__(self, loop, key, sock, timeout=None):
+        self.loop = loop
+        self.key = key
+        self.sock = sock
+        self.fd = sock.fileno()
+        self.timeout = timeout
+        self.buffer = ''
+        self.bytes_received = 0
+
+        # `Future` of the pending operation, failed if the connection is
+        # closed meanwhile.
+        self.pending = None
+
+        # Time the pending operation times out, checked by `self.timer` - one
+        # timer per connection, rather than one per wait.
+        self.deadline = None
+        self.timer = None
+
+    def recv(self, byte_count=65536):
+        """
+        Return a `Future` of up to `byte_count` bytes, or `''` at the end of
+        the stream. Data already buffered is returned first.
+        """
+
+        future = Future(self.loop)
+        if self.buffer:
+            data, self.buffer = self.buffer[:byte_count], self.buffer[byte_count:]
+            future.set_result(data)
+        else:
+            self._attempt(future, lambda: self._count(self.sock.recv(byte_count)), True)
+        return future
+
+    def send(self, data):
+        """
+        Return a `Future` of the number of bytes of `data` sent.
+        """
+
+        future = Future(self.loop)
+        self._attempt(future, lambda: self.sock.send(data), False)
+        return future
+
+    def send_all(self, data):
+        """
+        Return a `Future`, done once all of `data` is sent.
+        """
+
+        return Task(self.loop, self._send_all(data))
+
+    def read_until(self, delimiter):
+        """
+        Return a `Future` of the data up to and including `delimiter`.
+        """
+
+        return Task(self.loop, self._read_until(delimiter))
+
+    def read_exactly(self, byte_count):
+        """
+        Return a `Future` of the next `byte_count` bytes.
+        """
+
+        return Task(self.loop, self._read_exactly(byte_count))
+
+    def close(self):
+        """
+        Close the connection, failing any pending operation.
+        """
+
+        self.loop.remove_reader(self.fd)
+        self.loop.remove_writer(self.fd)
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        pending, self.pending = self.pending, None
+        if pending is not None and not pending.done():
+            pending.set_exception(socket.error(errno.EBADF, 'Connection closed'))
+        self.sock.close()
+
+    def wait(self, is_reading):
+        """
+        Return a `Future`, done once the socket is readable - or writable, if
+        `is_reading` is false.
+        """
+
+        future = Future(self.loop)
+        self._wait(future, lambda: None, is_reading)
+        return future
+
+    def _count(self, data):
+        self.bytes_received += len(data)
+        return data
+
+    def _attempt(self, future, operation, is_reading):
+        """
+        Complete `future` with the result of `operation`, waiting for the
+        socket first if it would block.
+        """
+
+        try:
+            result = operation()
+        except ssl.SSLWantReadError:
+            self._wait(future, operation, True)
+        except ssl.SSLWantWriteError:
+            self._wait(future, operation, False)
+        except socket.error as error:
+            if error.errno not in WOULD_BLOCK_ERRORS:
+                future.set_exc_info(sys.exc_info())
+            else:
+                self._wait(future, operation, is_reading)
+        else:
+            self.pending = None
+            future.set_result(result)
+
+    def _wait(self, future, operation, is_reading):
+        self.pending = future
+        if self.timeout is not None:
+            self.deadline = time.time() + self.timeout
+            if self.timer is None:
+                self.timer = self.loop.call_later(self.timeout, self._check_timeout)
+
+        def on_ready():
+            remove(self.fd)
+            if not future.done():
+                self._attempt(future, operation, is_reading)
+
+        if is_reading:
+            remove = self.loop.remove_reader
+            self.loop.add_reader(self.fd, on_ready)
+        else:
+            remove = self.loop.remove_writer
+            self.loop.add_writer(self.fd, on_ready)
+
+    def _check_timeout(self):
+        """
+        Fail the pending operation with `socket.timeout` if it's past
+        `self.deadline`, or check again at the deadline.
+        """
+
+        self.timer = None
+        pending = self.pending
+        if pending is None or pending.done():
+            return
+
+        remaining = self.deadline - time.time()
+        if remaining > 0:
+            self.timer = self.loop.call_later(remaining, self._check_timeout)
+            return
+
+        self.loop.remove_reader(self.fd)
+        self.loop.remove_writer(self.fd)
+        self.pending = None
+        pending.set_exception(socket.timeout('timed out'))
+
+    def _send_all(self, data):
+        offset = 0
+        while offset < len(data):
+            offset += yield self.send(data[offset:])
+
+    def _read_until(self, delimiter):
+        data = ''
+        while True:
+            chunk = yield self.recv()
+            if not chunk:
+                raise httplib.IncompleteRead(data)
+            data += chunk
+            index = data.find(delimiter)
+            if index != -1:
+                index += len(delimiter)
+                self.buffer = data[index:] + self.buffer
+                raise Return(data[:index])
+
+    def _read_exactly(self, byte_count):
+        chunks = []
+        length = 0
+        while length < byte_count:
+            chunk = yield self.recv(byte_count - length)
+            if not chunk:
+                raise httplib.IncompleteRead(''.join(chunks), byte_count - length)
+            chunks.append(chunk)
+            length += len(chunk)
+        raise Return(''.join(chunks))
+
+class BodyStream(object):
+    """
+    File-like object reading an HTTP response body as it arrives, so a large
+    response can be decoded while it's still being received.
+
+    The body is fed in on the loop, by the transport. `read` blocks until
+    data arrives, so is called from another thread - such as an executor's -
+    or on the loop once `wait_complete`'s future is done. Up to `max_buffered`
+    unread bytes are held; the transport then waits for the reader to catch up
+    rather than reading further ahead.
+    """
+
+    max_buffered = 262144
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.condition = threading.Condition()
+        self.eof = False
+        self.closed = False
+
+        # `sys.exc_info()` style tuple, if the body couldn't be read.
+        self.exc_info = None
+
+        # Data not yet read, as a deque of strings - the first read from
+        # `self.offset` - totalling `self.buffered_count` bytes.
+        self.chunks = collections.deque()
+        self.offset = 0
+        self.buffered_count = 0
+
+        # Futures waiting for the reader to catch up, and returned by
+        # `wait_complete`.
+        self.drained = None
+        self.completed = None
+
+    def feed(self, data):
+        """
+        Add `data` to the end of the body. Returns a `Future`, done once more
+        can be fed.
+        """
+
+        future = Future(self.loop)
+        with self.condition:
+            if data and not self.closed:
+                self.chunks.append(data)
+                self.buffered_count += len(data)
+                self.condition.notify()
+            if self._has_room():
+                future.set_result(None)
+            else:
+                self.drained = future
+        return future
+
+    def feed_eof(self):
+        """
+        Mark the end of the body.
+        """
+
+        with self.condition:
+            self.eof = True
+            self.condition.notify_all()
+        self._complete()
+
+    def set_exc_info(self, exc_info):
+        """
+        Fail the body with the `sys.exc_info()` style tuple `exc_info`, which
+        is raised by reads from then on.
+        """
+
+        with self.condition:
+            self.exc_info = exc_info
+            self.condition.notify_all()
+        self._complete()
+
+    def wait_complete(self):
+        """
+        Return a `Future`, done once the whole body has been fed - which may
+        then be read on the loop. The body is no longer limited to
+        `max_buffered` bytes.
+        """
+
+        with self.condition:
+            self.max_buffered = None
+        self._drain()
+
+        if self.completed is None:
+            self.completed = Future(self.loop)
+            if self.eof or self.exc_info is not None:
+                self._complete()
+        return self.completed
+
+    def read(self, byte_count=None):
+        """
+        Return up to `byte_count` bytes, or the rest of the body if
+        `byte_count` is omitted, waiting for at least one byte unless at the
+        end of the body.
+        """
+
+        with self.condition:
+            while not (self.eof or self.closed or self.exc_info is not None) and \
+                    (not self.buffered_count or byte_count is None):
+                self.condition.wait()
+            if self.exc_info is not None:
+                raise self.exc_info[0], self.exc_info[1], self.exc_info[2]
+
+            if byte_count is None or byte_count >= self.buffered_count:
+                byte_count = self.buffered_count
+
+            chunks = self.chunks
+            parts = []
+            remaining = byte_count
+            while remaining:
+                chunk = chunks[0]
+                end = self.offset + remaining
+                if end < len(chunk):
+                    parts.append(chunk[self.offset:end])
+                    self.offset = end
+                    break
+                parts.append(chunk[self.offset:] if self.offset else chunk)
+                remaining -= len(chunk) - self.offset
+                chunks.popleft()
+                self.offset = 0
+
+            self.buffered_count -= byte_count
+            is_drained = self.drained is not None and self._has_room()
+
+        if is_drained:
+            self.loop.call_soon_threadsafe(self._drain)
+        return parts[0] if len(parts) == 1 else ''.join(parts)
+
+    def close(self):
+        """
+        Discard the rest of the body. If the body hasn't been fed in full, the
+        transport stops reading it.
+        """
+
+        with self.condition:
+            self.closed = True
+            self.chunks.clear()
+            self.offset = 0
+            self.buffered_count = 0
+            self.condition.notify_all()
+            is_waiting = self.drained is not None
+        if is_waiting:
+            self.loop.call_soon_threadsafe(self._drain)
+
+    def _drain(self):
+        """
+        Wake the feeder, if the reader has caught up. Called on the loop.
+        """
+
+        with self.condition:
+            drained = self.drained
+            if drained is None or not self._has_room():
+                return
+            self.drained = None
+        if not drained.done():
+            drained.set_result(None)
+
+    def _has_room(self):
+        """
+        Return whether more data may be fed. Called with `self.condition`
+        held.
+        """
+
+        return self.closed or self.max_buffered is None \
+            or self.buffered_count < self.max_buffered
+
+    def _complete(self):
+        """
+        Complete the future returned by `wait_complete`, if any. Called on the
+        loop.
+        """
+
+        completed = self.completed
+        if completed is None or completed.done():
+            return
+        if self.exc_info is not None:
+            completed.set_exc_info(self.exc_info)
+        else:
+            completed.set_result(None)
+
+class HttpResponse(object):
+    """
+    An HTTP response. `headers` is a `httplib.HTTPMessage`, and `body` a
+    `BodyStream`, which may still be receiving the body.
+    """
+
+    def __init__(self, status, reason, headers, body):
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self.body = body
+
+class SocketTransport(object):
+    """
+    Makes HTTP/1.1 requests over non-blocking sockets on an `EventLoop`.
+
+    As with `mfpsync.http.ConnectionPool`, connections are kept alive and
+    reused between requests to the same scheme, host and port. Up to
+    `max_size` idle connections are kept per host, and are discarded after
+    `idle_timeout` seconds unused.
+
+    Responses are returned once their headers are read, and their bodies are
+    read into `HttpResponse.body` as the reader consumes them. The connection
+    is reused once the body has been read to the end.
+
+    Host names are resolved by a thread pool of `resolver_size` threads, kept
+    apart from the loop's default executor so lookups for new connections
+    don't wait behind decoding.
+    """
+
+    # Seconds to wait for a host name to resolve, a connection to be made, or
+    # any single read or write to make progress, before failing with
+    # `socket.timeout`. A slow response that keeps arriving doesn't time out.
+    timeout = 60
+
+    # Bytes to read from the socket at a time, for bodies.
+    read_size = 65536
+
+    # `ssl.SSLContext` for https connections, or `None` for
+    # `ssl.create_default_context()`.
+    ssl_context = None
+
+    # Number of threads resolving host names, created on first use.
+    resolver_size = 4
+
+    def __init__(self, loop, max_size=4, idle_timeout=60):
+        self.loop = loop
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.resolver = None
+
+        # Dict mapping `(scheme, host, port)` tuples to a list of
+        # `(connection, released_at)` tuples, most recently released last.
+        self.idle_connections = {}
+
+    def request(self, method, url, headers, body=''):
+        """
+        Make an HTTP request, returning a `Future` of an `HttpResponse`.
+        Fails with a `urllib2.HTTPError` for non-2xx responses.
+
+        If the server closed a reused connection without responding, the
+        request is retried once on a new connection.
+        """
+
+        return Task(self.loop, self._request(method, url, headers, body))
+
+    def clear(self):
+        """
+        Close all idle connections, and the resolver's threads once their
+        lookups finish.
+        """
+
+        idle_connections, self.idle_connections = self.idle_connections, {}
+        for connections in idle_connections.itervalues():
+            for connection, _ in connections:
+                connection.close()
+
+        if self.resolver is not None:
+            self.resolver.close()
+            self.resolver = None
+
+    def get_idle_connection(self, key):
+        """
+        Return an idle connection for `key`, or `None`.
+        """
+
+        now = time.time()
+        idle_connections = self.idle_connections.get(key, [])
+        while idle_connections:
+            connection, released_at = idle_connections.pop()
+            if now - released_at < self.idle_timeout:
+                return connection
+            connection.close()
+        return None
+
+    def release_connection(self, connection):
+        """
+        Return `connection` to the pool, closing it if the pool is full.
+        """
+
+        idle_connections = self.idle_connections.setdefault(connection.key, [])
+        if len(idle_connections) < self.max_size:
+            idle_connections.append((connection, time.time()))
+        else:
+            connection.close()
+
+    def connect(self, key):
+        """
+        Return a `Future` of a new `Connection` for `key`.
+        """
+
+        return Task(self.loop, self._connect(key))
+
+    def _connect(self, key):
+        scheme, host, port = key
+        if self.resolver is None:
+            self.resolver = ThreadPool(self.resolver_size)
+        addresses = yield wait_for(self.loop, self.loop.run_in_executor(
+            self.resolver, socket.getaddrinfo, host, port, 0, socket.SOCK_STREAM
+        ), self.timeout)
+        family, socket_type, protocol, _, address = addresses[0]
+
+        sock = socket.socket(family, socket_type, protocol)
+        sock.setblocking(False)
+        connection = Connection(self.loop, key, sock, self.timeout)
+        try:
+            error = sock.connect_ex(address)
+            if error and error not in WOULD_BLOCK_ERRORS:
+                raise socket.error(error, os.strerror(error))
+            yield connection.wait(False)
+            error = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+            if error:
+                raise socket.error(error, os.strerror(error))
+
+            if scheme == 'https':
+                context = self.ssl_context or ssl.create_default_context()
+                connection.sock = context.wrap_socket(
+                    sock, server_hostname=host, do_handshake_on_connect=False
+                )
+                while True:
+                    try:
+                        connection.sock.do_handshake()
+                        break
+                    except ssl.SSLWantReadError:
+                        yield connection.wait(True)
+                    except ssl.SSLWantWriteError:
+                        yield connection.wait(False)
+        except BaseException:
+            connection.close()
+            raise
+
+        raise Return(connection)
+
+    def _request(self, method, url, headers, body):
+        parsed_url = urlparse.urlsplit(url)
+        key = (
+            parsed_url.scheme,
+            parsed_url.hostname,
+            parsed_url.port or (443 if parsed_url.scheme == 'https' else 80)
+        )
+        path = parsed_url.path or '/'
+        if parsed_url.query:
+            path += '?' + parsed_url.query
+
+        request_data = ''.join(
+            ['{} {} HTTP/1.1\r\nHost: {}\r\n'.format(method, path, parsed_url.netloc)] +
+            ['{}: {}\r\n'.format(name, value) for name, value in headers.iteritems()] +
+            ['\r\n', body or '']
+        )
+
+        connection = self.get_idle_connection(key)
+        is_reused = connection is not None
+        while True:
+            if connection is None:
+                connection = yield self.connect(key)
+            bytes_received = connection.bytes_received
+
+            try:
+                yield connection.send_all(request_data)
+                status, reason, response_headers, will_close = \
+                    yield Task(self.loop, self._read_head(connection))
+            except (httplib.HTTPException, socket.error):
+                connection.close()
+                # The server may have closed the idle connection before it
+                # saw the request - so retry on a new connection, unless it
+                # responded.
+                if is_reused and connection.bytes_received == bytes_received:
+                    connection, is_reused = None, False
+                    continue
+                raise
+            except BaseException:
+                connection.close()
+                raise
+            break
+
+        response = HttpResponse(status, reason, response_headers, BodyStream(self.loop))
+        Task(self.loop, self._read_body(connection, response, will_close))
+
+        if not 200 <= status < 300:
+            # `urllib2.HTTPError` needs a file object with `readline`.
+            yield response.body.wait_complete()
+            raise urllib2.HTTPError(
+                url, status, reason, response_headers,
+                cStringIO.StringIO(response.body.read())
+            )
+
+        raise Return(response)
+
+    def _read_head(self, connection):
+        """
+        Read the status line and headers of an HTTP response from
+        `connection`, returning a `(status, reason, headers, will_close)`
+        tuple.
+        """
+
+        while True:
+            head = yield connection.read_until('\r\n\r\n')
+            status_line, _, header_lines = head.partition('\r\n')
+            try:
+                version, status, reason = (status_line.split(None, 2) + [''])[:3]
+                status = int(status)
+            except ValueError:
+                raise httplib.BadStatusLine(status_line)
+            # Skip interim responses, such as `100 Continue`.
+            if status >= 200:
+                break
+
+        headers = httplib.HTTPMessage(cStringIO.StringIO(header_lines))
+        will_close = version == 'HTTP/1.0' or \
+            headers.get('Connection', '').strip().lower() == 'close'
+        raise Return((status, reason.strip(), headers, will_close))
+
+    def _read_body(self, connection, response, will_close):
+        """
+        Feed the body of `response` from `connection` into `response.body`,
+        then release the connection - or close it, if the reader closed the
+        body early or it failed.
+        """
+
+        headers = response.headers
+        body = response.body
+        try:
+            if response.status in (204, 304):
+                pass
+            elif headers.get('Transfer-Encoding', '').strip().lower() == 'chunked':
+                while True:
+                    size_line = yield connection.read_until('\r\n')
+                    try:
+                        size = int(size_line.split(';', 1)[0].strip(), 16)
+                    except ValueError:
+                        raise httplib.HTTPException('Bad chunk size {!r}'.format(size_line))
+                    if not size:
+                        # Skip any trailers.
+                        while (yield connection.read_until('\r\n')) != '\r\n':
+                            pass
+                        break
+                    yield Task(self.loop, self._feed(connection, body, size))
+                    if body.closed:
+                        break
+                    if (yield connection.read_exactly(2)) != '\r\n':
+                        raise httplib.HTTPException('Chunk not followed by CRLF')
+            elif headers.get('Content-Length') is not None:
+                try:
+                    length = int(headers['Content-Length'])
+                except ValueError:
+                    raise httplib.HTTPException(
+                        'Bad Content-Length {!r}'.format(headers['Content-Length'])
+                    )
+                yield Task(self.loop, self._feed(connection, body, length))
+            else:
+                yield Task(self.loop, self._feed(connection, body, None))
+                will_close = True
+        except BaseException:
+            connection.close()
+            body.set_exc_info(sys.exc_info())
+            raise
+
+        if body.closed:
+            connection.close()
+            return
+
+        body.feed_eof()
+        if will_close:
+            connection.close()
+        else:
+            self.release_connection(connection)
+
+    def _feed(self, connection, body, byte_count):
+        """
+        Feed `byte_count` bytes from `connection` into `body` - or, if
+        `byte_count` is `None`, everything up to the end of the stream.
+        Returns early if the reader closes `body`.
+        """
+
+        remaining = byte_count
+        while remaining is None or remaining > 0:
+            data = yield connection.recv(
+                self.read_size if remaining is None else min(remaining, self.read_size)
+            )
+            if not data:
+                if remaining is None:
+                    return
+                raise httplib.IncompleteRead('', remaining)
+            if remaining is not None:
+                remaining -= len(data)
+            yield body.feed(data)
+            if body.closed:
+                return
+
+def decode_response(sync, response, types=None):
+    """
+    Return a list of the packets decoded from the `HttpResponse` `response`,
+    using the settings of the `Sync` object `sync`. Blocks while the body is
+    received, unless it's complete.
+    """
+
+    response_data_fp, save_response_fp = sync.open_response(response.headers, response.body)
+    return list(sync.decode_response(response_data_fp, save_response_fp, types))
+
+class AsyncSync(object):
+    """
+    Non-blocking counterpart to `Sync`, making requests for the `Sync`
+    object `sync` on the `EventLoop` `loop`.
+
+    Requests are made by `transport`, by default a `SocketTransport` shared
+    by all `AsyncSync` objects on the loop. Responses are read in full, then
+    those of `executor_threshold` bytes or more - and those of unknown length,
+    such as chunked responses - are decoded by `executor` - a thread pool as
+    `multiprocessing.pool.ThreadPool` - or by default the loop's default
+    executor. Caches set on `sync`, such as `Sync.string_table`, must be safe
+    to use from the executor's threads.
+
+    Bodies aren't decoded as they arrive, as each decode would hold an
+    executor thread for the whole download - limiting the responses received
+    at once to the executor's size.
+    """
+
+    # Responses with a shorter `Content-Length` are decoded on the loop,
+    # rather than by the executor.
+    executor_threshold = 65536
+
+    # Dict mapping `EventLoop`s to their shared `SocketTransport`.
+    _transports = weakref.WeakKeyDictionary()
+
+    def __init__(self, sync, loop, transport=None, executor=None):
+        self.sync = sync
+        self.loop = loop
+        self.executor = executor
+
+        if transport is None:
+            transport = self._transports.get(loop)
+            if transport is None:
+                transport = self._transports[loop] = SocketTransport(loop)
+        self.transport = transport
+
+    def get_packets(self, last_sync_pointers={}, types=None):
+        """
+        Return a `Future` of a list of the packets of a single response, as
+        yielded by `Sync.get_packets`.
+        """
+
+        return Task(self.loop, self._get_packets(last_sync_pointers, types))
+
+    def _get_packets(self, last_sync_pointers, types):
+        params = self.sync.get_request_params(last_sync_pointers)
+        response = yield self.transport.request('POST', params.url, params.headers, params.body)
+
+        try:
+            content_length = int(response.headers.get('Content-Length', ''))
+        except ValueError:
+            content_length = None
+
+        try:
+            yield response.body.wait_complete()
+            if content_length is not None and content_length < self.executor_threshold:
+                packets = decode_response(self.sync, response, types)
+            else:
+                packets = yield self.loop.run_in_executor(
+                    self.executor, decode_response, self.sync, response, types
+                )
+        except BaseException:
+            # Stop the transport reading the rest of the body.
+            response.body.close()
+            raise
+
+        raise Return(packets)
+
+class AsyncAllPackets(object):
+    """
+    Non-blocking counterpart to `mfpsync.AllPackets`, reading every page
+    of a sync via the `AsyncSync` object `client`.
+
+    Example:
+        >>> all_packets = AsyncAllPackets(client)
+        >>> while True:
+        ...     packets = yield all_packets.next_page()
+        ...     if packets is None:
+        ...         break
+    """
+
+    def __init__(self, client, last_sync_pointers={}, types=None):
+        self.client = client
+        self.last_sync_pointers = last_sync_pointers
+        self.is_finished = False
+
+        # `SyncResult` of the last page read.
+        self.sync_result = None
+
+        # `SyncResult` packets are always requested, as they're needed to
+        # fetch the next page - but are only returned if wanted.
+        self.wanted_types = get_packet_types(types) if types is not None else None
+        self.request_types = None
+        if self.wanted_types is not None:
+            self.request_types = self.wanted_types | {SyncResult.packet_type}
+
+    def next_page(self):
+        """
+        Return a `Future` of a list of the packets of the next page, or `None`
+        once all pages have been read. `sync_result` and `last_sync_pointers`
+        are updated once the page is read.
+        """
+
+        return Task(self.client.loop, self._next_page())
+
+    def read_all(self):
+        """
+        Return a `Future` of a list of the packets of every remaining page.
+        """
+
+        return Task(self.client.loop, self._read_all())
+
+    def _next_page(self):
+        if self.is_finished:
+            raise Return(None)
+
+        packets = yield self.client.get_packets(self.last_sync_pointers, self.request_types)
+
+        sync_result = None
+        page = []
+        for packet in packets:
+            if isinstance(packet, SyncResult):
+                sync_result = packet
+                if self.wanted_types is not None \
+                        and SyncResult.packet_type not in self.wanted_types:
+                    continue
+            page.append(packet)
+
+        if sync_result is None:
+            raise Exception('Response has no SyncResult')
+
+        self.sync_result = sync_result
+        self.last_sync_pointers = sync_result.last_sync_pointers
+        self.is_finished = not sync_result.more_data_to_sync
+        raise Return(page)
+
+    def _read_all(self):
+        packets = []
+        while True:
+            page = yield self.next_page()
+            if page is None:
+                break
+            packets.extend(page)
+        raise Return(packets)
@@ -0,0 +1,437 @@
+"""
+Syncing many accounts in one process, on a pool of threads.
+
+An accounts file is a JSON array of objects, each with a `username` and
+`password`, and optionally a `name` to use in place of the username in
+filenames and reports:
+
+    [
+        {"username": "alice@example.com", "password": "..."},
+        {"username": "bob@example.com", "password": "...", "name": "bob"}
+    ]
+
+Each account is synced to its own sink in an output directory:
+
+    NAME.json
+        A JSON array of the packets synced by the last run, replaced once
+        the sync completes. Its sync pointers are saved to
+        `NAME.pointers.json` at the same time.
+    NAME.ndjson
+        Newline-delimited JSON, appended to as each page is synced. Sync
+        pointers are saved to `NAME.pointers.json` after each page, along
+        with the length of the file, so an interrupted sync resumes from its
+        last complete page. Lines written after the last checkpoint - by a
+        page that failed part way, or a process that was killed - are
+        removed when the file is next opened.
+    NAME.sqlite
+        An `mfpsync.store.Store`, which keeps its own sync pointers and
+        commits once per page.
+
+An account that fails is reported, and leaves its sink as of its last
+checkpoint - other accounts carry on.
+
+Example:
+    >>> batch = BatchSync('/var/lib/mfpsync', concurrency=16, format='ndjson')
+    >>> results = batch.run(load_accounts(open('accounts.json')))
+    >>> write_report(results, sys.stderr)
+"""
+
+import json
+import os
+import re
+import sys
+import threading
+import time
+import traceback
+from multiprocessing.pool import ThreadPool
+
+from mfpsync import AllPackets, Sync
+from mfpsync.http import ConnectionPool
+from mfpsync.output import FORMATS
+
+# Keys of an NDJSON sink's checkpoint, saved to its pointers file.
+CHECKPOINT_KEYS = frozenset(('last_sync_pointers', 'position'))
+
+# Sink format storing packets in an `mfpsync.store.Store`, alongside the
+# output `FORMATS`.
+STORE_FORMAT = 'sqlite'
+
+class Account(object):
+    """
+    A single account of a batch.
+    """
+
+    def __init__(self, username, password, name=None):
+        self.username = username
+        self.password = password
+        self.name = name or username
+
+    def __repr__(self):
+        return '<Account {!r}>'.format(self.name)
+
+    @property
+    def filename_base(self):
+        """
+        Return `name` with any characters unsafe in a filename replaced.
+        """
+
+        return re.sub(r'[^\w@.+-]', '_', self.name).lstrip('.') or '_'
+
+def load_accounts(fp):
+    """
+    Return a list of `Account` objects parsed from the JSON accounts file
+    `fp`. Throws a `ValueError` if an account is incomplete, or two accounts
+    would share a sink.
+    """
+
+    accounts = []
+    filename_bases = set()
+    for number, item in enumerate(json.load(fp)):
+        if not isinstance(item, dict) or not item.get('username') \
+                or item.get('password') is None:
+            raise ValueError('Account {} needs a username and password'.format(number))
+
+        account = Account(item['username'], item['password'], item.get('name'))
+        if account.filename_base in filename_bases:
+            raise ValueError('Account {} has a duplicate name {!r}'.format(number, account.name))
+        filename_bases.add(account.filename_base)
+        accounts.append(account)
+    return accounts
+
+def write_json_atomically(filename, data):
+    """
+    Write `data` as JSON to `filename`, via a temporary file - so `filename`
+    is never left partly written.
+    """
+
+    temp_filename = filename + '.tmp'
+    with open(temp_filename, 'w') as fp:
+        json.dump(data, fp)
+    os.rename(temp_filename, filename)
+
+class FileSink(object):
+    """
+    Writes an account's packets to a file in one of the output `FORMATS`,
+    with its sync pointers in a separate file. See the module documentation.
+    """
+
+    def __init__(self, filename, pointers_filename, format):
+        self.filename = filename
+        self.pointers_filename = pointers_filename
+        self.format = format
+
+        # NDJSON is appended to page by page. A JSON array can't be, so is
+        # written to a temporary file and replaced once complete.
+        self.is_incremental = format == 'ndjson'
+        if self.is_incremental:
+            self.fp = open(filename, 'a')
+            self.fp.seek(0, os.SEEK_END)
+            self.discard_uncheckpointed()
+        else:
+            self.fp = open(filename + '.tmp', 'w')
+        self.writer = FORMATS[format](self.fp)
+
+        # Length of the file as of the last checkpoint. Anything after it is
+        # discarded if the sync fails, as it's synced again on resuming.
+        self.checkpoint_position = self.fp.tell()
+
+    def read_checkpoint(self):
+        """
+        Return a `(last_sync_pointers, position)` tuple for the last
+        checkpoint. `position` is the length of an NDJSON file as of the
+        checkpoint, or `None` if unknown - for a JSON array, or pointers
+        saved without it. Without a checkpoint, returns `({}, 0)`.
+        """
+
+        try:
+            with open(self.pointers_filename) as fp:
+                checkpoint = json.load(fp)
+        except IOError:
+            if os.path.isfile(self.pointers_filename):
+                raise
+            return {}, 0
+
+        if self.is_incremental and set(checkpoint) == CHECKPOINT_KEYS:
+            return checkpoint['last_sync_pointers'], checkpoint['position']
+        return checkpoint, None
+
+    def discard_uncheckpointed(self):
+        """
+        Truncate an NDJSON file to its length as of the last checkpoint,
+        discarding lines written by a sync that didn't get to close the sink.
+        Throws an `IOError` if the file is shorter than at the checkpoint.
+        """
+
+        position = self.read_checkpoint()[1]
+        if position is None:
+            return
+
+        length = self.fp.tell()
+        if length < position:
+            raise IOError('{} is shorter than at its last checkpoint'.format(self.filename))
+        if length > position:
+            self.fp.truncate(position)
+            self.fp.seek(0, os.SEEK_END)
+
+    @property
+    def last_sync_pointers(self):
+        """
+        Return the sync pointers of the last checkpoint, or an empty dict for
+        a full sync.
+        """
+
+        return self.read_checkpoint()[0]
+
+    def write_page(self, packets, all_packets):
+        """
+        Write the iterable `packets` of a single page. Returns the number of
+        packets written.
+        """
+
+        packet_count = 0
+        write = self.writer.write
+        for packet in packets:
+            write(packet)
+            packet_count += 1
+
+        if self.is_incremental and all_packets.sync_result is not None:
+            self.fp.flush()
+            os.fsync(self.fp.fileno())
+            position = self.fp.tell()
+            write_json_atomically(self.pointers_filename, {
+                'last_sync_pointers': all_packets.sync_result.last_sync_pointers,
+                'position': position
+            })
+            self.checkpoint_position = position
+        return packet_count
+
+    def finish(self, all_packets):
+        """
+        Finish a successful sync.
+        """
+
+        self.writer.close()
+        self.fp.close()
+        if not self.is_incremental:
+            os.rename(self.filename + '.tmp', self.filename)
+            write_json_atomically(self.pointers_filename, all_packets.last_sync_pointers)
+
+    def close(self):
+        """
+        Close the sink. If the sync didn't finish, discards any incomplete
+        JSON array, or any NDJSON written since the last checkpoint.
+        """
+
+        if self.fp.closed:
+            return
+
+        if self.is_incremental:
+            self.fp.flush()
+            self.fp.truncate(self.checkpoint_position)
+            self.fp.close()
+        else:
+            self.fp.close()
+            os.remove(self.filename + '.tmp')
+
+class StoreSink(object):
+    """
+    Ingests an account's packets into an `mfpsync.store.Store`.
+    """
+
+    def __init__(self, filename):
+        from mfpsync.store import Store
+        self.store = Store(filename)
+
+    @property
+    def last_sync_pointers(self):
+        return self.store.last_sync_pointers
+
+    def write_page(self, packets, all_packets):
+        return self.store.ingest_page(packets, all_packets)
+
+    def finish(self, all_packets):
+        pass
+
+    def close(self):
+        self.store.close()
+
+class AccountResult(object):
+    """
+    The outcome of syncing a single account.
+    """
+
+    def __init__(self, account):
+        self.account = account
+        self.packet_count = 0
+        self.page_count = 0
+        self.duration = 0.0
+
+        # Description of the exception that failed the sync, or `None` if it
+        # succeeded.
+        self.error = None
+
+    def __repr__(self):
+        return '<AccountResult {!r} {}>'.format(self.account.name, self.status)
+
+    @property
+    def status(self):
+        return 'ok' if self.error is None else 'failed'
+
+    def to_dict(self):
+        """
+        Return the result as a `dict`, for the JSON report.
+        """
+
+        return {
+            'name': self.account.name,
+            'status': self.status,
+            'packet_count': self.packet_count,
+            'page_count': self.page_count,
+            'duration': round(self.duration, 3),
+            'error': self.error
+        }
+
+class BatchSync(object):
+    """
+    Syncs a list of accounts, up to `concurrency` at a time, each to its own
+    sink in `output_directory`. See the module documentation.
+    """
+
+    # Keyword arguments for the `ConnectionPool` shared by the batch. Up to
+    # `concurrency` idle connections are kept, so each thread can reuse one.
+    connection_pool_options = {'idle_timeout': 60}
+
+    def __init__(self, output_directory, concurrency=8, format='ndjson',
+                 types=None, compress=False, pipeline=False):
+        """
+        `format` is one of the output `FORMATS`, or `STORE_FORMAT`. `types`,
+        `compress` and `pipeline` are as for the `mfpsync` command.
+        """
+
+        if format != STORE_FORMAT and format not in FORMATS:
+            raise ValueError('Unknown format {!r}'.format(format))
+        if format == STORE_FORMAT and types is not None:
+            raise ValueError('A store needs every packet type')
+
+        self.output_directory = output_directory
+        self.concurrency = concurrency
+        self.format = format
+        self.types = types
+        self.compress = compress
+        if pipeline:
+            from mfpsync.pipeline import PipelinedPackets
+            self.packets_class = PipelinedPackets
+        else:
+            self.packets_class = AllPackets
+
+        self.connection_pool = ConnectionPool(
+            max_size=concurrency, **self.connection_pool_options
+        )
+
+        # Optional function called with each `AccountResult` as its account
+        # finishes, along with the number of accounts finished so far.
+        self.progress_callback = None
+        self.finished_count = 0
+        self.lock = threading.Lock()
+
+    def run(self, accounts):
+        """
+        Sync each of `accounts`, returning a list of `AccountResult` objects in
+        the same order.
+        """
+
+        if not os.path.isdir(self.output_directory):
+            os.makedirs(self.output_directory)
+
+        self.finished_count = 0
+        pool = ThreadPool(max(1, min(self.concurrency, len(accounts))))
+        try:
+            # `map_async` rather than `map`, so the wait can be interrupted.
+            results = pool.map_async(self.sync_account, accounts, chunksize=1)
+            while not results.ready():
+                results.wait(1)
+            return results.get()
+        finally:
+            pool.terminate()
+            self.connection_pool.clear()
+
+    def get_sink(self, account):
+        """
+        Return a new sink for `account`.
+        """
+
+        base = os.path.join(self.output_directory, account.filename_base)
+        if self.format == STORE_FORMAT:
+            return StoreSink(base + '.' + STORE_FORMAT)
+        return FileSink(base + '.' + self.format, base + '.pointers.json', self.format)
+
+    def get_sync(self, account):
+        """
+        Return a new `Sync` object for `account`.
+        """
+
+        sync = Sync(account.username, account.password)
+        sync.compress = self.compress
+        sync.connection_pool = self.connection_pool
+        return sync
+
+    def sync_account(self, account):
+        """
+        Sync a single account to its sink, returning an `AccountResult`.
+        Exceptions are caught and recorded in the result.
+        """
+
+        result = AccountResult(account)
+        start_time = time.time()
+        try:
+            sink = self.get_sink(account)
+            try:
+                all_packets = self.packets_class(
+                    self.get_sync(account), sink.last_sync_pointers, types=self.types
+                )
+                for page in all_packets.pages():
+                    result.packet_count += sink.write_page(page, all_packets)
+                    result.page_count += 1
+                sink.finish(all_packets)
+            finally:
+                sink.close()
+        except Exception:
+            result.error = describe_exception()
+        result.duration = time.time() - start_time
+
+        if self.progress_callback is not None:
+            with self.lock:
+                self.finished_count += 1
+                self.progress_callback(result, self.finished_count)
+        return result
+
+def describe_exception():
+    """
+    Return a one-line description of the exception being handled, for an
+    `AccountResult`.
+    """
+
+    exc_type, exc_value = sys.exc_info()[:2]
+    return ''.join(traceback.format_exception_only(exc_type, exc_value)).strip()
+
+def write_report(results, fp):
+    """
+    Write a table of `AccountResult` objects to `fp`, with totals.
+    """
+
+    name_width = max([len('account')] + [len(result.account.name) for result in results])
+    row_format = '{:<%d}  {:<6}  {:>9}  {:>5}  {:>9}  {}' % name_width
+
+    fp.write(row_format.format('account', 'status', 'packets', 'pages', 'seconds', 'error') + '\n')
+    for result in results:
+        fp.write(row_format.format(
+            result.account.name, result.status, result.packet_count,
+            result.page_count, '{:.2f}'.format(result.duration), result.error or ''
+        ).rstrip() + '\n')
+
+    failed_count = sum(1 for result in results if result.error is not None)
+    fp.write('{} accounts, {} failed, {} packets, {} pages\n'.format(
+        len(results), failed_count,
+        sum(result.packet_count for result in results),
+        sum(result.page_count for result in results)
+    ))
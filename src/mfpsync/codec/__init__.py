@@ -1,9 +1,77 @@
 import contextlib
 import datetime
+import mmap
+import os
 import struct
 import uuid
 
 from mfpsync.codec import objects
+from mfpsync.codec.memo import BoundedCache
+
+_INT16 = struct.Struct('>h')
+_INT32 = struct.Struct('>l')
+_INT64 = struct.Struct('>q')
+_FLOAT = struct.Struct('>f')
+_PACKET_HEADER = struct.Struct('>hlhh')
+
+def parse_date(date_string):
+    """
+    Return a `datetime.date` object for a `YYYY-MM-DD` string.
+    """
+
+    fields = date_string[0:4], date_string[5:7], date_string[8:10]
+    if len(date_string) != 10 or date_string[4] != '-' or date_string[7] != '-' \
+            or not all(field.isdigit() for field in fields):
+        raise ValueError('Invalid date {!r}'.format(date_string))
+
+    return datetime.date(*map(int, fields))
+
+def parse_timestamp(timestamp_string):
+    """
+    Return a `datetime.datetime` object for a `YYYY-MM-DD HH:MM:SS` string.
+    """
+
+    fields = (
+        timestamp_string[0:4], timestamp_string[5:7], timestamp_string[8:10],
+        timestamp_string[11:13], timestamp_string[14:16], timestamp_string[17:19]
+    )
+    if len(timestamp_string) != 19 \
+            or timestamp_string[4] != '-' or timestamp_string[7] != '-' \
+            or timestamp_string[10] != ' ' \
+            or timestamp_string[13] != ':' or timestamp_string[16] != ':' \
+            or not all(field.isdigit() for field in fields):
+        raise ValueError('Invalid timestamp {!r}'.format(timestamp_string))
+
+    return datetime.datetime(*map(int, fields))
+
+# Caches of decoded dates and timestamps, keyed by their encoded strings.
+_date_cache = BoundedCache(parse_date)
+_timestamp_cache = BoundedCache(parse_timestamp)
+
+def get_packet_types(types):
+    """
+    Return a set of `packet_type` numbers for `types`, an iterable of
+    `BinaryPacket` subclasses or `packet_type` numbers.
+    """
+
+    return set(
+        getattr(packet_type, 'packet_type', packet_type)
+        for packet_type in types
+    )
+
+def map_file(path):
+    """
+    Return a read-only `mmap.mmap` of the file at `path`, or an empty `str`
+    if the file is empty - which can't be mapped.
+
+    The mapping stays valid after the file is closed. Processes mapping the
+    same file share its pages in the OS page cache.
+    """
+
+    with open(path, 'rb') as fp:
+        if not os.fstat(fp.fileno()).st_size:
+            return ''
+        return mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
 
 class Codec(object):
     """
@@ -23,9 +91,30 @@ class Codec(object):
         # packet, and checked at the end of the file to see that it matches
         # `expected_packet_count`. If there is no `SyncResult` packet, this
         # check will be disabled - however, this is not expected behaviour.
+        # A file may hold several responses - one per page - each with its
+        # own `SyncResult`, so their counts are added up.
         self.expected_packet_count = None
         self.packet_count = 0
 
+        # Optional `mfpsync.codec.cache.StringTable`, used to share decoded
+        # strings that repeat within the data.
+        self.string_table = None
+
+        # Optional `mfpsync.codec.cache.FoodRegistry`, used to share identical
+        # `Food` objects embedded in `FoodEntry` packets.
+        self.food_registry = None
+
+        # Optional dict mapping `BinaryPacket` subclasses to sequences of
+        # attribute names, such as `{FoodEntry: ('date', 'food.nutrients')}`.
+        # Only those attributes are decoded from packets of those classes -
+        # see `BinaryObject.get_projected_reader`. `SyncResult` packets are
+        # always decoded entirely.
+        self.projections = None
+
+        # Optional `mfpsync.codec.cache.PacketCache`, used to copy packets
+        # identical to ones already decoded rather than decoding them again.
+        self.packet_cache = None
+
         # Set `packet_type_classes` to a dict mapping of `packet_type`s to
         # `BinaryPacket` subclasses.
         self.packet_type_classes = {
@@ -55,6 +144,20 @@ class Codec(object):
             )
         }
 
+    @classmethod
+    def from_file(cls, path):
+        """
+        Return a `BufferCodec` decoding the file at `path`, such as a response
+        saved via `Sync.save_response_fp`. The file is memory-mapped rather
+        than read, so it's decoded straight from the OS page cache.
+
+        Example:
+            >>> for packet in Codec.from_file('response.bin'):
+            ...     print packet
+        """
+
+        return BufferCodec(map_file(path))
+
     def __iter__(self):
         return self.read_packets()
 
@@ -104,33 +207,64 @@ class Codec(object):
             raise EOFError
         return bytes
 
+    def skip_bytes(self, byte_count):
+        """
+        Move forward `byte_count` bytes, throwing an `EOFError` if there are
+        not enough bytes remaining.
+        """
+
+        self.read_bytes(byte_count)
+
+    def skip_string(self):
+        """
+        Move past an encoded string, without decoding it.
+        """
+
+        self.skip_bytes(self.read_2_byte_int())
+
+    def read_bytes_view(self, byte_count):
+        """
+        Return `byte_count` bytes, without copying them if the codec supports
+        it. The result is only guaranteed to support the buffer interface.
+        """
+
+        return self.read_bytes(byte_count)
+
+    def read_struct(self, struct_):
+        """
+        Return the tuple of values decoded by the `struct.Struct` object
+        `struct_`.
+        """
+
+        return struct_.unpack(self.read_bytes(struct_.size))
+
     def read_2_byte_int(self):
         """
         Return a decoded 2-byte big-endian integer.
         """
 
-        return struct.unpack('>h', self.read_bytes(2))[0]
+        return self.read_struct(_INT16)[0]
 
     def read_4_byte_int(self):
         """
         Return a decoded 4-byte big-endian integer.
         """
 
-        return struct.unpack('>l', self.read_bytes(4))[0]
+        return self.read_struct(_INT32)[0]
 
     def read_8_byte_int(self):
         """
         Return a decoded 8-byte big-endian integer.
         """
 
-        return struct.unpack('>q', self.read_bytes(8))[0]
+        return self.read_struct(_INT64)[0]
 
     def read_float(self):
         """
         Return a IEEE 754 binary32-decoded big-endian float.
         """
 
-        return struct.unpack('>f', self.read_bytes(4))[0]
+        return self.read_struct(_FLOAT)[0]
 
     def read_string(self):
         """
@@ -139,6 +273,8 @@ class Codec(object):
 
         string_length = self.read_2_byte_int()
         encoded_string = self.read_bytes(string_length)
+        if self.string_table is not None:
+            return self.string_table.decode(encoded_string)
         decoded_string = encoded_string.decode('utf8')
         return decoded_string
 
@@ -154,18 +290,51 @@ class Codec(object):
         Return a decoded `datetime.date` object.
         """
 
-        date_string = self.read_bytes(10)
-        date = datetime.datetime.strptime(date_string, '%Y-%m-%d').date()
-        return date
+        return self.decode_date(self.read_bytes(10))
 
     def read_timestamp(self):
         """
         Return a decoded `datetime.datetime` object.
         """
 
-        timestamp_string = self.read_bytes(19)
-        timestamp = datetime.datetime.strptime(timestamp_string, '%Y-%m-%d %H:%M:%S')
-        return timestamp
+        return self.decode_timestamp(self.read_bytes(19))
+
+    def decode_date(self, date_string):
+        """
+        Return a `datetime.date` object for a `YYYY-MM-DD` string. Repeated
+        strings return the same cached object.
+        """
+
+        return _date_cache[date_string]
+
+    def decode_timestamp(self, timestamp_string):
+        """
+        Return a `datetime.datetime` object for a `YYYY-MM-DD HH:MM:SS` string.
+        Repeated strings return the same cached object.
+        """
+
+        return _timestamp_cache[timestamp_string]
+
+    def read_object(self, object_class, read_body=None):
+        """
+        Return a decoded `BinaryObject` of class `object_class`. Used for
+        objects embedded within a packet body.
+
+        If given, `read_body` is used in place of
+        `object_class.read_body_from_codec` - e.g. a projected reader from
+        `BinaryObject.get_projected_reader`.
+        """
+
+        obj = object_class()
+        if read_body is not None:
+            read_body(obj, self)
+            return obj
+
+        if object_class is objects.Food and self.food_registry is not None:
+            return self.food_registry.read_food(self)
+
+        obj.read_body_from_codec(self)
+        return obj
 
     def read_map(self, item_count, read_key, read_value):
         """
@@ -191,6 +360,21 @@ class Codec(object):
 
         return items
 
+    def get_projected_reader(self, packet_class):
+        """
+        Return the projected reader for `packet_class` given by
+        `self.projections`, or `None` if the packet should be decoded
+        entirely.
+        """
+
+        if not self.projections or packet_class is objects.SyncResult:
+            return None
+
+        names = self.projections.get(packet_class)
+        if names is None:
+            return None
+        return packet_class.get_projected_reader(names, read_trailing=False)
+
     def read_packet_header(self):
         """
         Return a decoded packet header. Throws a `ValueError` if the first two
@@ -212,18 +396,31 @@ class Codec(object):
             'type': packet_type
         }
 
-    def read_packets(self):
+    def read_packets(self, types=None):
         """
         Return an iterator yielding `BinaryPacket`-subclassed objects.
+
+        If `types` is given - an iterable of `BinaryPacket` subclasses or
+        `packet_type` numbers - only packets of those types are decoded and
+        yielded. Other packets are skipped using the length in their header,
+        but still count towards the `SyncResult`'s `expected_packet_count`.
         """
 
+        wanted_types = get_packet_types(types) if types is not None else None
+
         while True:
             packet_start = self.position
             try:
-                yield self.read_packet()
+                packet = self.read_packet(wanted_types)
             except EOFError:
                 if self.position == packet_start:
                     break
+                continue
+
+            if packet is not None and (
+                wanted_types is None or packet.packet_type in wanted_types
+            ):
+                yield packet
 
         if self.expected_packet_count is not None:
             if self.packet_count != self.expected_packet_count:
@@ -231,9 +428,14 @@ class Codec(object):
                     self.expected_packet_count, self.packet_count
                 ))
 
-    def read_packet(self):
+    def read_packet(self, wanted_types=None):
         """
         Return the next decoded packet.
+
+        If `wanted_types` is given - a set of `packet_type` numbers - packets
+        of other types are skipped and `None` is returned. `SyncResult`
+        packets are always decoded, as they're needed to check the packet
+        count.
         """
 
         # Record the start position of the packet.
@@ -248,14 +450,38 @@ class Codec(object):
         # checked after decoding the packet.
         expected_packet_end = packet_start + packet_length
 
+        # Skip unwanted packets without decoding them.
+        if wanted_types is not None and packet_type not in wanted_types \
+                and packet_type != objects.PACKET_TYPE_SYNC_RESULT:
+            self.skip_bytes(expected_packet_end - self.position)
+            self.packet_count += 1
+            return None
+
         # Decode the packet body.
         packet = None
         try:
             if packet_type in self.packet_type_classes:
-                packet = self.packet_type_classes[packet_type]()
-                packet.packet_start = packet_start
-                packet.packet_length = packet_length
-                packet.read_body_from_codec(self)
+                packet_class = self.packet_type_classes[packet_type]
+                read_body = self.get_projected_reader(packet_class)
+
+                if read_body is None and self.packet_cache is not None \
+                        and self.packet_cache.is_cacheable(packet_class):
+                    # Copy identical packets from the cache.
+                    packet = self.packet_cache.read_packet(
+                        self, packet_class, packet_start, packet_length
+                    )
+                else:
+                    packet = packet_class()
+                    packet.packet_start = packet_start
+                    packet.packet_length = packet_length
+
+                    if read_body is None:
+                        packet.read_body_from_codec(self)
+                    else:
+                        # Skip any fields after the last projected field.
+                        read_body(packet, self)
+                        if self.position < expected_packet_end:
+                            self.skip_bytes(expected_packet_end - self.position)
             else:
                 raise NotImplementedError
         except NotImplementedError:
@@ -271,11 +497,12 @@ class Codec(object):
             packet.read_body_from_codec(self)
 
         # If this is a `SyncResult`, we have an `expected_packet_count`.
-        # Record this, so we can check it at the end of the file.
+        # Add this to the total, so we can check it at the end of the file.
         # If not, increment `packet_count` - `SyncResult` packets are not
         # included in the count.
         if isinstance(packet, objects.SyncResult):
-            self.expected_packet_count = packet.expected_packet_count
+            self.expected_packet_count = \
+                (self.expected_packet_count or 0) + packet.expected_packet_count
         else:
             self.packet_count += 1
 
@@ -290,33 +517,40 @@ class Codec(object):
 
         return packet
 
+    def write_struct(self, struct_, *values):
+        """
+        Write `values`, encoded by the `struct.Struct` object `struct_`.
+        """
+
+        self.fp.write(struct_.pack(*values))
+
     def write_2_byte_int(self, value):
         """
         Write an encoded big-endian 2-byte int.
         """
 
-        self.fp.write(struct.pack('>h', value))
+        self.write_struct(_INT16, value)
 
     def write_4_byte_int(self, value):
         """
         Write an encoded big-endian 4-byte int.
         """
 
-        self.fp.write(struct.pack('>l', value))
+        self.write_struct(_INT32, value)
 
     def write_8_byte_int(self, value):
         """
         Write an encoded big-endian 8-byte int.
         """
 
-        self.fp.write(struct.pack('>q', value))
+        self.write_struct(_INT64, value)
 
     def write_float(self, value):
         """
         Write an IEEE 754 binary32-encoded big-endian float.
         """
 
-        self.fp.write(struct.pack('>f', value))
+        self.write_struct(_FLOAT, value)
 
     def write_string(self, value):
         """
@@ -339,14 +573,29 @@ class Codec(object):
         Write an encoded `datetime.date` object.
         """
 
-        self.fp.write(value.strftime('%Y-%m-%d %H:%M:%S'))
+        self.fp.write(self.encode_date(value))
 
     def write_timestamp(self, value):
         """
         Write an encoded `datetime.datetime` object.
         """
 
-        self.fp.write(value.strftime(''))
+        self.fp.write(self.encode_timestamp(value))
+
+    def encode_date(self, value):
+        """
+        Return the `YYYY-MM-DD` string for a `datetime.date` object.
+        """
+
+        return value.strftime('%Y-%m-%d')
+
+    def encode_timestamp(self, value):
+        """
+        Return the `YYYY-MM-DD HH:MM:SS` string for a `datetime.datetime`
+        object.
+        """
+
+        return value.strftime('%Y-%m-%d %H:%M:%S')
 
     def write_map(self, write_key, write_value, items):
         """
@@ -366,3 +615,216 @@ class Codec(object):
         for key, value in items.iteritems():
             write_key(key)
             write_value(value)
+
+class BufferCodec(Codec):
+    """
+    Decodes MyFitnessPal binary objects from an in-memory buffer.
+
+    Accepts any object supporting the buffer interface - `str`, `bytearray`,
+    `memoryview` or `mmap.mmap`. The read position is kept as an integer
+    offset, fields are decoded in place with `struct.Struct.unpack_from`, and
+    `UnknownPacket.bytes` are returned as views into the buffer rather than
+    copies.
+
+    Example:
+        >>> for packet in BufferCodec(response_data):
+        ...     print packet
+
+    `BufferCodec` objects are read-only - use `Codec` to encode packets.
+    """
+
+    def __init__(self, data, offset=0):
+        """
+        Configures class to read from `data`, starting at `offset`.
+        """
+
+        super(BufferCodec, self).__init__(None)
+        self.load(data, offset)
+
+    def load(self, data, offset=0):
+        """
+        Replace the buffer with `data`, starting at `offset`.
+        """
+
+        self.data = data
+        self.offset = offset
+        self.length = len(data)
+
+        # Slicing `str` and `mmap` objects returns a `str`, so `read_bytes`
+        # can slice them directly. Other buffers are sliced via a
+        # `memoryview`. `mmap` objects don't support `memoryview` in Python 2,
+        # so views into them are made with `buffer` instead.
+        self.slices_to_str = isinstance(data, (str, mmap.mmap))
+        try:
+            self.view = memoryview(data)
+        except TypeError:
+            self.view = None
+
+    @property
+    def position(self):
+        """
+        Return the current offset within `self.data`.
+        """
+
+        return self.offset
+
+    @position.setter
+    def position(self, value):
+        """
+        Set a new offset within `self.data`.
+        """
+
+        self.offset = value
+
+    def _advance(self, byte_count):
+        """
+        Move forward `byte_count` bytes, returning the previous offset. Throws
+        an `EOFError` if there are not enough bytes remaining, leaving the
+        offset at the end of the buffer as a file object would.
+        """
+
+        start = self.offset
+        end = start + byte_count
+        if end > self.length:
+            self.offset = self.length
+            raise EOFError
+        self.offset = end
+        return start
+
+    def read_bytes(self, byte_count):
+        """
+        Return `byte_count` bytes as a `str`, throwing an `EOFError` if there
+        are not enough bytes remaining.
+        """
+
+        start = self._advance(byte_count)
+        if self.slices_to_str:
+            return self.data[start:start + byte_count]
+        return self.view[start:start + byte_count].tobytes()
+
+    def skip_bytes(self, byte_count):
+        """
+        Move forward `byte_count` bytes, throwing an `EOFError` if there are
+        not enough bytes remaining.
+        """
+
+        self._advance(byte_count)
+
+    def read_bytes_view(self, byte_count):
+        """
+        Return a zero-copy view of the next `byte_count` bytes.
+        """
+
+        start = self._advance(byte_count)
+        if self.view is None:
+            return buffer(self.data, start, byte_count)
+        return self.view[start:start + byte_count]
+
+    def read_struct(self, struct_):
+        """
+        Return the tuple of values decoded in place by the `struct.Struct`
+        object `struct_`.
+        """
+
+        return struct_.unpack_from(self.data, self._advance(struct_.size))
+
+    def read_string(self):
+        """
+        Return a decoded string.
+        """
+
+        string_length = _INT16.unpack_from(self.data, self._advance(2))[0]
+        encoded_string = self.read_bytes(string_length)
+        if self.string_table is not None:
+            return self.string_table.decode(encoded_string)
+        return encoded_string.decode('utf8')
+
+class StreamCodec(BufferCodec):
+    """
+    Decodes MyFitnessPal binary objects from a non-seekable stream, such as an
+    HTTP response.
+
+    Each packet's bytes are read from the stream using the length in its
+    header, then decoded in place as with `BufferCodec`. Packets are available
+    as soon as their bytes arrive, and only one packet is held in memory.
+
+    If `tee_fp` is given, every byte read from the stream is also written to
+    it.
+    """
+
+    def __init__(self, fp, tee_fp=None):
+        """
+        Configures class to read from the file object `fp`, optionally copying
+        the data to the file object `tee_fp`.
+        """
+
+        super(StreamCodec, self).__init__('')
+        self.fp = fp
+        self.tee_fp = tee_fp
+
+        # Position of the start of `self.data` within the stream.
+        self.stream_position = 0
+
+    @property
+    def position(self):
+        """
+        Return the current position within the stream.
+        """
+
+        return self.stream_position + self.offset
+
+    @position.setter
+    def position(self, value):
+        """
+        Set a new position within the current packet.
+        """
+
+        self.offset = value - self.stream_position
+
+    def read_stream(self, byte_count):
+        """
+        Return up to `byte_count` bytes from `self.fp`. Fewer bytes are
+        returned only at the end of the stream.
+        """
+
+        chunks = []
+        remaining = byte_count
+        while remaining > 0:
+            chunk = self.fp.read(remaining)
+            if not chunk:
+                break
+            chunks.append(chunk)
+            remaining -= len(chunk)
+
+        data = ''.join(chunks)
+        if self.tee_fp is not None and data:
+            self.tee_fp.write(data)
+        return data
+
+    def load_packet(self):
+        """
+        Replace the buffer with the next packet read from the stream. At the
+        end of the stream, the buffer is left empty or holding a partial
+        packet.
+        """
+
+        self.stream_position += self.length
+
+        header = self.read_stream(_PACKET_HEADER.size)
+        body = ''
+        if len(header) == _PACKET_HEADER.size:
+            magic_number, length, _, _ = _PACKET_HEADER.unpack(header)
+            # Leave a bad magic number for `read_packet_header` to report.
+            if magic_number == objects.BinaryPacket.MAGIC:
+                body = self.read_stream(length - len(header))
+
+        self.load(header + body)
+
+    def read_packet(self, wanted_types=None):
+        """
+        Read the next packet from the stream, and return it decoded. Unwanted
+        packets are still read from the stream, but not decoded.
+        """
+
+        self.load_packet()
+        return super(StreamCodec, self).read_packet(wanted_types)
@@ -0,0 +1,314 @@
+from collections import OrderedDict
+import cPickle as pickle
+import hashlib
+import sqlite3
+
+from mfpsync.codec import objects
+
+class StringTable(object):
+    """
+    Bounded table of decoded strings, keyed by their UTF-8 encoding.
+
+    Set as a `Codec`'s `string_table` to return the same `unicode` object for
+    repeated strings - meal names, brands, portion descriptions and the like.
+    This saves decoding them again, and the memory for duplicate copies.
+
+    Example:
+        >>> codec.string_table = StringTable()
+        >>> packets = list(codec)
+        >>> codec.string_table.hits, codec.string_table.misses
+        (41235, 1873)
+
+    Strings longer than `max_length` bytes are rarely repeated, so are decoded
+    without being added. Once the table holds `max_size` strings, new strings
+    are no longer added.
+    """
+
+    def __init__(self, max_size=65536, max_length=64):
+        self.max_size = max_size
+        self.max_length = max_length
+        self.strings = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.strings)
+
+    def __repr__(self):
+        return '<StringTable(size={}, hits={}, misses={}, hit_rate={:.3f})>'.format(
+            len(self.strings), self.hits, self.misses, self.hit_rate
+        )
+
+    @property
+    def hit_rate(self):
+        """
+        Return the proportion of lookups that found an existing string.
+        """
+
+        lookups = self.hits + self.misses
+        return float(self.hits) / lookups if lookups else 0.0
+
+    def decode(self, encoded_string):
+        """
+        Return the decoded `unicode` object for the UTF-8 `encoded_string`.
+        """
+
+        try:
+            string = self.strings[encoded_string]
+        except KeyError:
+            pass
+        else:
+            self.hits += 1
+            return string
+
+        self.misses += 1
+        string = encoded_string.decode('utf8')
+        if len(encoded_string) <= self.max_length and len(self.strings) < self.max_size:
+            self.strings[encoded_string] = string
+        return string
+
+class FoodRegistry(object):
+    """
+    Registry of frozen `Food` objects, shared between `FoodEntry` packets that
+    embed identical foods.
+
+    Set as a `Codec`'s `food_registry`. Each embedded `Food` is keyed by its
+    `master_food_id` and a digest of its encoded bytes. The first time a key
+    is seen, the food is decoded and frozen. After that, the shared object is
+    returned and decoding, including the portion list, is skipped.
+
+    Example:
+        >>> codec.food_registry = FoodRegistry()
+        >>> entries = [packet for packet in codec if isinstance(packet, FoodEntry)]
+        >>> entries[0].food is entries[300].food
+        True
+
+    Once the registry holds `max_size` foods, new foods are decoded but not
+    added.
+    """
+
+    def __init__(self, max_size=16384):
+        self.max_size = max_size
+        self.foods = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.foods)
+
+    def __repr__(self):
+        return '<FoodRegistry(size={}, hits={}, misses={})>'.format(
+            len(self.foods), self.hits, self.misses
+        )
+
+    def read_food(self, codec):
+        """
+        Return the `Food` encoded at the codec's current position, moving the
+        codec past it.
+        """
+
+        # Find the extent of the encoded food by skipping over it.
+        food_start = codec.position
+        master_food_id = codec.read_4_byte_int()
+        codec.position = food_start
+        objects.Food.skip_body_in_codec(codec)
+        food_end = codec.position
+
+        codec.position = food_start
+        key = (
+            master_food_id,
+            hashlib.sha1(codec.read_bytes_view(food_end - food_start)).digest()
+        )
+
+        try:
+            food = self.foods[key]
+        except KeyError:
+            pass
+        else:
+            self.hits += 1
+            return food
+
+        self.misses += 1
+        codec.position = food_start
+        food = objects.Food()
+        food.read_body_from_codec(codec)
+        food.freeze()
+        if len(self.foods) < self.max_size:
+            self.foods[key] = food
+        return food
+
+class PacketCache(object):
+    """
+    Content-addressed cache of decoded packets, keyed by packet type and a
+    digest of the encoded body.
+
+    Set as a `Codec`'s `packet_cache`. When a packet's body matches one
+    already decoded, the cached packet is copied rather than decoded again -
+    which makes re-processing overlapping syncs or captures mostly a matter
+    of hashing. Cached packets are frozen, and copies share their embedded
+    objects, so all packets read through the cache are frozen.
+
+    Example:
+        >>> cache = PacketCache(path='packets.sqlite')
+        >>> codec.packet_cache = cache
+        >>> packets = list(codec)
+        >>> cache.close()
+        >>> cache
+        <PacketCache(size=65536, hits=48003, disk_hits=1022, misses=97, hit_rate=0.998)>
+
+    Once the cache holds `max_size` packets, the least recently used packets
+    are evicted. If `path` is given, packets are also stored in an SQLite
+    database there, and packets not in memory are looked up there before
+    being decoded. `SyncResult` packets, and packet classes without `fields`,
+    are never cached.
+    """
+
+    # Number of packets stored in the SQLite database per transaction.
+    commit_interval = 1000
+
+    def __init__(self, max_size=65536, path=None):
+        self.max_size = max_size
+        self.packets = OrderedDict()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self.connection = None
+        self.pending_count = 0
+        if path is not None:
+            self.connection = sqlite3.connect(path)
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS packets ('
+                'packet_type INTEGER NOT NULL, '
+                'digest BLOB NOT NULL, '
+                'data BLOB NOT NULL, '
+                'PRIMARY KEY (packet_type, digest))'
+            )
+
+    def __len__(self):
+        return len(self.packets)
+
+    def __repr__(self):
+        return '<PacketCache(size={}, hits={}, disk_hits={}, misses={}, hit_rate={:.3f})>'.format(
+            len(self.packets), self.hits, self.disk_hits, self.misses, self.hit_rate
+        )
+
+    @property
+    def hit_rate(self):
+        """
+        Return the proportion of lookups found in memory or on disk.
+        """
+
+        lookups = self.hits + self.disk_hits + self.misses
+        return float(self.hits + self.disk_hits) / lookups if lookups else 0.0
+
+    def is_cacheable(self, packet_class):
+        """
+        Return whether packets of `packet_class` are cached.
+        """
+
+        return packet_class.fields is not None and packet_class is not objects.SyncResult
+
+    def read_packet(self, codec, packet_class, packet_start, packet_length):
+        """
+        Return the `packet_class` packet whose body starts at the codec's
+        current position, moving the codec to the end of the packet.
+        """
+
+        body_start = codec.position
+        key = (
+            packet_class.packet_type,
+            hashlib.sha1(codec.read_bytes_view(packet_start + packet_length - body_start)).digest()
+        )
+
+        packet = self.get(key)
+        if packet is not None:
+            return copy_packet(packet, packet_start)
+
+        self.misses += 1
+        codec.position = body_start
+        packet = packet_class()
+        packet.packet_start = packet_start
+        packet.packet_length = packet_length
+        packet.read_body_from_codec(codec)
+        packet.freeze()
+        self.put(key, packet, store=True)
+        return packet
+
+    def get(self, key):
+        """
+        Return the packet for `key` from memory or disk, or `None`.
+        """
+
+        try:
+            packet = self.packets.pop(key)
+        except KeyError:
+            pass
+        else:
+            self.hits += 1
+            self.packets[key] = packet
+            return packet
+
+        if self.connection is None:
+            return None
+
+        row = self.connection.execute(
+            'SELECT data FROM packets WHERE packet_type = ? AND digest = ?',
+            (key[0], sqlite3.Binary(key[1]))
+        ).fetchone()
+        if row is None:
+            return None
+
+        self.disk_hits += 1
+        packet = pickle.loads(str(row[0]))
+        self.put(key, packet, store=False)
+        return packet
+
+    def put(self, key, packet, store):
+        """
+        Add `packet` to the in-memory cache, evicting the least recently used
+        packet if full. If `store` is set, also add it to the database.
+        """
+
+        self.packets[key] = packet
+        if len(self.packets) > self.max_size:
+            self.packets.popitem(last=False)
+
+        if store and self.connection is not None:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO packets (packet_type, digest, data) VALUES (?, ?, ?)',
+                (key[0], sqlite3.Binary(key[1]),
+                 sqlite3.Binary(pickle.dumps(packet, pickle.HIGHEST_PROTOCOL)))
+            )
+            self.pending_count += 1
+            if self.pending_count >= self.commit_interval:
+                self.flush()
+
+    def flush(self):
+        """
+        Commit packets added to the database.
+        """
+
+        if self.connection is not None:
+            self.connection.commit()
+        self.pending_count = 0
+
+    def close(self):
+        """
+        Commit and close the database, if any.
+        """
+
+        if self.connection is not None:
+            self.flush()
+            self.connection.close()
+            self.connection = None
+
+def copy_packet(packet, packet_start):
+    """
+    Return a frozen copy of the frozen `packet`, at position `packet_start`.
+    Embedded objects are shared with the original.
+    """
+
+    restore, (cls, state, is_frozen) = packet.__reduce_ex__(pickle.HIGHEST_PROTOCOL)
+    state['packet_start'] = packet_start
+    return restore(cls, state, True)
@@ -38,6 +38,9 @@ class Flag(object):
         base attribute.
         """
 
+        if obj is None:
+            return self
+
         return bool(getattr(obj, self.base_attr) & self.bitmask)
 
     def __set__(self, obj, enabled):
@@ -51,3 +54,41 @@ class Flag(object):
         else:
             value &= ~self.bitmask
         setattr(obj, self.base_attr, value)
+
+class ClassDefault(object):
+    """
+    Descriptor for an attribute with a class-level value that instances may
+    override. A class with `__slots__` can't have a class attribute and a slot
+    of the same name, so instances store their value in the slot `slot_name`.
+
+    Example:
+        >>> class Test(object):
+        ...     __slots__ = ('_kind',)
+        ...     kind = ClassDefault('_kind', None)
+        ...
+        >>> Test.kind is None
+        True
+        >>> test = Test()
+        >>> test.kind = 3
+        >>> test.kind, Test.kind
+        (3, None)
+    """
+
+    def __init__(self, slot_name, default):
+        """
+        Create the descriptor. `slot_name` is the slot holding an instance's
+        value, and `default` is returned for the class, or for instances
+        without a value.
+        """
+
+        self.slot_name = slot_name
+        self.default = default
+
+    def __get__(self, obj, type=None):
+        if obj is None:
+            return self.default
+
+        return getattr(obj, self.slot_name, self.default)
+
+    def __set__(self, obj, value):
+        setattr(obj, self.slot_name, value)
@@ -0,0 +1,753 @@
+from operator import methodcaller
+import struct
+import uuid
+
+from mfpsync.codec.memo import BoundedCache
+
+# Field flag. Marks a field holding the item count of a later `Array` or `Map`
+# field with the same name, for packets where the count isn't written directly
+# before the items. The count is kept in a local variable rather than set as
+# an attribute, and is written as `len()` of the items.
+COUNT = 0x1
+
+# Caches of the strings returned by `format_date` and `format_timestamp`.
+_date_strings = BoundedCache(methodcaller('strftime', '%Y-%m-%d'))
+_timestamp_strings = BoundedCache(methodcaller('strftime', '%Y-%m-%d %H:%M:%S'))
+
+class Field(object):
+    """
+    A named, typed field within a `BinaryObject`'s binary body.
+
+    `BinaryObject` subclasses list their fields in body order as a `fields`
+    tuple. This is compiled into `read_body_from_codec` and
+    `write_body_to_codec` methods when the class is created.
+
+    Example:
+        >>> class Point(BinaryObject):
+        ...     fields = (
+        ...         Field(INT32, 'x'),
+        ...         Field(INT32, 'y'),
+        ...         Field(STRING, 'label')
+        ...     )
+    """
+
+    def __init__(self, type, name, flags=0):
+        """
+        Create a field. `type` is a `FieldType` object, `name` is the attribute
+        name, and `flags` is a bitmask of field flags such as `COUNT`.
+        """
+
+        self.type = type
+        self.name = name
+        self.flags = flags
+
+    def __repr__(self):
+        return '<Field({!r}, {!r}, flags={})>'.format(self.type, self.name, self.flags)
+
+class FieldType(object):
+    """
+    Base class for field types.
+
+    Fixed-width types set `format` to a `struct` format string producing
+    `item_count` values. Adjacent fixed-width fields are decoded and encoded
+    together with a single `struct.Struct`. Types that need to convert those
+    values set `converts`, and override `decode_expr` and `encode_exprs`.
+
+    Variable-width types leave `format` as `None`, and override `read_expr`,
+    `write_lines` and `skip_lines`.
+
+    The `*_expr` and `*_lines` methods return Python source, which is compiled
+    into the generated methods. Objects the source refers to are added to the
+    `namespace` dict via `bind`.
+    """
+
+    format = None
+    item_count = 1
+    converts = False
+
+    # Name of the `Codec` methods that read and write a single value of this
+    # type - used for `Map` keys and values.
+    reader = None
+    writer = None
+
+    # Item count type for `Array` and `Map` fields, written directly before
+    # the items. `None` if the count is given by an earlier `COUNT` field.
+    count = None
+
+    def decode_expr(self, items, namespace):
+        """
+        Return an expression converting the struct value expressions `items`
+        to an attribute value.
+        """
+
+        return items[0]
+
+    def encode_exprs(self, value, namespace):
+        """
+        Return a list of expressions converting the attribute value expression
+        `value` to struct values.
+        """
+
+        return [value]
+
+    def read_expr(self, count, namespace):
+        """
+        Return an expression reading a value from `codec`. `count` is the name
+        of the variable holding the item count, for `Array` and `Map` types.
+        """
+
+        raise NotImplementedError
+
+    def read_projected_expr(self, count, namespace, read_body):
+        """
+        Return an expression reading a value from `codec`, decoding embedded
+        objects with the projected reader `read_body`. Only supported by
+        `Object` and `Array` types.
+        """
+
+        raise NotImplementedError
+
+    def write_lines(self, value, namespace):
+        """
+        Return a list of source lines writing the attribute value expression
+        `value` to `codec`.
+        """
+
+        raise NotImplementedError
+
+    def skip_lines(self, count, namespace):
+        """
+        Return a list of source lines moving `codec` past a value, without
+        decoding more than is needed to find its end.
+        """
+
+        if self.format is not None:
+            return ['codec.skip_bytes({})'.format(struct.calcsize('>' + self.format))]
+        raise NotImplementedError
+
+    def primitive_expr(self, value, namespace):
+        """
+        Return an expression converting the attribute value expression
+        `value` to primitives - see `compile_converter`.
+        """
+
+        return value
+
+class Scalar(FieldType):
+    """
+    A single fixed-width value, stored as-is.
+    """
+
+    def __init__(self, name, format, reader, writer):
+        self.name = name
+        self.format = format
+        self.reader = reader
+        self.writer = writer
+
+    def __repr__(self):
+        return self.name
+
+INT16 = Scalar('INT16', 'h', 'read_2_byte_int', 'write_2_byte_int')
+INT32 = Scalar('INT32', 'l', 'read_4_byte_int', 'write_4_byte_int')
+INT64 = Scalar('INT64', 'q', 'read_8_byte_int', 'write_8_byte_int')
+FLOAT = Scalar('FLOAT', 'f', 'read_float', 'write_float')
+
+class String(FieldType):
+    """
+    A UTF-8 string, preceded by a 2-byte length.
+    """
+
+    reader = 'read_string'
+    writer = 'write_string'
+
+    def read_expr(self, count, namespace):
+        return 'codec.read_string()'
+
+    def write_lines(self, value, namespace):
+        return ['codec.write_string({})'.format(value)]
+
+    def skip_lines(self, count, namespace):
+        return ['codec.skip_string()']
+
+    def __repr__(self):
+        return 'STRING'
+
+STRING = String()
+
+class Date(FieldType):
+    """
+    A `datetime.date`, encoded as a `YYYY-MM-DD` string.
+    """
+
+    format = '10s'
+    converts = True
+    reader = 'read_date'
+    writer = 'write_date'
+
+    def decode_expr(self, items, namespace):
+        return 'codec.decode_date({})'.format(items[0])
+
+    def encode_exprs(self, value, namespace):
+        return ['codec.encode_date({})'.format(value)]
+
+    def primitive_expr(self, value, namespace):
+        return '{}({})'.format(bind(namespace, format_date, 'format_date'), value)
+
+    def __repr__(self):
+        return 'DATE'
+
+DATE = Date()
+
+class Timestamp(FieldType):
+    """
+    A `datetime.datetime`, encoded as a `YYYY-MM-DD HH:MM:SS` string.
+    """
+
+    format = '19s'
+    converts = True
+    reader = 'read_timestamp'
+    writer = 'write_timestamp'
+
+    def decode_expr(self, items, namespace):
+        return 'codec.decode_timestamp({})'.format(items[0])
+
+    def encode_exprs(self, value, namespace):
+        return ['codec.encode_timestamp({})'.format(value)]
+
+    def primitive_expr(self, value, namespace):
+        return '{}({})'.format(bind(namespace, format_timestamp, 'format_timestamp'), value)
+
+    def __repr__(self):
+        return 'TIMESTAMP'
+
+TIMESTAMP = Timestamp()
+
+class Uuid(FieldType):
+    """
+    A 16-byte `uuid.UUID`.
+    """
+
+    format = '16s'
+    converts = True
+    reader = 'read_uuid'
+    writer = 'write_uuid'
+
+    def decode_expr(self, items, namespace):
+        return '{}(bytes={})'.format(bind(namespace, uuid.UUID, 'UUID'), items[0])
+
+    def encode_exprs(self, value, namespace):
+        return ['{}.bytes'.format(value)]
+
+    def __repr__(self):
+        return 'UUID'
+
+UUID = Uuid()
+
+class FloatMap(FieldType):
+    """
+    A run of big-endian floats, decoded to a `mapping_class` object - such as
+    `Nutrients`. `mapping_class` is created from a sequence of values, and
+    lists its keys in order as `mapping_class.nutrient_names`.
+    """
+
+    converts = True
+
+    def __init__(self, mapping_class):
+        self.mapping_class = mapping_class
+        self.keys = tuple(mapping_class.nutrient_names)
+        self.format = '{}f'.format(len(self.keys))
+        self.item_count = len(self.keys)
+
+    def decode_expr(self, items, namespace):
+        return '{}(({},))'.format(
+            bind(namespace, self.mapping_class, self.mapping_class.__name__),
+            ', '.join(items)
+        )
+
+    def encode_exprs(self, value, namespace):
+        return [
+            '{}.get({!r}, 0.0)'.format(value, key)
+            for key in self.keys
+        ]
+
+    def primitive_expr(self, value, namespace):
+        return '{}.to_primitive()'.format(value)
+
+    def __repr__(self):
+        return 'FloatMap({})'.format(self.mapping_class.__name__)
+
+class Object(FieldType):
+    """
+    An embedded `BinaryObject`, without a packet header.
+    """
+
+    def __init__(self, object_class):
+        self.object_class = object_class
+
+    def read_expr(self, count, namespace):
+        return 'codec.read_object({})'.format(
+            bind(namespace, self.object_class, self.object_class.__name__)
+        )
+
+    def read_projected_expr(self, count, namespace, read_body):
+        return 'codec.read_object({}, {})'.format(
+            bind(namespace, self.object_class, self.object_class.__name__),
+            bind(namespace, read_body, 'read_body')
+        )
+
+    def write_lines(self, value, namespace):
+        return ['{}.write_body_to_codec(codec)'.format(value)]
+
+    def primitive_expr(self, value, namespace):
+        return '{}.to_primitive()'.format(value)
+
+    def skip_lines(self, count, namespace):
+        return ['{}.skip_body_in_codec(codec)'.format(
+            bind(namespace, self.object_class, self.object_class.__name__)
+        )]
+
+    def __repr__(self):
+        return 'Object({})'.format(self.object_class.__name__)
+
+class Array(FieldType):
+    """
+    A list of embedded `BinaryObject`s.
+
+    The item count is written directly before the items as type `count`,
+    unless `count` is `None` - in which case the packet has an earlier `COUNT`
+    field of the same name.
+    """
+
+    def __init__(self, object_class, count=INT16):
+        self.object_class = object_class
+        self.count = count
+
+    def read_expr(self, count, namespace):
+        return '[codec.read_object({}) for _ in xrange({})]'.format(
+            bind(namespace, self.object_class, self.object_class.__name__),
+            count
+        )
+
+    def read_projected_expr(self, count, namespace, read_body):
+        return '[codec.read_object({}, {}) for _ in xrange({})]'.format(
+            bind(namespace, self.object_class, self.object_class.__name__),
+            bind(namespace, read_body, 'read_body'),
+            count
+        )
+
+    def write_lines(self, value, namespace):
+        return [
+            'for item in {}:'.format(value),
+            '    item.write_body_to_codec(codec)'
+        ]
+
+    def primitive_expr(self, value, namespace):
+        return '[item.to_primitive() for item in {}]'.format(value)
+
+    def skip_lines(self, count, namespace):
+        return [
+            'for _ in xrange({}):'.format(count),
+            '    {}.skip_body_in_codec(codec)'.format(
+                bind(namespace, self.object_class, self.object_class.__name__)
+            )
+        ]
+
+    def __repr__(self):
+        return 'Array({}, count={!r})'.format(self.object_class.__name__, self.count)
+
+class Map(FieldType):
+    """
+    A `dict`, encoded as alternating keys and values of the given types.
+
+    The item count is written directly before the items as type `count`,
+    unless `count` is `None` - in which case the packet has an earlier `COUNT`
+    field of the same name.
+    """
+
+    def __init__(self, key_type, value_type, count=INT16):
+        self.key_type = key_type
+        self.value_type = value_type
+        self.count = count
+
+    def read_expr(self, count, namespace):
+        return 'codec.read_map({}, codec.{}, codec.{})'.format(
+            count, self.key_type.reader, self.value_type.reader
+        )
+
+    def write_lines(self, value, namespace):
+        return ['codec.write_map(codec.{}, codec.{}, {})'.format(
+            self.key_type.writer, self.value_type.writer, value
+        )]
+
+    def skip_lines(self, count, namespace):
+        if self.key_type.format is not None and self.value_type.format is not None:
+            item_size = struct.calcsize('>' + self.key_type.format + self.value_type.format)
+            return ['codec.skip_bytes({} * {})'.format(item_size, count)]
+
+        return ['for _ in xrange({}):'.format(count)] + [
+            '    ' + line
+            for item_type in (self.key_type, self.value_type)
+            for line in item_type.skip_lines(None, namespace)
+        ]
+
+    def __repr__(self):
+        return 'Map({!r}, {!r}, count={!r})'.format(
+            self.key_type, self.value_type, self.count
+        )
+
+def bind(namespace, value, name):
+    """
+    Add `value` to `namespace` for use by generated source, returning the
+    name it's bound to.
+    """
+
+    name = '_' + name
+    while namespace.get(name, value) is not value:
+        name += '_'
+    namespace[name] = value
+    return name
+
+def format_date(date):
+    """
+    Return the `YYYY-MM-DD` string for a `datetime.date` object. Repeated
+    dates return the same cached string.
+    """
+
+    return _date_strings[date]
+
+def format_timestamp(timestamp):
+    """
+    Return the `YYYY-MM-DD HH:MM:SS` string for a `datetime.datetime` object.
+    Repeated timestamps return the same cached string.
+    """
+
+    return _timestamp_strings[timestamp]
+
+class Record(dict):
+    """
+    A `dict` whose keys iterate in the fixed order `key_order` - a tuple of
+    exactly its keys - as an `OrderedDict`'s would, but far cheaper to create.
+    The order is kept when pickled.
+
+    Used for primitives written as JSON, where the key order is kept.
+
+    Example:
+        >>> Record(('type', 'data'), type='Food', data={})
+        Record([('type', 'Food'), ('data', {})])
+    """
+
+    __slots__ = ('key_order',)
+
+    def __init__(self, key_order, *args, **kwargs):
+        dict.__init__(self, *args, **kwargs)
+        self.key_order = key_order
+
+    def __reduce__(self):
+        return (self.__class__, (self.key_order,), None, None, dict.iteritems(self))
+
+    def __iter__(self):
+        return iter(self.key_order)
+
+    def __repr__(self):
+        return '{}({!r})'.format(self.__class__.__name__, self.items())
+
+    def keys(self):
+        return list(self.key_order)
+
+    def values(self):
+        return [self[key] for key in self.key_order]
+
+    def items(self):
+        return [(key, self[key]) for key in self.key_order]
+
+    def iterkeys(self):
+        return iter(self.key_order)
+
+    def itervalues(self):
+        return (self[key] for key in self.key_order)
+
+    def iteritems(self):
+        return ((key, self[key]) for key in self.key_order)
+
+def expand_fields(fields):
+    """
+    Return `fields` with a `COUNT` field inserted before each `Array` or `Map`
+    field that is directly preceded by its item count.
+    """
+
+    expanded = []
+    for field in fields:
+        if field.type.count is not None:
+            expanded.append(Field(field.type.count, field.name, COUNT))
+        expanded.append(field)
+    return expanded
+
+def group_fields(fields):
+    """
+    Return a list of `(is_fixed_width, fields)` tuples, grouping adjacent
+    fixed-width fields so they can share a `struct.Struct`.
+    """
+
+    groups = []
+    for field in expand_fields(fields):
+        is_fixed_width = field.type.format is not None
+        if is_fixed_width and groups and groups[-1][0]:
+            groups[-1][1].append(field)
+        else:
+            groups.append((is_fixed_width, [field]))
+    return groups
+
+def count_variable(name):
+    """
+    Return the name of the local variable holding the item count for the
+    field `name`.
+    """
+
+    return 'count_' + name
+
+def get_struct(fields):
+    """
+    Return a `struct.Struct` for a group of fixed-width fields.
+    """
+
+    return struct.Struct('>' + ''.join(field.type.format for field in fields))
+
+def parse_projection(fields, names, class_name):
+    """
+    Return a dict mapping the names of `fields` to decode to a list of their
+    attribute names to decode in turn, or `None` to decode them entirely.
+
+    `names` is a sequence of attribute names. Attributes of embedded objects
+    are given as dotted names, e.g. `'food.nutrients'`.
+    """
+
+    field_types = {
+        field.name: field.type
+        for field in fields
+        if not field.flags & COUNT
+    }
+
+    projection = {}
+    for name in names:
+        field_name, _, sub_name = name.partition('.')
+        if field_name not in field_types:
+            raise ValueError('{} has no field {!r}'.format(class_name, field_name))
+
+        if not sub_name:
+            projection[field_name] = None
+        elif not isinstance(field_types[field_name], (Object, Array)):
+            raise ValueError('{}.{} has no fields'.format(class_name, field_name))
+        else:
+            sub_names = projection.setdefault(field_name, [])
+            if sub_names is not None:
+                sub_names.append(sub_name)
+
+    return projection
+
+def compile_function(name, lines, namespace, filename):
+    """
+    Compile the source `lines` of function `name`, returning the function.
+    """
+
+    source = '\n'.join(lines) + '\n'
+    exec compile(source, filename, 'exec') in namespace
+    function = namespace[name]
+    function.source = source
+    return function
+
+def compile_reader(fields, class_name, projection=None, read_trailing=True):
+    """
+    Return a `read_body_from_codec` method decoding `fields`.
+
+    If given a `projection` as returned by `parse_projection`, only the
+    projected fields are decoded - the rest are skipped, as by
+    `compile_skipper`, and left unset. If `read_trailing` is false, the
+    method returns after the last projected field, leaving the caller to skip
+    the remainder of the body.
+    """
+
+    namespace = {}
+    lines = ['def read_body_from_codec(self, codec):']
+
+    if projection is not None and not read_trailing:
+        fields = fields[:max([
+            index + 1
+            for index, field in enumerate(fields)
+            if field.name in projection and not field.flags & COUNT
+        ] or [0])]
+
+    for is_fixed_width, group in group_fields(fields):
+        if not is_fixed_width:
+            field, = group
+            count = count_variable(field.name)
+            if projection is None or projection.get(field.name, ()) is None:
+                lines.append('    self.{} = {}'.format(
+                    field.name, field.type.read_expr(count, namespace)
+                ))
+            elif field.name in projection:
+                read_body = field.type.object_class.get_projected_reader(
+                    projection[field.name]
+                )
+                lines.append('    self.{} = {}'.format(
+                    field.name, field.type.read_projected_expr(count, namespace, read_body)
+                ))
+            else:
+                lines.extend(
+                    '    ' + line
+                    for line in field.type.skip_lines(count, namespace)
+                )
+            continue
+
+        formats = []
+        targets = []
+        conversions = []
+        for field in group:
+            if field.flags & COUNT:
+                formats.append(field.type.format)
+                targets.append(count_variable(field.name))
+            elif projection is not None and field.name not in projection:
+                # Pad bytes are skipped by `struct` without being decoded.
+                formats.append('{}x'.format(struct.calcsize('>' + field.type.format)))
+            elif not field.type.converts:
+                formats.append(field.type.format)
+                targets.append('self.' + field.name)
+            else:
+                formats.append(field.type.format)
+                items = [
+                    'value_{}'.format(len(targets) + index)
+                    for index in xrange(field.type.item_count)
+                ]
+                targets.extend(items)
+                conversions.append('    self.{} = {}'.format(
+                    field.name, field.type.decode_expr(items, namespace)
+                ))
+
+        struct_ = struct.Struct('>' + ''.join(formats))
+        if not targets:
+            lines.append('    codec.skip_bytes({})'.format(struct_.size))
+            continue
+
+        lines.append('    {}, = codec.read_struct({})'.format(
+            ', '.join(targets),
+            bind(namespace, struct_, 'struct')
+        ))
+        lines.extend(conversions)
+
+    if len(lines) == 1:
+        lines.append('    pass')
+
+    return compile_function(
+        'read_body_from_codec', lines, namespace,
+        '<{}.read_body_from_codec>'.format(class_name)
+    )
+
+def compile_writer(fields, class_name):
+    """
+    Return a `write_body_to_codec` method encoding `fields`.
+    """
+
+    namespace = {}
+    lines = ['def write_body_to_codec(self, codec):']
+
+    for is_fixed_width, group in group_fields(fields):
+        if not is_fixed_width:
+            field, = group
+            lines.extend(
+                '    ' + line
+                for line in field.type.write_lines('self.' + field.name, namespace)
+            )
+            continue
+
+        values = []
+        for field in group:
+            if field.flags & COUNT:
+                values.append('len(self.{})'.format(field.name))
+            else:
+                values.extend(field.type.encode_exprs('self.' + field.name, namespace))
+
+        lines.append('    codec.write_struct({}, {})'.format(
+            bind(namespace, get_struct(group), 'struct'),
+            ', '.join(values)
+        ))
+
+    return compile_function(
+        'write_body_to_codec', lines, namespace,
+        '<{}.write_body_to_codec>'.format(class_name)
+    )
+
+def compile_skipper(fields, class_name):
+    """
+    Return a `skip_body_in_codec` class method, moving a codec past `fields`.
+    Fixed-width fields are skipped without decoding, unless they hold an item
+    count. Strings and embedded objects are skipped using their length and
+    count fields.
+    """
+
+    namespace = {}
+    lines = ['def skip_body_in_codec(cls, codec):']
+
+    for is_fixed_width, group in group_fields(fields):
+        if not is_fixed_width:
+            field, = group
+            lines.extend(
+                '    ' + line
+                for line in field.type.skip_lines(count_variable(field.name), namespace)
+            )
+            continue
+
+        struct_ = get_struct(group)
+        if not any(field.flags & COUNT for field in group):
+            lines.append('    codec.skip_bytes({})'.format(struct_.size))
+            continue
+
+        targets = []
+        for field in group:
+            if field.flags & COUNT:
+                targets.append(count_variable(field.name))
+            else:
+                targets.extend(['_'] * field.type.item_count)
+
+        lines.append('    {}, = codec.read_struct({})'.format(
+            ', '.join(targets), bind(namespace, struct_, 'struct')
+        ))
+
+    return classmethod(compile_function(
+        'skip_body_in_codec', lines, namespace,
+        '<{}.skip_body_in_codec>'.format(class_name)
+    ))
+
+def compile_converter(fields, names, class_name, convert_value):
+    """
+    Return a `to_dict` method, returning a `Record` mapping the attribute
+    `names`, in order, to primitives - `dict`s, lists, strings and numbers, which can be
+    written as JSON or cheaply pickled.
+
+    Attributes that are `fields` are converted as their type requires. Others,
+    such as properties, are converted by `convert_value`.
+    """
+
+    field_types = {
+        field.name: field.type
+        for field in fields or ()
+        if not field.flags & COUNT
+    }
+
+    namespace = {}
+    lines = ['def to_dict(self):', '    data = {}({})'.format(
+        bind(namespace, Record, 'Record'), bind(namespace, tuple(names), 'key_order')
+    )]
+
+    for name in names:
+        value = 'self.' + name
+        if name in field_types:
+            expr = field_types[name].primitive_expr(value, namespace)
+        else:
+            expr = '{}({})'.format(bind(namespace, convert_value, 'convert_value'), value)
+        lines.append('    data[{!r}] = {}'.format(name, expr))
+
+    lines.append('    return data')
+
+    return compile_function(
+        'to_dict', lines, namespace,
+        '<{}.to_dict>'.format(class_name)
+    )
@@ -0,0 +1,232 @@
+from array import array
+
+from mfpsync.codec import BufferCodec, _PACKET_HEADER, get_packet_types
+from mfpsync.codec import objects
+
+class PacketIndex(object):
+    """
+    Index of the packets within an in-memory buffer, built by reading only
+    their 10-byte headers.
+
+    Packets are returned as `LazyPacket` proxies, which decode their body on
+    first attribute access. This makes counting packets, finding the
+    `SyncResult`, or picking out a few packet types much cheaper than
+    decoding everything.
+
+    Example:
+        >>> index = PacketIndex(response_data)
+        >>> len(index)
+        48122
+        >>> index.sync_result.last_sync_pointers
+        {u'diary': u'...'}
+        >>> for packet in index.filter(DeleteItem):
+        ...     print packet.master_id
+    """
+
+    def __init__(self, data, positions=None, parent=None):
+        """
+        Index the packets in `data` - any object supported by `BufferCodec`.
+
+        `positions` and `parent` are used internally by `filter()`, to create
+        an index of a subset of the packets in `parent`.
+        """
+
+        self.data = data
+
+        # Python 2's `array` has no 64-bit integer typecode - `'l'` is a C
+        # `long`, only 32 bits on some platforms - so starts, which may be
+        # beyond 2GiB, are kept in a list. Lengths and types are read from
+        # 32 and 16-bit header fields.
+        if parent is not None:
+            self.codec = parent.codec
+            self.starts = [parent.starts[position] for position in positions]
+            self.lengths = array('l', (parent.lengths[position] for position in positions))
+            self.types = array('l', (parent.types[position] for position in positions))
+            return
+
+        self.codec = BufferCodec(data)
+        self.starts = []
+        self.lengths = array('l')
+        self.types = array('l')
+        self._scan()
+
+    def _scan(self):
+        """
+        Walk the packet headers, jumping from one packet to the next by its
+        length. A truncated final packet is ignored, as in
+        `Codec.read_packets`.
+        """
+
+        data = self.data
+        data_length = len(data)
+        unpack_from = _PACKET_HEADER.unpack_from
+        header_size = _PACKET_HEADER.size
+
+        start = 0
+        while start + header_size <= data_length:
+            magic_number, length, _, packet_type = unpack_from(data, start)
+            if magic_number != objects.BinaryPacket.MAGIC:
+                raise ValueError('Unexpected magic {:X} at position {}'.format(
+                    magic_number, start
+                ))
+            if length < header_size:
+                raise ValueError('Invalid packet length {} at position {}'.format(
+                    length, start
+                ))
+            if start + length > data_length:
+                break
+
+            self.starts.append(start)
+            self.lengths.append(length)
+            self.types.append(packet_type)
+            start += length
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __iter__(self):
+        for position in xrange(len(self.starts)):
+            yield LazyPacket(self, position)
+
+    def __getitem__(self, position):
+        if isinstance(position, slice):
+            return [self[item] for item in xrange(*position.indices(len(self)))]
+
+        if position < 0:
+            position += len(self)
+        if not 0 <= position < len(self):
+            raise IndexError('packet index out of range')
+
+        return LazyPacket(self, position)
+
+    def get_packet_class(self, packet_type):
+        """
+        Return the `BinaryPacket` subclass for `packet_type`, or
+        `UnknownPacket` if it's unregistered.
+        """
+
+        return self.codec.packet_type_classes.get(packet_type, objects.UnknownPacket)
+
+    def filter(self, *packet_types):
+        """
+        Return a `PacketIndex` of the packets matching any of `packet_types` -
+        either `packet_type` numbers or `BinaryPacket` subclasses.
+        """
+
+        wanted_types = get_packet_types(packet_types)
+        positions = [
+            position
+            for position, packet_type in enumerate(self.types)
+            if packet_type in wanted_types
+        ]
+        return PacketIndex(self.data, positions, parent=self)
+
+    def count_types(self):
+        """
+        Return a dict mapping `packet_type`s to the number of packets of that
+        type.
+        """
+
+        counts = {}
+        for packet_type in self.types:
+            counts[packet_type] = counts.get(packet_type, 0) + 1
+        return counts
+
+    def decode(self, position):
+        """
+        Return the fully decoded packet at `position`.
+        """
+
+        self.codec.position = self.starts[position]
+        return self.codec.read_packet()
+
+    @property
+    def sync_result(self):
+        """
+        Return the decoded `SyncResult` packet, or `None` if there isn't one.
+        """
+
+        for position, packet_type in enumerate(self.types):
+            if packet_type == objects.PACKET_TYPE_SYNC_RESULT:
+                return self.decode(position)
+        return None
+
+    def validate(self):
+        """
+        Check the number of packets against the total `expected_packet_count`
+        of the `SyncResult` packets, as `Codec.read_packets` does - the data
+        may hold several responses, one per page. Throws an `Exception` if
+        they don't match.
+        """
+
+        sync_results = self.filter(objects.PACKET_TYPE_SYNC_RESULT)
+        if not len(sync_results):
+            return
+
+        expected_packet_count = sum(
+            sync_result.expected_packet_count for sync_result in sync_results
+        )
+        packet_count = len(self) - len(sync_results)
+        if packet_count != expected_packet_count:
+            raise Exception('Expected {} objects, received {}'.format(
+                expected_packet_count, packet_count
+            ))
+
+class LazyPacket(object):
+    """
+    Proxy for a packet within a `PacketIndex`. `packet_type`, `packet_start`
+    and `packet_length` are available from the header. Accessing any other
+    attribute decodes the packet body, once.
+
+    `isinstance` checks see the proxied packet's class.
+    """
+
+    __slots__ = ('index', 'position', 'packet')
+
+    def __init__(self, index, position):
+        self.index = index
+        self.position = position
+        self.packet = None
+
+    @property
+    def packet_type(self):
+        return self.index.types[self.position]
+
+    @property
+    def packet_start(self):
+        return self.index.starts[self.position]
+
+    @property
+    def packet_length(self):
+        return self.index.lengths[self.position]
+
+    @property
+    def is_decoded(self):
+        return self.packet is not None
+
+    def decode(self):
+        """
+        Return the decoded packet.
+        """
+
+        if self.packet is None:
+            self.packet = self.index.decode(self.position)
+        return self.packet
+
+    @property
+    def __class__(self):
+        # Packet classes without fields may fall back to `UnknownPacket` when
+        # decoded, so only trust the header for classes with a schema.
+        if self.packet is not None:
+            return self.packet.__class__
+
+        packet_class = self.index.get_packet_class(self.packet_type)
+        if packet_class.fields is None:
+            return self.decode().__class__
+        return packet_class
+
+    def __getattr__(self, name):
+        return getattr(self.decode(), name)
+
+    def __repr__(self):
+        return repr(self.decode())
@@ -0,0 +1,42 @@
+class BoundedCache(dict):
+    """
+    `dict` caching the results of a one-argument `function`, keyed by its
+    argument. Missing keys are computed and added, and the cache is cleared
+    once it reaches `max_size` entries - so lookups of repeated keys are plain
+    `dict` lookups, and memory stays bounded however many distinct keys are
+    seen.
+
+    Example:
+        >>> lengths = BoundedCache(len, max_size=2)
+        >>> lengths['abc']
+        3
+        >>> lengths['de'], lengths['f']
+        (2, 1)
+        >>> len(lengths)
+        1
+
+    Exceptions raised by `function` are passed on, and nothing is cached.
+    """
+
+    __slots__ = ('function', 'max_size')
+
+    # Default `max_size`. Sync responses typically repeat a few hundred
+    # distinct dates across thousands of entries.
+    DEFAULT_MAX_SIZE = 4096
+
+    def __init__(self, function, max_size=DEFAULT_MAX_SIZE):
+        super(BoundedCache, self).__init__()
+        self.function = function
+        self.max_size = max_size
+
+    def __missing__(self, key):
+        value = self.function(key)
+        if len(self) >= self.max_size:
+            self.clear()
+        self[key] = value
+        return value
+
+    def __repr__(self):
+        return '<BoundedCache({!r}, size={}, max_size={})>'.format(
+            self.function, len(self), self.max_size
+        )
@@ -1,7 +1,15 @@
+from array import array
+from collections import OrderedDict
 import datetime
 import uuid
 
-from mfpsync.codec.descriptors import Flag
+from mfpsync.codec.descriptors import ClassDefault, Flag
+from mfpsync.codec.fields import (
+    Array, COUNT, DATE, Field, FloatMap, FLOAT, INT16, INT32, INT64, Map,
+    Object, Record, STRING, UUID, compile_converter, compile_reader,
+    compile_skipper, compile_writer, format_date, format_timestamp,
+    parse_projection
+)
 
 PACKET_TYPE_SYNC_REQUEST = 1
 PACKET_TYPE_SYNC_RESULT = 2
@@ -25,16 +33,131 @@ PACKET_TYPE_FAILED_ITEM_CREATION = 20
 PACKET_TYPE_ADD_DELETED_MOST_USED_FOOD = 21
 PACKET_TYPE_DIARY_NOTE = 23
 
+class BinaryObjectType(type):
+    """
+    Metaclass for `BinaryObject`. If a class lists its `fields`, these are
+    compiled into `read_body_from_codec`, `write_body_to_codec` and
+    `skip_body_in_codec` methods - unless the class defines the methods
+    itself. If a class lists its `repr_names`, a `to_dict` method is compiled
+    in the same way.
+
+    Classes get `__slots__` for their `fields` and `repr_names`, unless they
+    define `__slots__` themselves. Names provided by properties or
+    descriptors, such as `Flag`, are left out - as are class attributes of a
+    base class, such as `packet_type`, which a slot would hide. Use a
+    `ClassDefault` descriptor for a class attribute instances may override.
+    """
+
+    def __new__(mcs, name, bases, attrs):
+        if '__slots__' not in attrs:
+            attrs['__slots__'] = mcs.get_slot_names(bases, attrs)
+
+        fields = attrs.get('fields')
+        if fields is not None:
+            if 'read_body_from_codec' not in attrs:
+                attrs['read_body_from_codec'] = compile_reader(fields, name)
+            if 'write_body_to_codec' not in attrs:
+                attrs['write_body_to_codec'] = compile_writer(fields, name)
+            if 'skip_body_in_codec' not in attrs:
+                attrs['skip_body_in_codec'] = compile_skipper(fields, name)
+
+        repr_names = attrs.get('repr_names')
+        if repr_names is not None and 'to_dict' not in attrs:
+            attrs['to_dict'] = compile_converter(fields, repr_names, name, to_primitive)
+
+        return super(BinaryObjectType, mcs).__new__(mcs, name, bases, attrs)
+
+    @staticmethod
+    def get_slot_names(bases, attrs):
+        """
+        Return a tuple of slot names for a new class.
+        """
+
+        names = [field.name for field in attrs.get('fields') or ()]
+        names.extend(attrs.get('repr_names') or ())
+
+        slot_names = []
+        for name in names:
+            if name in slot_names or name in attrs:
+                continue
+
+            # Skip names already handled by a base class - either slots,
+            # properties and other data descriptors, or class attributes.
+            if any(
+                name in cls.__dict__
+                for base in bases
+                for cls in base.__mro__
+            ):
+                continue
+
+            slot_names.append(name)
+
+        return tuple(slot_names)
+
+# Keys of a `BinaryObject`'s primitive form.
+OBJECT_KEY_ORDER = ('type', 'data')
+
+# Types returned as-is by `to_primitive`, checked before any conversion.
+PRIMITIVE_TYPES = frozenset((bool, int, long, float, str, unicode, type(None)))
+
+def to_primitive(value):
+    """
+    Return `value` converted to primitives, as `BinaryObject.to_primitive`
+    does. Values that are already primitives are returned as-is.
+    """
+
+    if type(value) in PRIMITIVE_TYPES:
+        return value
+    if isinstance(value, (BinaryObject, Nutrients)):
+        return value.to_primitive()
+    if isinstance(value, memoryview):
+        return value.tobytes()
+    if isinstance(value, buffer):
+        return str(value)
+    if isinstance(value, datetime.datetime):
+        return format_timestamp(value)
+    if isinstance(value, datetime.date):
+        return format_date(value)
+    if isinstance(value, (list, tuple)):
+        return [to_primitive(item) for item in value]
+    return value
+
+def unfrozen_class(obj):
+    """
+    Return the class of `obj`, or for a frozen object, the class it was
+    frozen from. Use this rather than `obj.__class__` to look up packets by
+    class, as packets read through a `PacketCache` are frozen.
+    """
+
+    cls = obj.__class__
+    return cls.__bases__[0] if cls.is_frozen else cls
+
 class BinaryObject(object):
     """
     Base class for `Codec` encodable objects. `BinaryObject`'s do not have
     a packet header.
     """
 
+    __metaclass__ = BinaryObjectType
+    __slots__ = ()
+
+    # Tuple of `Field` objects, listing the binary body in order. See
+    # `mfpsync.codec.fields`.
+    fields = None
+
     # Tuple of attribute names shown by a `repr` call. `packet_start` and
     # `packet_length` are implicitly added.
     repr_names = None
 
+    # Set on the immutable subclasses created by `freeze()`.
+    is_frozen = False
+
+    # Dict mapping classes to their frozen subclasses.
+    _frozen_classes = {}
+
+    # Dict mapping `(class, names, read_trailing)` tuples to projected readers.
+    _projected_readers = {}
+
     def __init__(self):
         self.set_default_values()
 
@@ -57,6 +180,142 @@ class BinaryObject(object):
 
         raise NotImplementedError
 
+    @classmethod
+    def skip_body_in_codec(cls, codec):
+        """
+        Move a `Codec` past an encoded object, without decoding it.
+        """
+
+        raise NotImplementedError
+
+    def to_dict(self):
+        """
+        Return a `Record` mapping the object's `repr_names`, in order, to
+        their values as primitives. Embedded objects are converted with
+        `to_primitive`, dates and timestamps to strings, and `Nutrients` to
+        a `Record` of nutrient values.
+        """
+
+        raise NotImplementedError('{} repr_names is unset'.format(
+            self.__class__.__name__
+        ))
+
+    def to_primitive(self):
+        """
+        Return the object as primitives - a `Record` of its class name as
+        `type` and its `to_dict` as `data`, which can be written as JSON or
+        cheaply pickled.
+
+        Example:
+            >>> entry.to_primitive()
+            Record([('type', 'FoodEntry'), ('data', Record([('master_food_id', 1), ...]))])
+        """
+
+        return Record(OBJECT_KEY_ORDER, type=self.__class__.__name__, data=self.to_dict())
+
+    @classmethod
+    def get_projected_reader(cls, names, read_trailing=True):
+        """
+        Return a `read_body_from_codec` style function, decoding only the
+        attributes `names` from an encoded object and skipping the other
+        fields. Attributes of embedded objects are given as dotted names,
+        e.g. `'food.nutrients'`. Unprojected attributes keep their default
+        values.
+
+        If `read_trailing` is false, the function returns after the last
+        projected field rather than skipping the remaining fields - which the
+        caller must do, e.g. using the packet length.
+
+        Example:
+            >>> read_body = FoodEntry.get_projected_reader(('date', 'food.nutrients'))
+            >>> entry = codec.read_object(FoodEntry, read_body)
+        """
+
+        key = (cls, tuple(names), read_trailing)
+        try:
+            return cls._projected_readers[key]
+        except KeyError:
+            pass
+
+        if cls.fields is None:
+            raise ValueError('{} has no fields'.format(cls.__name__))
+
+        reader = compile_reader(
+            cls.fields, cls.__name__,
+            parse_projection(cls.fields, names, cls.__name__),
+            read_trailing
+        )
+        cls._projected_readers[key] = reader
+        return reader
+
+    def freeze(self):
+        """
+        Make the object, and any objects embedded within it, immutable.
+        Embedded lists of objects become tuples. Returns the object.
+
+        Frozen objects can be safely shared - see
+        `mfpsync.codec.cache.FoodRegistry`.
+        """
+
+        if self.is_frozen:
+            return self
+
+        for field in self.fields or ():
+            if field.flags & COUNT:
+                continue
+            if isinstance(field.type, (Object, FloatMap)):
+                getattr(self, field.name).freeze()
+            elif isinstance(field.type, Array):
+                setattr(self, field.name, tuple(
+                    item.freeze() for item in getattr(self, field.name)
+                ))
+
+        self.__class__ = self._get_frozen_class()
+        return self
+
+    @classmethod
+    def _get_frozen_class(cls):
+        """
+        Return an immutable subclass of `cls`, with the same name.
+        """
+
+        try:
+            return cls._frozen_classes[cls]
+        except KeyError:
+            pass
+
+        def __setattr__(self, name, value):
+            raise AttributeError('{} object is frozen'.format(cls.__name__))
+
+        def __delattr__(self, name):
+            raise AttributeError('{} object is frozen'.format(cls.__name__))
+
+        frozen_class = type(cls)(cls.__name__, (cls,), {
+            '__slots__': (),
+            '__module__': cls.__module__,
+            '__setattr__': __setattr__,
+            '__delattr__': __delattr__,
+            'is_frozen': True
+        })
+        cls._frozen_classes[cls] = frozen_class
+        return frozen_class
+
+    def __reduce_ex__(self, protocol):
+        """
+        Pickle support. Objects are pickled by slot values, and frozen objects
+        are pickled via their unfrozen class.
+        """
+
+        cls = unfrozen_class(self)
+
+        state = {}
+        for klass in cls.__mro__:
+            for name in klass.__dict__.get('__slots__', ()):
+                if name not in state and hasattr(self, name):
+                    state[name] = getattr(self, name)
+
+        return (_restore_object, (cls, state, self.is_frozen))
+
     def __repr__(self):
         if self.repr_names is None:
             raise NotImplementedError('{} repr_names is unset'.format(
@@ -71,12 +330,27 @@ class BinaryObject(object):
             for name in self.repr_names
         ))
 
+def _restore_object(cls, state, is_frozen):
+    """
+    Return a new `cls` object with the given slot values, frozen if
+    `is_frozen` is set. Used to unpickle `BinaryObject`s.
+    """
+
+    obj = cls.__new__(cls)
+    for name, value in state.iteritems():
+        setattr(obj, name, value)
+    if is_frozen:
+        obj.__class__ = cls._get_frozen_class()
+    return obj
+
 class BinaryPacket(BinaryObject):
     """
     Base class for `Codec` packets. Sync API requests and responses are a
     series of packets.
     """
 
+    __slots__ = ('packet_start', 'packet_length')
+
     # Magic number, marks the beginning of a packet.
     MAGIC = 0x04D3
 
@@ -103,6 +377,12 @@ class BinaryPacket(BinaryObject):
             codec.write_4_byte_int(packet_end - packet_start) # Length
 
 class UnknownPacket(BinaryPacket):
+    __slots__ = ('_packet_type', 'bytes')
+
+    # The type read from the packet header. The class attribute stays `None`,
+    # as for any unregistered packet.
+    packet_type = ClassDefault('_packet_type', None)
+
     repr_names = (
         'packet_type',
         'bytes',
@@ -112,11 +392,32 @@ class UnknownPacket(BinaryPacket):
         self.bytes = ''
 
     def read_body_from_codec(self, codec):
-        self.bytes = codec.read_bytes(self.packet_start - codec.position + self.packet_length)
+        self.bytes = codec.read_bytes_view(self.packet_start - codec.position + self.packet_length)
+
+    def __reduce_ex__(self, protocol):
+        # `bytes` may be a view into the decoded buffer, which can't be
+        # pickled - so pickle a copy.
+        restore, (cls, state, is_frozen) = super(UnknownPacket, self).__reduce_ex__(protocol)
+        if isinstance(state.get('bytes'), memoryview):
+            state['bytes'] = state['bytes'].tobytes()
+        elif isinstance(state.get('bytes'), buffer):
+            state['bytes'] = str(state['bytes'])
+        return restore, (cls, state, is_frozen)
 
 class SyncRequest(BinaryPacket):
     packet_type = PACKET_TYPE_SYNC_REQUEST
 
+    fields = (
+        Field(INT16, 'api_version'),
+        Field(INT32, 'svn_revision'),
+        Field(INT16, 'unknown1'),
+        Field(STRING, 'username'),
+        Field(STRING, 'password'),
+        Field(INT16, 'flags'),
+        Field(UUID, 'installation_uuid'),
+        Field(Map(STRING, STRING), 'last_sync_pointers')
+    )
+
     repr_names = (
         'api_version',
         'svn_revision',
@@ -138,36 +439,20 @@ class SyncRequest(BinaryPacket):
         self.installation_uuid = uuid.uuid4()
         self.last_sync_pointers = {}
 
-    def read_body_from_codec(self, codec):
-        self.api_version = codec.read_2_byte_int()
-        self.svn_revision = codec.read_4_byte_int()
-        self.unknown1 = codec.read_2_byte_int()
-        self.username = codec.read_string()
-        self.password = codec.read_string()
-        self.flags = codec.read_2_byte_int()
-        self.installation_uuid = codec.read_uuid()
-        self.last_sync_pointers = codec.read_map(
-            codec.read_2_byte_int(),
-            codec.read_string, codec.read_string
-        )
-
-    def write_body_to_codec(self, codec):
-        codec.write_2_byte_int(self.api_version)
-        codec.write_4_byte_int(self.svn_revision)
-        codec.write_2_byte_int(self.unknown1)
-        codec.write_string(self.username)
-        codec.write_string(self.password)
-        codec.write_2_byte_int(self.flags)
-        codec.write_uuid(self.installation_uuid)
-        codec.write_2_byte_int(len(self.last_sync_pointers))
-        codec.write_map(
-            codec.write_string, codec.write_string,
-            self.last_sync_pointers
-        )
-
 class SyncResult(BinaryPacket):
     packet_type = PACKET_TYPE_SYNC_RESULT
 
+    fields = (
+        Field(INT16, 'status_code'),
+        Field(STRING, 'error_message'),
+        Field(STRING, 'optional_extra_message'),
+        Field(INT32, 'master_id'),
+        Field(INT16, 'flags'),
+        Field(INT16, 'last_sync_pointers', COUNT),
+        Field(INT32, 'expected_packet_count'),
+        Field(Map(STRING, STRING, count=None), 'last_sync_pointers')
+    )
+
     repr_names = (
         'status_code',
         'status_message',
@@ -234,38 +519,56 @@ class SyncResult(BinaryPacket):
     def upgrade_url(self, value):
         self.optional_extra_message = '|'.join(self.upgrade_alert or '', value)
 
-    def read_body_from_codec(self, codec):
-        self.status_code = codec.read_2_byte_int()
-        self.error_message = codec.read_string()
-        self.optional_extra_message = codec.read_string()
-        self.master_id = codec.read_4_byte_int()
-        self.flags = codec.read_2_byte_int()
-        last_sync_pointer_count = codec.read_2_byte_int()
-        self.expected_packet_count = codec.read_4_byte_int()
-        self.last_sync_pointers = codec.read_map(
-            last_sync_pointer_count,
-            codec.read_string, codec.read_string
-        )
-
-class Food(BinaryPacket):
-    packet_type = PACKET_TYPE_FOOD
-
+class FoodPortion(BinaryObject):
     repr_names = (
-        'master_food_id',
-        'owner_user_master_id',
-        'original_master_id',
+        'amount',
+        'gram_weight',
         'description',
-        'brand',
-        'flags',
-        'is_public',
-        'is_deleted',
-        'nutrients',
-        'grams',
-        'type',
-        'is_meal',
-        'portions'
+        'fraction_int',
+        'is_fraction'
+    )
+
+    fields = (
+        Field(FLOAT, 'amount'),
+        Field(FLOAT, 'gram_weight'),
+        Field(STRING, 'description'),
+        Field(INT16, 'fraction_int')
     )
 
+    @property
+    def is_fraction(self):
+        return self.fraction_int != 0
+
+    @is_fraction.setter
+    def is_fraction(self, value):
+        self.fraction_int = 1 if value else 0
+
+    def set_default_values(self):
+        self.amount = 0
+        self.gram_weight = 0
+        self.description = ''
+        self.is_fraction = 0
+
+class Nutrients(object):
+    """
+    Nutrient values for a `Food`, in `nutrient_names` order.
+
+    Values are stored in a single `array('f')` rather than a `dict`, but
+    support read-only `dict` style access by nutrient name. Once frozen, by
+    `freeze()`, values are stored in a tuple instead.
+
+    Example:
+        >>> food.nutrients['calories']
+        371.0
+        >>> dict(food.nutrients)['protein']
+        12.0
+    """
+
+    __slots__ = ('array',)
+
+    # Set on `FrozenNutrients`.
+    is_frozen = False
+
     nutrient_names = (
         'calories',
         'fat',
@@ -286,6 +589,160 @@ class Food(BinaryPacket):
         'iron'
     )
 
+    # Dict mapping nutrient names to their index in `nutrient_names`.
+    nutrient_indexes = {
+        name: index
+        for index, name in enumerate(nutrient_names)
+    }
+
+    def __init__(self, values=None):
+        """
+        Create from a sequence of values in `nutrient_names` order. If
+        omitted, all values are zero.
+        """
+
+        if values is None:
+            values = [0.0] * len(self.nutrient_names)
+        self.array = array('f', values)
+
+    def __getitem__(self, name):
+        return self.array[self.nutrient_indexes[name]]
+
+    def __contains__(self, name):
+        return name in self.nutrient_indexes
+
+    def __iter__(self):
+        return iter(self.nutrient_names)
+
+    def __len__(self):
+        return len(self.nutrient_names)
+
+    def __eq__(self, other):
+        if isinstance(other, Nutrients):
+            if self.is_frozen != other.is_frozen:
+                return tuple(self.array) == tuple(other.array)
+            return self.array == other.array
+        return dict(self.iteritems()) == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return repr(dict(self.iteritems()))
+
+    def __reduce__(self):
+        # Pickled by value list, as objects with `__slots__` can't be
+        # pickled by the default protocols 0 and 1.
+        return (_restore_nutrients, (list(self.array), self.is_frozen))
+
+    def freeze(self):
+        """
+        Make the values immutable. Returns the object.
+        """
+
+        if not self.is_frozen:
+            self.array = tuple(self.array)
+            self.__class__ = FrozenNutrients
+        return self
+
+    def get(self, name, default=None):
+        index = self.nutrient_indexes.get(name)
+        return default if index is None else self.array[index]
+
+    def keys(self):
+        return list(self.nutrient_names)
+
+    def values(self):
+        return list(self.array)
+
+    def items(self):
+        return zip(self.nutrient_names, self.array)
+
+    def iterkeys(self):
+        return iter(self.nutrient_names)
+
+    def itervalues(self):
+        return iter(self.array)
+
+    def iteritems(self):
+        return iter(self.items())
+
+    def to_dict(self):
+        """
+        Return an `OrderedDict` of nutrient values, in `nutrient_names`
+        order.
+        """
+
+        return OrderedDict(self.iteritems())
+
+    def to_primitive(self):
+        """
+        Return a `Record` of nutrient values. Like `to_dict`, keys are in
+        `nutrient_names` order, but it's cheaper to create.
+        """
+
+        return Record(self.nutrient_names, zip(self.nutrient_names, self.array))
+
+class FrozenNutrients(Nutrients):
+    """
+    Immutable `Nutrients`, created by `Nutrients.freeze()`.
+    """
+
+    __slots__ = ()
+
+    is_frozen = True
+
+    def __setattr__(self, name, value):
+        raise AttributeError('Nutrients object is frozen')
+
+    def __delattr__(self, name):
+        raise AttributeError('Nutrients object is frozen')
+
+def _restore_nutrients(values, is_frozen):
+    """
+    Return a new `Nutrients` object with `values`, frozen if `is_frozen` is
+    set. Used to unpickle `Nutrients`.
+    """
+
+    nutrients = Nutrients(values)
+    if is_frozen:
+        nutrients.freeze()
+    return nutrients
+
+class Food(BinaryPacket):
+    packet_type = PACKET_TYPE_FOOD
+
+    repr_names = (
+        'master_food_id',
+        'owner_user_master_id',
+        'original_master_id',
+        'description',
+        'brand',
+        'flags',
+        'is_public',
+        'is_deleted',
+        'nutrients',
+        'grams',
+        'type',
+        'is_meal',
+        'portions'
+    )
+
+    nutrient_names = Nutrients.nutrient_names
+
+    fields = (
+        Field(INT32, 'master_food_id'),
+        Field(INT32, 'owner_user_master_id'),
+        Field(INT32, 'original_master_id'),
+        Field(STRING, 'description'),
+        Field(STRING, 'brand'),
+        Field(INT32, 'flags'),
+        Field(FloatMap(Nutrients), 'nutrients'),
+        Field(FLOAT, 'grams'),
+        Field(INT16, 'type'),
+        Field(Array(FoodPortion), 'portions')
+    )
+
     is_public = Flag('flags', 0x1)
     is_deleted = Flag('flags', 0x2)
 
@@ -307,34 +764,11 @@ class Food(BinaryPacket):
         self.description = ''
         self.brand = ''
         self.flags = 0
-        self.nutrients = {}
+        self.nutrients = Nutrients()
         self.grams = 0
         self.type = 0
         self.portions = []
 
-    def read_body_from_codec(self, codec):
-        self.master_food_id = codec.read_4_byte_int()
-        self.owner_user_master_id = codec.read_4_byte_int()
-        self.original_master_id = codec.read_4_byte_int()
-        self.description = codec.read_string()
-        self.brand = codec.read_string()
-        self.flags = codec.read_4_byte_int()
-
-        self.nutrients = {}
-        for nutrient in self.nutrient_names:
-            value = codec.read_float()
-            self.nutrients[nutrient] = value
-
-        self.grams = codec.read_float()
-        self.type = codec.read_2_byte_int()
-
-        portion_count = codec.read_2_byte_int()
-        self.portions = []
-        for _ in xrange(portion_count):
-            food_portion = FoodPortion()
-            food_portion.read_body_from_codec(codec)
-            self.portions.append(food_portion)
-
 class Exercise(BinaryPacket):
     packet_type = PACKET_TYPE_EXERCISE
 
@@ -350,6 +784,16 @@ class Exercise(BinaryPacket):
         'mets',
     )
 
+    fields = (
+        Field(INT32, 'master_exercise_id'),
+        Field(INT32, 'owner_user_master_id'),
+        Field(INT32, 'original_master_exercise_id'),
+        Field(INT16, 'exercise_type'),
+        Field(STRING, 'description'),
+        Field(INT32, 'flags'),
+        Field(FLOAT, 'mets')
+    )
+
     is_public = Flag('flags', 0x1)
     is_deleted = Flag('flags', 0x2)
 
@@ -362,15 +806,6 @@ class Exercise(BinaryPacket):
         self.flags = 0
         self.mets = 0
 
-    def read_body_from_codec(self, codec):
-        self.master_exercise_id = codec.read_4_byte_int()
-        self.owner_user_master_id = codec.read_4_byte_int()
-        self.original_master_exercise_id = codec.read_4_byte_int()
-        self.exercise_type = codec.read_2_byte_int()
-        self.description = codec.read_string()
-        self.flags = codec.read_4_byte_int()
-        self.mets = codec.read_float()
-
 class FoodEntry(BinaryPacket):
     packet_type = PACKET_TYPE_FOOD_ENTRY
 
@@ -383,6 +818,15 @@ class FoodEntry(BinaryPacket):
         'weight_index'
     )
 
+    fields = (
+        Field(INT64, 'master_food_id'),
+        Field(Object(Food), 'food'),
+        Field(DATE, 'date'),
+        Field(STRING, 'meal_name'),
+        Field(FLOAT, 'quantity'),
+        Field(INT32, 'weight_index')
+    )
+
     def set_default_values(self):
         self.master_food_id = 0
         self.food = Food()
@@ -391,15 +835,6 @@ class FoodEntry(BinaryPacket):
         self.quantity = 0
         self.weight_index = 0
 
-    def read_body_from_codec(self, codec):
-        self.master_food_id = codec.read_8_byte_int()
-        self.food = Food()
-        self.food.read_body_from_codec(codec)
-        self.date = codec.read_date()
-        self.meal_name = codec.read_string()
-        self.quantity = codec.read_float()
-        self.weight_index = codec.read_4_byte_int()
-
     @property
     def portion(self):
         return self.food.portions[self.weight_index]
@@ -425,6 +860,16 @@ class ExerciseEntry(BinaryPacket):
         'calories',
     )
 
+    fields = (
+        Field(INT64, 'master_exercise_entry_id'),
+        Field(Object(Exercise), 'exercise'),
+        Field(DATE, 'date'),
+        Field(INT32, 'quantity'),
+        Field(INT32, 'sets'),
+        Field(INT32, 'weight'),
+        Field(INT32, 'calories')
+    )
+
     def set_default_values(self):
         self.master_exercise_id = 0
         self.exercise = Exercise()
@@ -434,16 +879,6 @@ class ExerciseEntry(BinaryPacket):
         self.weight = 0
         self.calories = 0
 
-    def read_body_from_codec(self, codec):
-        self.master_exercise_entry_id = codec.read_8_byte_int()
-        self.exercise = Exercise()
-        self.exercise.read_body_from_codec(codec)
-        self.date = codec.read_date()
-        self.quantity = codec.read_4_byte_int()
-        self.sets = codec.read_4_byte_int()
-        self.weight = codec.read_4_byte_int()
-        self.calories = codec.read_4_byte_int()
-
 class ClientFoodEntry(BinaryPacket):
     packet_type = PACKET_TYPE_CLIENT_FOOD_ENTRY
 
@@ -457,15 +892,13 @@ class MeasurementTypes(BinaryPacket):
         'descriptions',
     )
 
+    fields = (
+        Field(Map(INT32, STRING), 'descriptions'),
+    )
+
     def set_default_values(self):
         self.descriptions = {}
 
-    def read_body_from_codec(self, codec):
-        self.descriptions = codec.read_map(
-            codec.read_2_byte_int(),
-            codec.read_4_byte_int, codec.read_string
-        )
-
 class MeasurementValue(BinaryPacket):
     packet_type = PACKET_TYPE_MEASUREMENT_VALUE
 
@@ -476,17 +909,51 @@ class MeasurementValue(BinaryPacket):
         'value',
     )
 
+    fields = (
+        Field(INT64, 'master_measurement_id'),
+        Field(STRING, 'type_name'),
+        Field(DATE, 'entry_date'),
+        Field(FLOAT, 'value')
+    )
+
     def set_default_values(self):
         self.master_measurement_id = 0
         self.type_name = ''
         self.entry_date = datetime.date.today()
         self.value = 0
 
-    def read_body_from_codec(self, codec):
-        self.master_measurement_id = codec.read_8_byte_int()
-        self.type_name = codec.read_string()
-        self.entry_date = codec.read_date()
-        self.value = codec.read_float()
+class MealIngredient(BinaryObject):
+    repr_names = (
+        'master_ingredient_id',
+        'master_food_id',
+        'fraction_int',
+        'is_fraction',
+        'quantity',
+        'weight_index',
+    )
+
+    fields = (
+        Field(INT32, 'master_ingredient_id'),
+        Field(INT32, 'master_food_id'),
+        Field(INT32, 'fraction_int'),
+        Field(FLOAT, 'quantity'),
+        Field(INT16, 'weight_index')
+    )
+
+    @property
+    def is_fraction(self):
+        return self.fraction_int > 0
+
+    @is_fraction.setter
+    def is_fraction(self, value):
+        self.fraction_int = 1 if value else 0
+
+    def set_default_values(self):
+        self.master_ingredient_id = 0
+        self.master_food_id = 0
+        self.fraction_int = 0
+        self.quantity = 0
+        self.weight_index = 0
 
 class MealIngredients(BinaryPacket):
     packet_type = PACKET_TYPE_MEAL_INGREDIENTS
@@ -495,17 +962,13 @@ class MealIngredients(BinaryPacket):
         'ingredients',
     )
 
-    def set_default_values(self):
-        self.ingredients = []
+    fields = (
+        Field(INT32, 'master_food_id'),
+        Field(Array(MealIngredient, count=INT32), 'ingredients')
+    )
 
-    def read_body_from_codec(self, codec):
-        self.master_food_id = codec.read_4_byte_int()
-        ingredient_count = codec.read_4_byte_int()
+    def set_default_values(self):
         self.ingredients = []
-        for _ in xrange(ingredient_count):
-            ingredient = MealIngredient()
-            ingredient.read_body_from_codec(codec)
-            self.ingredients.append(ingredient)
 
 class MasterIdAssignment(BinaryPacket):
     packet_type = PACKET_TYPE_MASTER_ID_ASSIGNMENT
@@ -517,14 +980,13 @@ class UserPropertyUpdate(BinaryPacket):
         'properties',
     )
 
+    fields = (
+        Field(Map(STRING, STRING), 'properties'),
+    )
+
     def set_default_values(self):
         self.properties = {}
 
-    def read_body_from_codec(self, codec):
-        self.properties = codec.read_map(
-            codec.read_2_byte_int(), codec.read_string, codec.read_string
-        )
-
 class UserRegistration(BinaryPacket):
     packet_type = PACKET_TYPE_USER_REGISTRATION
 
@@ -541,6 +1003,12 @@ class DeleteItem(BinaryPacket):
         'is_destroyed'
     )
 
+    fields = (
+        Field(INT16, 'item_type'),
+        Field(INT64, 'master_id'),
+        Field(INT16, 'status')
+    )
+
     @property
     def is_destroyed(self):
         return self.status == 2
@@ -554,11 +1022,6 @@ class DeleteItem(BinaryPacket):
         self.master_id = 0
         self.status = 0
 
-    def read_body_from_codec(self, codec):
-        self.item_type = codec.read_2_byte_int()
-        self.master_id = codec.read_8_byte_int()
-        self.status = codec.read_2_byte_int()
-
 class SearchRequest(BinaryPacket):
     packet_type = PACKET_TYPE_SEARCH_REQUEST
 
@@ -573,64 +1036,3 @@ class AddDeletedMostUsedFood(BinaryPacket):
 
 class DiaryNote(BinaryPacket):
     packet_type = PACKET_TYPE_DIARY_NOTE
-
-class FoodPortion(BinaryObject):
-    repr_names = (
-        'amount',
-        'gram_weight',
-        'description',
-        'fraction_int',
-        'is_fraction'
-    )
-
-    @property
-    def is_fraction(self):
-        return self.fraction_int != 0
-
-    @is_fraction.setter
-    def is_fraction(self, value):
-        self.fraction_int = 1 if value else 0
-
-    def set_default_values(self):
-        self.amount = 0
-        self.gram_weight = 0
-        self.description = ''
-        self.is_fraction = 0
-
-    def read_body_from_codec(self, codec):
-        self.amount = codec.read_float()
-        self.gram_weight = codec.read_float()
-        self.description = codec.read_string()
-        self.fraction_int = codec.read_2_byte_int()
-
-class MealIngredient(BinaryObject):
-    repr_names = (
-        'master_ingredient_id',
-        'master_food_id',
-        'fraction_int',
-        'is_fraction',
-        'quantity',
-        'weight_index',
-    )
-
-    @property
-    def is_fraction(self):
-        return self.fraction_int > 0
-
-    @is_fraction.setter
-    def is_fraction(self, value):
-        self.fraction_int = 1 if value else 0
-
-    def set_default_values(self):
-        self.master_ingredient_id = 0
-        self.master_food_id = 0
-        self.fraction_int = 0
-        self.quantity = 0
-        self.weight_index = 0
-
-    def read_body_from_codec(self, codec):
-        self.master_ingredient_id = codec.read_4_byte_int()
-        self.master_food_id = codec.read_4_byte_int()
-        self.fraction_int = codec.read_4_byte_int()
-        self.quantity = codec.read_float()
-        self.weight_index = codec.read_2_byte_int()
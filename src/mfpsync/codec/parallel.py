@@ -0,0 +1,163 @@
+"""
+Parallel decoding of saved sync responses, using a `multiprocessing` pool.
+
+The response is first indexed by a header-only scan (see `PacketIndex`), then
+split on packet boundaries into chunks of roughly equal size. Each worker
+process maps the file itself, so only the chunk boundaries and the decoded
+packets are sent between processes. Workers can send packets as primitives -
+see `BinaryObject.to_primitive` - which are cheaper to pickle.
+
+Example:
+    >>> decoder = ParallelDecoder('response.bin', processes=16)
+    >>> for packet in decoder.read_packets(types=(FoodEntry,)):
+    ...     print packet.date, packet.quantity
+"""
+
+import multiprocessing
+
+from mfpsync.codec import BufferCodec, get_packet_types, map_file
+from mfpsync.codec import objects
+from mfpsync.codec.index import PacketIndex
+
+def split_chunks(index, chunk_count):
+    """
+    Return a list of up to `chunk_count` `(start, end)` byte ranges covering
+    the packets in `index`, split on packet boundaries into chunks of roughly
+    equal size.
+    """
+
+    if not len(index):
+        return []
+
+    end = index.starts[-1] + index.lengths[-1]
+    chunk_size = max(1, end // chunk_count)
+
+    chunks = []
+    chunk_start = 0
+    for start, length in zip(index.starts, index.lengths):
+        if start + length - chunk_start >= chunk_size:
+            chunks.append((chunk_start, start + length))
+            chunk_start = start + length
+    if chunk_start < end:
+        chunks.append((chunk_start, end))
+    return chunks
+
+def decode_chunk(args):
+    """
+    Decode the packets between byte positions `start` and `end` of the file
+    `filename`. Runs in a worker process.
+
+    Returns a `(chunk_number, packets, packet_count, expected_packet_counts)`
+    tuple. As in `Codec.read_packets`, `packet_count` includes skipped packets
+    but not `SyncResult` packets, and `SyncResult` packets are always decoded
+    so their `expected_packet_count` can be checked. If `primitives` is set,
+    packets are returned via `to_primitive`.
+    """
+
+    chunk_number, filename, start, end, wanted_types, projections, primitives = args
+
+    codec = BufferCodec(map_file(filename), start)
+    codec.projections = projections
+
+    packets = []
+    expected_packet_counts = []
+    while codec.position < end:
+        packet = codec.read_packet(wanted_types)
+        if packet is None:
+            continue
+        if isinstance(packet, objects.SyncResult):
+            expected_packet_counts.append(packet.expected_packet_count)
+            if wanted_types is not None and packet.packet_type not in wanted_types:
+                continue
+        packets.append(packet.to_primitive() if primitives else packet)
+
+    return chunk_number, packets, codec.packet_count, expected_packet_counts
+
+class ParallelDecoder(object):
+    """
+    Decodes a saved sync response file - as written via
+    `Sync.save_response_fp` - using a pool of worker processes.
+    """
+
+    # Number of chunks per worker process. More, smaller chunks balance the
+    # load better when some packets are slower to decode than others.
+    chunks_per_process = 4
+
+    def __init__(self, filename, processes=None):
+        """
+        Index the packets in the file `filename`. `processes` is the number of
+        worker processes, by default the number of CPUs.
+        """
+
+        self.filename = filename
+        self.processes = processes or multiprocessing.cpu_count()
+        self.index = PacketIndex(map_file(filename))
+
+        # Optional dict mapping `BinaryPacket` subclasses to the attribute
+        # names to decode. See `Codec.projections`.
+        self.projections = None
+
+        # If set, packets are yielded as primitives via `to_primitive`, and
+        # sent from the worker processes in that form.
+        self.primitives = False
+
+    def __len__(self):
+        return len(self.index)
+
+    def __iter__(self):
+        return self.read_packets()
+
+    def get_chunks(self):
+        """
+        Return a list of `(start, end)` byte ranges to decode in parallel.
+        """
+
+        return split_chunks(self.index, self.processes * self.chunks_per_process)
+
+    def read_packets(self, ordered=True, types=None):
+        """
+        Return an iterator yielding decoded packets.
+
+        If `ordered` is false, packets are yielded a chunk at a time as the
+        chunks are decoded, rather than in file order. If `types` is given,
+        only packets of those types are decoded - see `Codec.read_packets`.
+
+        Once all packets are decoded, the total number of packets is checked
+        against the total `expected_packet_count` of the `SyncResult` packets.
+        Throws an `Exception` if they don't match.
+        """
+
+        wanted_types = get_packet_types(types) if types is not None else None
+        tasks = [
+            (
+                chunk_number, self.filename, start, end, wanted_types,
+                self.projections, self.primitives
+            )
+            for chunk_number, (start, end) in enumerate(self.get_chunks())
+        ]
+
+        packet_count = 0
+        expected_packet_counts = []
+
+        pool = multiprocessing.Pool(self.processes)
+        try:
+            imap = pool.imap if ordered else pool.imap_unordered
+            for _, packets, chunk_packet_count, chunk_expected_packet_counts \
+                    in imap(decode_chunk, tasks):
+                packet_count += chunk_packet_count
+                expected_packet_counts.extend(chunk_expected_packet_counts)
+                for packet in packets:
+                    yield packet
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+
+        # A file may hold several responses - one per page - each with its
+        # own `SyncResult`.
+        if expected_packet_counts:
+            expected_packet_count = sum(expected_packet_counts)
+            if packet_count != expected_packet_count:
+                raise Exception('Expected {} objects, received {}'.format(
+                    expected_packet_count, packet_count
+                ))
@@ -1,5 +1,15 @@
+import collections
+import cStringIO
+import errno
+import httplib
 import random
+import socket
 import string
+import threading
+import time
+import urllib2
+import urlparse
+import zlib
 
 class HttpRequestParams(object):
     """
@@ -9,9 +19,13 @@ class HttpRequestParams(object):
     url = 'https://www.myfitnesspal.com/iphone_api/synchronize'
     user_agent = 'Dalvik/1.6.0 (Linux; U; Android 4.4.2; sdk Build/KK)'
 
-    def __init__(self, data):
+    # Content encodings the response may be compressed with, when requested.
+    accept_encoding = 'gzip, deflate'
+
+    def __init__(self, data, compress=False):
         """
-        Set `self.body` and `self.headers` for an encoded sync API request.
+        Set `self.body` and `self.headers` for an encoded sync API request. If
+        `compress` is set, the server is asked to compress the response.
         """
 
         mime_boundary = ''.join(
@@ -21,6 +35,8 @@ class HttpRequestParams(object):
 
         self.body = self._get_body(mime_boundary, data)
         self.headers = self._get_headers(mime_boundary, self.body)
+        if compress:
+            self.headers['Accept-Encoding'] = self.accept_encoding
 
     def _get_body(self, mime_boundary, data):
         """
@@ -50,3 +66,322 @@ class HttpRequestParams(object):
             'Content-Type': 'multipart/form-data; boundary={}'.format(mime_boundary),
             'Content-Length': len(body)
         }
+
+class ConnectionPool(object):
+    """
+    Pool of persistent HTTP/1.1 connections, shared between requests to the
+    same scheme, host and port.
+
+    Example:
+        >>> pool = ConnectionPool(max_size=2, idle_timeout=30)
+        >>> response = pool.request('POST', url, headers, body)
+        >>> data = response.read()
+
+    Connections are returned to the pool once their response has been read to
+    the end. Up to `max_size` idle connections are kept per host, and are
+    discarded after `idle_timeout` seconds unused.
+    """
+
+    connection_classes = {
+        'http': httplib.HTTPConnection,
+        'https': httplib.HTTPSConnection
+    }
+
+    def __init__(self, max_size=4, idle_timeout=60):
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+
+        # Dict mapping `(scheme, host, port)` tuples to a list of
+        # `(connection, released_at)` tuples, most recently released last.
+        self.idle_connections = {}
+        self.lock = threading.Lock()
+
+    def get_connection(self, key):
+        """
+        Return a `(connection, is_reused)` tuple for `key`, reusing an idle
+        connection if one is available.
+        """
+
+        now = time.time()
+        with self.lock:
+            idle_connections = self.idle_connections.get(key, [])
+            while idle_connections:
+                connection, released_at = idle_connections.pop()
+                if now - released_at < self.idle_timeout:
+                    return connection, True
+                connection.close()
+
+        return self.new_connection(key), False
+
+    def new_connection(self, key):
+        """
+        Return a new, unconnected connection for `key`.
+        """
+
+        scheme, host, port = key
+        return self.connection_classes[scheme](host, port)
+
+    def release_connection(self, key, connection):
+        """
+        Return `connection` to the pool, closing it if the pool is full.
+        """
+
+        with self.lock:
+            idle_connections = self.idle_connections.setdefault(key, [])
+            if len(idle_connections) < self.max_size:
+                idle_connections.append((connection, time.time()))
+                return
+
+        connection.close()
+
+    def clear(self):
+        """
+        Close all idle connections.
+        """
+
+        with self.lock:
+            idle_connections, self.idle_connections = self.idle_connections, {}
+
+        for connections in idle_connections.itervalues():
+            for connection, _ in connections:
+                connection.close()
+
+    def request(self, method, url, headers, body=None):
+        """
+        Make an HTTP request, returning a `PooledResponse`. Throws a
+        `urllib2.HTTPError` for non-2xx responses.
+
+        If the server closed a reused connection without sending a status
+        line, the request is retried once on a new connection. Requests
+        aren't otherwise retried - timeouts included - as they might not be
+        idempotent.
+        """
+
+        parsed_url = urlparse.urlsplit(url)
+        key = (
+            parsed_url.scheme,
+            parsed_url.hostname,
+            parsed_url.port or (443 if parsed_url.scheme == 'https' else 80)
+        )
+        path = parsed_url.path or '/'
+        if parsed_url.query:
+            path += '?' + parsed_url.query
+
+        connection, is_reused = self.get_connection(key)
+        while True:
+            try:
+                connection.request(method, path, body, headers)
+                response = connection.getresponse()
+            except (httplib.BadStatusLine, socket.error) as exc:
+                connection.close()
+                if not is_reused or not is_stale_connection_error(exc):
+                    raise
+                # The server closed the idle connection - retry on a new
+                # one, rather than another idle one that may be as stale.
+                connection, is_reused = self.new_connection(key), False
+                continue
+            except BaseException:
+                connection.close()
+                raise
+            break
+
+        pooled_response = PooledResponse(self, key, connection, response)
+
+        if not 200 <= response.status < 300:
+            # The body is read up front, so the connection can be reused -
+            # and as `urllib2.HTTPError` needs a file object with `readline`.
+            raise urllib2.HTTPError(
+                url, response.status, response.reason, response.msg,
+                cStringIO.StringIO(pooled_response.read())
+            )
+
+        return pooled_response
+
+def is_stale_connection_error(exc):
+    """
+    Return whether `exc`, raised making a request on a reused connection,
+    shows the server closed the connection before responding - so the request
+    can safely be sent again. Timeouts aren't, as the server may be handling
+    the request.
+    """
+
+    if isinstance(exc, httplib.BadStatusLine):
+        return True
+    return not isinstance(exc, socket.timeout) \
+        and exc.errno in (errno.ECONNRESET, errno.EPIPE)
+
+class PooledResponse(object):
+    """
+    File-like wrapper for a `httplib.HTTPResponse`, returning its connection to
+    the `ConnectionPool` once the response has been read to the end.
+    """
+
+    def __init__(self, pool, key, connection, response):
+        self.pool = pool
+        self.key = key
+        self.connection = connection
+        self.response = response
+        self.headers = response.msg
+
+    def getcode(self):
+        """
+        Return the HTTP status code.
+        """
+
+        return self.response.status
+
+    def read(self, byte_count=None):
+        """
+        Return up to `byte_count` bytes of the response body, or the rest of
+        the body if `byte_count` is omitted.
+        """
+
+        data = self.response.read(byte_count)
+        if self.connection is not None and self.response.isclosed():
+            self.release()
+        return data
+
+    def release(self):
+        """
+        Return the connection to the pool, or close it if the server won't
+        accept further requests.
+        """
+
+        connection, self.connection = self.connection, None
+        if self.response.will_close:
+            connection.close()
+        else:
+            self.pool.release_connection(self.key, connection)
+
+    def close(self):
+        """
+        Close the response. If it hasn't been read to the end, the connection
+        can't be reused, so is closed.
+        """
+
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+        self.response.close()
+
+class DecompressingReader(object):
+    """
+    File-like object that incrementally decompresses a gzip or deflate
+    encoded file object `fp`.
+
+    Compressed data is read and decompressed `chunk_size` bytes at a time, so
+    neither the compressed nor the decompressed data is held in full. If
+    `tee_fp` is given, the compressed data is also written to it as it's
+    read.
+    """
+
+    chunk_size = 16384
+
+    def __init__(self, fp, content_encoding, tee_fp=None):
+        """
+        Configures class to decompress `fp`, compressed with
+        `content_encoding` - either `gzip` or `deflate`.
+        """
+
+        if content_encoding not in ('gzip', 'deflate'):
+            raise ValueError('Unsupported content encoding {!r}'.format(content_encoding))
+
+        self.fp = fp
+        self.content_encoding = content_encoding
+        self.tee_fp = tee_fp
+        self.decompressor = None
+        self.eof = False
+
+        # Decompressed data not yet read, as a deque of strings - the first
+        # read from `self.offset` - totalling `self.buffered_count` bytes.
+        # Reads only copy the bytes they return.
+        self.chunks = collections.deque()
+        self.offset = 0
+        self.buffered_count = 0
+
+    def _get_decompressor(self, data):
+        """
+        Return a `zlib` decompressor for a stream starting with `data`.
+        """
+
+        if self.content_encoding == 'gzip':
+            return zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+        # "deflate" should be zlib-wrapped, but some servers send a raw
+        # deflate stream. Zlib headers are a multiple of 31 when read as a
+        # big-endian 2-byte int, and specify compression method 8.
+        if len(data) >= 2 and (ord(data[0]) & 0x0F) == 8 \
+                and (ord(data[0]) * 256 + ord(data[1])) % 31 == 0:
+            return zlib.decompressobj(zlib.MAX_WBITS)
+        return zlib.decompressobj(-zlib.MAX_WBITS)
+
+    def _fill(self):
+        """
+        Decompress up to `chunk_size` more bytes into `self.chunks`, setting
+        `self.eof` at the end of the stream.
+        """
+
+        if self.decompressor is not None and self.decompressor.unconsumed_tail:
+            data = self.decompressor.unconsumed_tail
+        else:
+            data = self.fp.read(self.chunk_size)
+            if not data:
+                if self.decompressor is not None:
+                    self._append(self.decompressor.flush())
+                self.eof = True
+                return
+            if self.tee_fp is not None:
+                self.tee_fp.write(data)
+            if self.decompressor is None:
+                self.decompressor = self._get_decompressor(data)
+
+        self._append(self.decompressor.decompress(data, self.chunk_size))
+
+    def _append(self, data):
+        """
+        Add decompressed `data` to the end of `self.chunks`.
+        """
+
+        if data:
+            self.chunks.append(data)
+            self.buffered_count += len(data)
+
+    def read(self, byte_count=None):
+        """
+        Return up to `byte_count` decompressed bytes, or the rest of the
+        stream if `byte_count` is omitted.
+        """
+
+        while not self.eof and (byte_count is None or self.buffered_count < byte_count):
+            self._fill()
+
+        if byte_count is None or byte_count >= self.buffered_count:
+            byte_count = self.buffered_count
+
+        chunks = self.chunks
+        parts = []
+        remaining = byte_count
+        while remaining:
+            chunk = chunks[0]
+            end = self.offset + remaining
+            if end < len(chunk):
+                parts.append(chunk[self.offset:end])
+                self.offset = end
+                break
+            parts.append(chunk[self.offset:] if self.offset else chunk)
+            remaining -= len(chunk) - self.offset
+            chunks.popleft()
+            self.offset = 0
+
+        self.buffered_count -= byte_count
+        return parts[0] if len(parts) == 1 else ''.join(parts)
+
+    def close(self):
+        """
+        Close the underlying file object.
+        """
+
+        self.fp.close()
+
+# Connection pool shared by `Sync` objects.
+default_connection_pool = ConnectionPool()
@@ -1,20 +1,71 @@
-from collections import OrderedDict
 import argparse
-import datetime
 import json
 import os.path
 import sys
 
-from mfpsync import Sync
-from mfpsync.codec.objects import BinaryObject, SyncResult
+from mfpsync import AllPackets, Sync
+from mfpsync.codec import Codec, objects
+from mfpsync.codec.objects import BinaryPacket
+from mfpsync.output import FORMATS, read_packets, write_packets
 
-def main():
-    parser = argparse.ArgumentParser()
+# Kept for compatibility - `JSONEncoder` was defined here before moving to
+# `mfpsync.output`.
+from mfpsync.output import JSONEncoder
+
+# Subsystems are imported by the commands using them, so each command only
+# pays for its own imports at startup.
+
+def main(argv=None):
+    """
+    Command line entry point. Runs a subcommand if the first argument names
+    one, otherwise syncs - `mfpsync USERNAME PASSWORD` is short for
+    `mfpsync sync USERNAME PASSWORD`. A username that's also a subcommand
+    name needs the explicit `sync` subcommand.
+    """
+
+    if argv is None:
+        argv = sys.argv[1:]
+
+    if argv and argv[0] in COMMANDS:
+        return COMMANDS[argv[0]](argv[1:])
+    return sync_command(argv)
+
+def sync_command(argv):
+    """
+    Output all packets for a user as JSON.
+    """
+
+    parser = argparse.ArgumentParser(
+        prog='mfpsync [sync]',
+        epilog='The sync subcommand may be omitted, unless USERNAME is a subcommand '
+               'name: {}.'.format(', '.join(sorted(COMMANDS)))
+    )
     parser.add_argument('username')
     parser.add_argument('password')
     parser.add_argument('-P', '--pointers-filename', required=False)
+    parser.add_argument('-z', '--compress', action='store_true',
+                        help='request compressed responses')
+    parser.add_argument('-t', '--types', type=packet_classes,
+                        help='comma-separated packet types to output, e.g. FoodEntry,DeleteItem')
+    parser.add_argument('-f', '--format', choices=FORMATS.keys(),
+                        help='output format - a JSON array (the default), or one JSON object per line')
+    parser.add_argument('-s', '--store', metavar='STORE_FILENAME',
+                        help='ingest packets into an SQLite store, resuming from its sync pointers')
+    parser.add_argument('-p', '--pipeline', action='store_true',
+                        help='fetch the next page while decoding and writing the current one')
 
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
+
+    if args.store:
+        # A store keeps its own sync pointers, and needs every packet type.
+        for option, value in (
+            ('--types', args.types),
+            ('--pointers-filename', args.pointers_filename),
+            ('--format', args.format)
+        ):
+            if value is not None:
+                parser.error('{} cannot be used with --store'.format(option))
+        return store_command(args)
 
     last_sync_pointers = {}
     if args.pointers_filename:
@@ -26,64 +77,352 @@ def main():
                 raise
 
     sync = Sync(args.username, args.password)
-    packets = AllPackets(sync, last_sync_pointers)
-    sys.stdout.write("[")
-    first_packet = True
-    for packet in packets:
-        sys.stdout.write(
-            ("\n" if first_packet else ",\n") + indent(
-                json.dumps(packet, cls=JSONEncoder, indent=4),
-                "    "
-            )
-        )
-        first_packet = False
-    sys.stdout.write("\n]")
+    sync.compress = args.compress
+    packets_class = get_packets_class(args.pipeline)
+    packets = packets_class(sync, last_sync_pointers, types=args.types)
+    write_packets(packets, sys.stdout, args.format or 'json')
 
     if args.pointers_filename:
         with open(args.pointers_filename, "w") as fp:
             json.dump(packets.last_sync_pointers, fp)
 
-def indent(string, prefix):
-    return "\n".join(
-        prefix + line
-        for line in string.split("\n")
+def store_command(args):
+    """
+    Ingest packets for a user into an SQLite store, syncing from the store's
+    last sync pointers.
+    """
+
+    from mfpsync.store import Store
+
+    store = Store(args.store)
+    try:
+        sync = Sync(args.username, args.password)
+        sync.compress = args.compress
+        packets_class = get_packets_class(args.pipeline)
+        packet_count = store.ingest(packets_class(sync, store.last_sync_pointers))
+    finally:
+        store.close()
+
+    sys.stderr.write('Stored {} packets\n'.format(packet_count))
+
+def batch_command(argv):
+    """
+    Sync many accounts in one process, each to its own output file or store,
+    and report on each.
+    """
+
+    from mfpsync import batch
+
+    parser = argparse.ArgumentParser(prog='mfpsync batch')
+    parser.add_argument('accounts_filename', metavar='ACCOUNTS',
+                        help='JSON array of {"username", "password", "name"} objects')
+    parser.add_argument('-o', '--output-directory', required=True,
+                        help='directory to write per-account output and sync pointers to')
+    parser.add_argument('-j', '--concurrency', type=int, default=8,
+                        help='number of accounts to sync at a time')
+    parser.add_argument('-f', '--format', choices=FORMATS.keys() + [batch.STORE_FORMAT],
+                        default='ndjson',
+                        help='output format, or sqlite to ingest into a store per account')
+    parser.add_argument('-z', '--compress', action='store_true',
+                        help='request compressed responses')
+    parser.add_argument('-t', '--types', type=packet_classes,
+                        help='comma-separated packet types to output, e.g. FoodEntry,DeleteItem')
+    parser.add_argument('-p', '--pipeline', action='store_true',
+                        help='fetch the next page while decoding and writing the current one')
+    parser.add_argument('-r', '--report', metavar='REPORT_FILENAME',
+                        help='write per-account results to this file as JSON')
+
+    args = parser.parse_args(argv)
+
+    if args.concurrency < 1:
+        parser.error('--concurrency must be at least 1')
+    if args.format == batch.STORE_FORMAT and args.types is not None:
+        parser.error('--types cannot be used with the sqlite format')
+
+    try:
+        with open(args.accounts_filename) as fp:
+            accounts = batch.load_accounts(fp)
+    except ValueError as exc:
+        parser.error('{}: {}'.format(args.accounts_filename, exc))
+
+    batch_sync = batch.BatchSync(
+        args.output_directory, concurrency=args.concurrency, format=args.format,
+        types=args.types, compress=args.compress, pipeline=args.pipeline
     )
 
-class AllPackets(object):
-    def __init__(self, sync, last_sync_pointers={}):
-        self.sync = sync
-        self.last_sync_pointers = last_sync_pointers
-
-    def __iter__(self):
-        while True:
-            sync_result = None
-            for packet in self.sync.get_packets(last_sync_pointers=self.last_sync_pointers):
-                if isinstance(packet, SyncResult):
-                    sync_result = packet
-                yield packet
-
-            self.last_sync_pointers = sync_result.last_sync_pointers
-            if not sync_result.more_data_to_sync:
-                break
-
-class JSONEncoder(json.JSONEncoder):
-    def default(self, obj):
-        if isinstance(obj, BinaryObject):
-            return OrderedDict((
-                ('type', obj.__class__.__name__),
-                ('data', {
-                    name: getattr(obj, name)
-                    for name in obj.repr_names
-                })
-            ))
-
-        if isinstance(obj, datetime.datetime):
-            return obj.strftime('%Y-%m-%d %H:%M:%S')
-
-        if isinstance(obj, datetime.date):
-            return obj.strftime('%Y-%m-%d')
-
-        return super(JSONEncoder, self).default(obj)
+    def progress(result, finished_count):
+        sys.stderr.write('[{}/{}] {}: {}\n'.format(
+            finished_count, len(accounts), result.account.name,
+            result.error or '{} packets in {:.2f}s'.format(result.packet_count, result.duration)
+        ))
+    batch_sync.progress_callback = progress
+
+    results = batch_sync.run(accounts)
+
+    batch.write_report(results, sys.stderr)
+    if args.report:
+        with open(args.report, 'w') as fp:
+            json.dump([result.to_dict() for result in results], fp, indent=4)
+
+    if any(result.error is not None for result in results):
+        return 1
+
+def schedule_command(argv):
+    """
+    Keep many accounts synced, each to its own output file or store, adapting
+    concurrency to the server. Runs until interrupted.
+    """
+
+    from mfpsync import batch, scheduler
+
+    parser = argparse.ArgumentParser(prog='mfpsync schedule')
+    parser.add_argument('accounts_filename', metavar='ACCOUNTS',
+                        help='JSON array of {"username", "password", "name"} objects')
+    parser.add_argument('-o', '--output-directory', required=True,
+                        help='directory to write per-account output and sync pointers to')
+    parser.add_argument('-f', '--format', choices=FORMATS.keys() + [batch.STORE_FORMAT],
+                        default='ndjson',
+                        help='output format, or sqlite to ingest into a store per account')
+    parser.add_argument('-z', '--compress', action='store_true',
+                        help='request compressed responses')
+    parser.add_argument('-t', '--types', type=packet_classes,
+                        help='comma-separated packet types to output, e.g. FoodEntry,DeleteItem')
+    parser.add_argument('-p', '--pipeline', action='store_true',
+                        help='fetch the next page while decoding and writing the current one')
+    parser.add_argument('-j', '--max-concurrency', type=int, default=32,
+                        help='most accounts to sync at a time')
+    parser.add_argument('-R', '--rate', type=float, default=10.0,
+                        help='most requests per second, across all accounts')
+    parser.add_argument('--burst', type=float,
+                        help='most requests in a burst above --rate')
+    parser.add_argument('--latency-target', type=float,
+                        help='seconds of mean request latency above which concurrency is reduced')
+    parser.add_argument('--min-interval', type=float, default=scheduler.FleetScheduler.min_interval,
+                        help='seconds between syncs of the busiest accounts')
+    parser.add_argument('--max-interval', type=float, default=scheduler.FleetScheduler.max_interval,
+                        help='seconds between syncs of the quietest accounts')
+    parser.add_argument('-d', '--duration', type=float,
+                        help='seconds to run for, rather than until interrupted')
+    parser.add_argument('--status-interval', type=float, default=60.0,
+                        help='seconds between status lines')
+
+    args = parser.parse_args(argv)
+
+    if args.max_concurrency < 1:
+        parser.error('--max-concurrency must be at least 1')
+    if args.rate <= 0:
+        parser.error('--rate must be positive')
+    if not 0 < args.min_interval <= args.max_interval:
+        parser.error('--min-interval must be positive, and at most --max-interval')
+    if args.format == batch.STORE_FORMAT and args.types is not None:
+        parser.error('--types cannot be used with the sqlite format')
+
+    try:
+        with open(args.accounts_filename) as fp:
+            accounts = batch.load_accounts(fp)
+    except ValueError as exc:
+        parser.error('{}: {}'.format(args.accounts_filename, exc))
+
+    fleet_scheduler = scheduler.FleetScheduler(
+        args.output_directory, format=args.format, types=args.types,
+        compress=args.compress, pipeline=args.pipeline,
+        max_concurrency=args.max_concurrency, request_rate=args.rate,
+        burst=args.burst, latency_target=args.latency_target
+    )
+    fleet_scheduler.min_interval = args.min_interval
+    fleet_scheduler.max_interval = args.max_interval
+    fleet_scheduler.status_interval = args.status_interval
+
+    def status(fleet_scheduler):
+        controller = fleet_scheduler.controller
+        sys.stderr.write(
+            'concurrency {}, {} running, {} requests ({} failed), '
+            'latency {}, max staleness {:.0f}s\n'.format(
+                controller.concurrency, fleet_scheduler.running_count,
+                controller.request_count, controller.error_count,
+                '{:.2f}s'.format(controller.latency) if controller.latency is not None else '-',
+                fleet_scheduler.get_max_staleness()
+            )
+        )
+    fleet_scheduler.status_callback = status
+
+    try:
+        states = fleet_scheduler.run(accounts, duration=args.duration)
+    except KeyboardInterrupt:
+        states = fleet_scheduler.states
+
+    batch.write_report([state.result for state in states if state.result is not None], sys.stderr)
+
+def replay_command(argv):
+    """
+    Output the packets in saved response files as JSON. Files are
+    memory-mapped, and optionally decoded by a pool of worker processes.
+    """
+
+    parser = argparse.ArgumentParser(prog='mfpsync replay')
+    parser.add_argument('filenames', metavar='FILE', nargs='+',
+                        help='response saved via Sync.save_response_fp')
+    parser.add_argument('-t', '--types', type=packet_classes,
+                        help='comma-separated packet types to output, e.g. FoodEntry,DeleteItem')
+    parser.add_argument('-f', '--format', choices=FORMATS.keys(), default='json',
+                        help='output format - a JSON array, or one JSON object per line')
+    parser.add_argument('-j', '--processes', type=int, default=1,
+                        help='number of worker processes to decode with')
+    parser.add_argument('-c', '--cache', metavar='CACHE_FILENAME',
+                        help='SQLite file caching decoded packets between runs')
+
+    args = parser.parse_args(argv)
+
+    if args.cache:
+        from mfpsync.codec.cache import PacketCache
+        packet_cache = PacketCache(path=args.cache)
+    else:
+        packet_cache = None
+    try:
+        write_packets(
+            (
+                packet
+                for filename in args.filenames
+                for packet in replay_file(filename, args.types, args.processes, packet_cache)
+            ),
+            sys.stdout, args.format
+        )
+    finally:
+        if packet_cache is not None:
+            packet_cache.close()
+            sys.stderr.write('{!r}\n'.format(packet_cache))
+
+def replay_file(filename, types=None, processes=1, packet_cache=None):
+    """
+    Return an iterator yielding the packets in the saved response file
+    `filename`. `packet_cache` is only used when decoding in a single
+    process. Packets decoded by several processes are yielded as primitives,
+    as they're only written out.
+    """
+
+    if processes > 1:
+        from mfpsync.codec.parallel import ParallelDecoder
+        decoder = ParallelDecoder(filename, processes)
+        decoder.primitives = True
+        return decoder.read_packets(types=types)
+
+    codec = Codec.from_file(filename)
+    codec.packet_cache = packet_cache
+    return codec.read_packets(types)
+
+def split_command(argv):
+    """
+    Split saved response files into shards, and write a manifest.
+    """
+
+    from mfpsync import shards
+
+    parser = argparse.ArgumentParser(prog='mfpsync split')
+    parser.add_argument('filenames', metavar='FILE', nargs='+',
+                        help='response saved via Sync.save_response_fp')
+    parser.add_argument('-n', '--shards', type=int, required=True,
+                        help='number of shards to split into')
+    parser.add_argument('-o', '--output-directory', required=True,
+                        help='directory to write shards and manifest.json to')
+
+    args = parser.parse_args(argv)
+
+    if args.shards < 1:
+        parser.error('--shards must be at least 1')
+
+    if not os.path.isdir(args.output_directory):
+        os.makedirs(args.output_directory)
+
+    manifest = shards.split_captures(args.filenames, args.shards, args.output_directory)
+    for shard in manifest['shards']:
+        sys.stderr.write('{}: {} packets, {} bytes\n'.format(
+            shard['filename'], shard['packet_count'], shard['length']
+        ))
+
+def decode_shard_command(argv):
+    """
+    Output the packets of a shard as JSON.
+    """
+
+    from mfpsync import shards
+
+    parser = argparse.ArgumentParser(prog='mfpsync decode-shard')
+    parser.add_argument('manifest_filename', metavar='MANIFEST')
+    parser.add_argument('shard_number', metavar='SHARD', type=int)
+    parser.add_argument('-f', '--format', choices=FORMATS.keys(), default='json',
+                        help='output format - a JSON array, or one JSON object per line')
+
+    args = parser.parse_args(argv)
+
+    manifest = shards.load_manifest(args.manifest_filename)
+    write_packets(shards.decode_shard(manifest, args.shard_number), sys.stdout, args.format)
+
+def merge_command(argv):
+    """
+    Check decoded shards against their manifest, and output their packets as
+    JSON. Decoded shards may be in either output format.
+    """
+
+    from mfpsync import shards
+
+    parser = argparse.ArgumentParser(prog='mfpsync merge')
+    parser.add_argument('manifest_filename', metavar='MANIFEST')
+    parser.add_argument('filenames', metavar='DECODED', nargs='+',
+                        help='decode-shard output, in shard order')
+    parser.add_argument('-f', '--format', choices=FORMATS.keys(), default='json',
+                        help='output format - a JSON array, or one JSON object per line')
+
+    args = parser.parse_args(argv)
+
+    manifest = shards.load_manifest(args.manifest_filename)
+    decoded_shards = [read_file_packets(filename) for filename in args.filenames]
+    write_packets(shards.merge_shards(manifest, decoded_shards), sys.stdout, args.format)
+
+def read_file_packets(filename):
+    """
+    Return an iterator yielding the packets parsed from the output file
+    `filename`. The file is opened once iterated, and closed once read.
+    """
+
+    with open(filename) as fp:
+        for packet in read_packets(fp):
+            yield packet
+
+def get_packets_class(pipeline):
+    """
+    Return `PipelinedPackets` if `pipeline` is set, otherwise `AllPackets`.
+    """
+
+    if pipeline:
+        from mfpsync.pipeline import PipelinedPackets
+        return PipelinedPackets
+    return AllPackets
+
+def packet_classes(value):
+    """
+    Return a list of `BinaryPacket` subclasses for a comma-separated string
+    of class names.
+    """
+
+    classes = []
+    for name in value.split(','):
+        packet_class = getattr(objects, name.strip(), None)
+        if not (isinstance(packet_class, type) and issubclass(packet_class, BinaryPacket)
+                and packet_class.packet_type is not None):
+            raise argparse.ArgumentTypeError('Unknown packet type {!r}'.format(name))
+        classes.append(packet_class)
+    return classes
+
+# Dict mapping subcommand names to functions taking the remaining arguments.
+COMMANDS = {
+    'sync': sync_command,
+    'batch': batch_command,
+    'schedule': schedule_command,
+    'replay': replay_command,
+    'split': split_command,
+    'decode-shard': decode_shard_command,
+    'merge': merge_command
+}
 
 if __name__ == '__main__':
     main()
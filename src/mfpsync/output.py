@@ -0,0 +1,289 @@
+"""
+Writers for decoded packets, used by the command line interface.
+
+Two formats are supported:
+
+    json
+        A JSON array, with each packet indented by four spaces.
+    ndjson
+        Newline-delimited JSON - one compact object per line.
+
+Example:
+    >>> write_packets(AllPackets(Sync(username, password)), sys.stdout, 'ndjson')
+"""
+
+from collections import OrderedDict
+import json
+import re
+
+from mfpsync.codec.objects import to_primitive
+
+_INFINITY = float('inf')
+
+class JSONEncoder(json.JSONEncoder):
+    """
+    Encodes packets via their `to_primitive` method, along with any other
+    values `mfpsync.codec.objects.to_primitive` can convert.
+    """
+
+    def default(self, obj):
+        primitive = to_primitive(obj)
+        if primitive is not obj:
+            return primitive
+
+        return super(JSONEncoder, self).default(obj)
+
+    def append_indented(self, parts, value, level):
+        """
+        Append the pieces of the JSON encoding of `value` to the list `parts`,
+        indented as if nested `level` levels deep - as `encode` would indent
+        it as an item of `level` nested arrays. Requires `indent` to be set.
+
+        Arrays and objects are laid out here, using `indent`,
+        `item_separator` and `key_separator`, and numbers and constants are
+        formatted as `encode` formats them. Strings are encoded by `encode`,
+        and other values converted by `default`.
+        """
+
+        if isinstance(value, dict):
+            if not value:
+                parts.append('{}')
+                return
+            newline_indent = '\n' + ' ' * (self.indent * (level + 1))
+            parts.append('{' + newline_indent)
+            for number, (key, item) in enumerate(value.iteritems()):
+                if number:
+                    parts.append(self.item_separator + newline_indent)
+                parts.append(self.encode(self.get_key(key)) + self.key_separator)
+                self.append_indented(parts, item, level + 1)
+            parts.append('\n' + ' ' * (self.indent * level) + '}')
+        elif isinstance(value, (list, tuple)):
+            if not value:
+                parts.append('[]')
+                return
+            newline_indent = '\n' + ' ' * (self.indent * (level + 1))
+            parts.append('[' + newline_indent)
+            for number, item in enumerate(value):
+                if number:
+                    parts.append(self.item_separator + newline_indent)
+                self.append_indented(parts, item, level + 1)
+            parts.append('\n' + ' ' * (self.indent * level) + ']')
+        elif isinstance(value, basestring):
+            parts.append(self.encode(value))
+        elif value is None:
+            parts.append('null')
+        elif value is True:
+            parts.append('true')
+        elif value is False:
+            parts.append('false')
+        elif isinstance(value, (int, long)):
+            parts.append(str(value))
+        elif isinstance(value, float):
+            # Infinite and NaN values are left to `encode`, which checks
+            # `allow_nan`.
+            parts.append(repr(value) if -_INFINITY < value < _INFINITY else self.encode(value))
+        else:
+            self.append_indented(parts, self.default(value), level)
+
+    def get_key(self, key):
+        """
+        Return the string an object key is encoded as, converting keys that
+        aren't strings as `encode` does.
+        """
+
+        if isinstance(key, basestring):
+            return key
+        if key is True:
+            return 'true'
+        if key is False:
+            return 'false'
+        if key is None:
+            return 'null'
+        if isinstance(key, (int, long)):
+            return str(key)
+        if isinstance(key, float):
+            return self.encode(key)
+        raise TypeError('key {!r} is not a string'.format(key))
+
+class PacketWriter(object):
+    """
+    Base class for packet writers. Writes packets to the file object `fp` as
+    they're given.
+
+    Example:
+        >>> writer = NDJSONWriter(sys.stdout)
+        >>> for packet in packets:
+        ...     writer.write(packet)
+        >>> writer.close()
+    """
+
+    def __init__(self, fp):
+        self.fp = fp
+        self.packet_count = 0
+
+    def write(self, packet):
+        """
+        Write a single packet.
+        """
+
+        raise NotImplementedError
+
+    def close(self):
+        """
+        Finish writing. Does not close `fp`.
+        """
+
+    def write_all(self, packets):
+        """
+        Write each packet in the iterable `packets`, then finish writing.
+        """
+
+        write = self.write
+        for packet in packets:
+            write(packet)
+        self.close()
+
+class JSONArrayWriter(PacketWriter):
+    """
+    Writes packets as a JSON array, each indented by four spaces. Output is
+    the same as `json.dumps(packets, indent=4)`.
+    """
+
+    def __init__(self, fp):
+        super(JSONArrayWriter, self).__init__(fp)
+        self.encoder = JSONEncoder(indent=4)
+        self.fp.write('[')
+
+    def write(self, packet):
+        # Write the packet as an item of the array, one level deep.
+        parts = [
+            '\n    ' if not self.packet_count
+            else self.encoder.item_separator + '\n    '
+        ]
+        self.encoder.append_indented(parts, packet, 1)
+        self.fp.writelines(parts)
+        self.packet_count += 1
+
+    def close(self):
+        self.fp.write('\n]' if self.packet_count else ']')
+
+class NDJSONWriter(PacketWriter):
+    """
+    Writes packets as newline-delimited JSON - one compact object per line.
+    """
+
+    def __init__(self, fp):
+        super(NDJSONWriter, self).__init__(fp)
+        self.encoder = JSONEncoder(separators=(',', ':'))
+
+    def write(self, packet):
+        self.fp.write(self.encoder.encode(packet) + '\n')
+        self.packet_count += 1
+
+# Dict mapping format names to `PacketWriter` subclasses.
+FORMATS = OrderedDict((
+    ('json', JSONArrayWriter),
+    ('ndjson', NDJSONWriter)
+))
+
+def write_packets(packets, fp, format='json'):
+    """
+    Write the iterable `packets` to `fp` in `format`, one of `FORMATS`.
+    """
+
+    FORMATS[format](fp).write_all(packets)
+
+# Size of the pieces `read_packets` reads.
+READ_SIZE = 64 * 1024
+
+_WHITESPACE = re.compile(r'\s*')
+
+class _JSONStream(object):
+    """
+    Parses JSON values one at a time from a file object, reading it in
+    pieces. Only the unparsed remainder of the data read is kept.
+    """
+
+    def __init__(self, fp):
+        self.fp = fp
+        self.decoder = json.JSONDecoder(object_pairs_hook=OrderedDict)
+        self.data = ''
+        self.position = 0
+
+    def read(self):
+        """
+        Read the next piece of `fp`. Returns false at the end of the file.
+        """
+
+        piece = self.fp.read(READ_SIZE)
+        if not piece:
+            return False
+        self.data = self.data[self.position:] + piece
+        self.position = 0
+        return True
+
+    def peek(self):
+        """
+        Skip whitespace, and return the next character - or an empty string
+        at the end of the file.
+        """
+
+        while True:
+            self.position = _WHITESPACE.match(self.data, self.position).end()
+            if self.position < len(self.data):
+                return self.data[self.position]
+            if not self.read():
+                return ''
+
+    def expect(self, characters):
+        """
+        Skip whitespace and one of `characters`, returning it. Throws a
+        `ValueError` if the next character isn't one of them.
+        """
+
+        character = self.peek()
+        if not character or character not in characters:
+            raise ValueError('Expected one of {!r}, found {!r}'.format(
+                characters, character
+            ))
+        self.position += 1
+        return character
+
+    def decode(self):
+        """
+        Return the next JSON value, reading more of `fp` until it's complete.
+        """
+
+        self.peek()
+        while True:
+            try:
+                value, self.position = self.decoder.raw_decode(self.data, self.position)
+                return value
+            except ValueError:
+                if not self.read():
+                    raise
+
+def read_packets(fp):
+    """
+    Return an iterator yielding packets parsed from `fp`, as written in either
+    format. Objects are parsed to `OrderedDict`s. Packets are parsed as `fp`
+    is read, so only one is held in memory.
+    """
+
+    stream = _JSONStream(fp)
+    if stream.peek() != '[':
+        while stream.peek():
+            yield stream.decode()
+        return
+
+    stream.expect('[')
+    if stream.peek() == ']':
+        stream.expect(']')
+    else:
+        while True:
+            yield stream.decode()
+            if stream.expect(',]') == ']':
+                break
+
+    if stream.peek():
+        raise ValueError('Unexpected data after the JSON array')
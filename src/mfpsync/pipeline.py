@@ -0,0 +1,271 @@
+"""
+Pipelined syncing, overlapping the network with decoding and output.
+
+`PipelinedPackets` runs the pages of a sync through three stages, connected
+by bounded queues:
+
+    fetch
+        A thread requesting each page.
+    decode
+        A thread reading and decoding each response into packets, as it's
+        received. Once a page's `SyncResult` is decoded, it's passed back to
+        the fetch stage - so the next page is requested while the rest of
+        the page is received, decoded and output.
+    output
+        The caller's thread, iterating over the packets - e.g. writing them
+        with `mfpsync.output.write_packets`.
+
+A stage blocks while the next stage's queue is full, so at most
+`body_queue_size` responses wait to be read, and at most `packet_queue_size`
+batches of packets wait to be output. Responses are never held in full.
+
+Decoding and output share the interpreter lock, but both overlap with
+waiting on the network - so a sync takes closer to the longer of its network
+and CPU time, rather than their sum.
+
+Example:
+    >>> packets = PipelinedPackets(Sync(username, password))
+    >>> write_packets(packets, sys.stdout, 'ndjson')
+"""
+
+import Queue
+import sys
+import threading
+
+from mfpsync.codec import get_packet_types
+from mfpsync.codec.objects import SyncResult
+
+# Kinds of queue items, queued as `(kind, value)` tuples.
+BODY = 'body' # A response, as a `(response_data_fp, save_response_fp)` tuple.
+PACKETS = 'packets' # A list of decoded packets.
+PAGE_END = 'page_end' # The end of a page, with its `SyncResult`.
+END = 'end' # The end of the sync.
+ERROR = 'error' # An exception raised by a stage, as a `sys.exc_info()` tuple.
+
+# Interval in seconds at which a stage blocked on a full or empty queue checks
+# whether the pipeline has been stopped.
+POLL_INTERVAL = 0.1
+
+class PipelineStopped(Exception):
+    """
+    Raised within a stage once the pipeline is stopped.
+    """
+
+class PipelinedPackets(object):
+    """
+    Iterates over the packets of every page of a sync, as `AllPackets` does,
+    but fetching, decoding and output run concurrently. See the module
+    documentation.
+    """
+
+    # Maximum number of responses waiting to be read.
+    body_queue_size = 1
+
+    # Maximum number of batches of packets waiting to be output.
+    packet_queue_size = 64
+
+    # Number of packets passed from the decode stage to the output stage at a
+    # time.
+    batch_size = 256
+
+    def __init__(self, sync, last_sync_pointers={}, types=None):
+        self.sync = sync
+        self.last_sync_pointers = last_sync_pointers
+
+        # `SyncResult` of the current page, as output.
+        self.sync_result = None
+
+        # `SyncResult` packets are always requested, as they're needed to
+        # fetch the next page - but are only yielded if wanted.
+        self.wanted_types = get_packet_types(types) if types is not None else None
+        self.request_types = None
+        if self.wanted_types is not None:
+            self.request_types = self.wanted_types | {SyncResult.packet_type}
+
+        self.bodies = Queue.Queue(self.body_queue_size)
+        self.packets = Queue.Queue(self.packet_queue_size)
+
+        # `SyncResult` packets passed from the decode stage to the fetch stage,
+        # or `None` if the decode stage has finished.
+        self.sync_results = Queue.Queue()
+
+        self.stopped = threading.Event()
+        self.threads = []
+
+    def __iter__(self):
+        for page in self.pages():
+            for packet in page:
+                yield packet
+
+    def pages(self):
+        """
+        Return an iterator yielding an iterator of packets for each page.
+
+        As with `AllPackets.pages`, each page must be read to the end before
+        the next. Its `SyncResult` is then available as `sync_result`, and
+        `last_sync_pointers` is updated once the next page is read.
+        """
+
+        self.start()
+        try:
+            while True:
+                self.sync_result = None
+                yield self.read_page()
+
+                self.last_sync_pointers = self.sync_result.last_sync_pointers
+                if not self.sync_result.more_data_to_sync:
+                    break
+        finally:
+            self.stop()
+
+    def read_page(self):
+        """
+        Return an iterator yielding the packets of the next page from the
+        decode stage. Exceptions raised by the other stages are raised here.
+        """
+
+        while True:
+            kind, value = self.packets.get()
+            if kind == PACKETS:
+                for packet in value:
+                    yield packet
+            elif kind == PAGE_END:
+                self.sync_result = value
+                return
+            elif kind == ERROR:
+                raise value[0], value[1], value[2]
+            else:
+                raise Exception('Sync ended before the last page')
+
+    def start(self):
+        """
+        Start the fetch and decode stages.
+        """
+
+        for target in (self.fetch, self.decode):
+            thread = threading.Thread(target=target, name='mfpsync-' + target.__name__)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self):
+        """
+        Stop the fetch and decode stages. A stage waiting on the network
+        stops once its read completes.
+        """
+
+        self.stopped.set()
+
+    def put(self, queue, kind, value=None):
+        """
+        Add an item to `queue`, blocking while it's full. Throws
+        `PipelineStopped` if the pipeline is stopped meanwhile.
+        """
+
+        while not self.stopped.is_set():
+            try:
+                queue.put((kind, value), timeout=POLL_INTERVAL)
+                return
+            except Queue.Full:
+                pass
+        raise PipelineStopped()
+
+    def get(self, queue):
+        """
+        Remove and return an item from `queue`, blocking while it's empty.
+        Throws `PipelineStopped` if the pipeline is stopped meanwhile.
+        """
+
+        while not self.stopped.is_set():
+            try:
+                return queue.get(timeout=POLL_INTERVAL)
+            except Queue.Empty:
+                pass
+        raise PipelineStopped()
+
+    def fetch(self):
+        """
+        Fetch stage. Requests each page, waiting for the previous page's
+        `SyncResult` from the decode stage.
+        """
+
+        try:
+            last_sync_pointers = self.last_sync_pointers
+            while True:
+                response_data_fp, save_response_fp = self.sync.get_response(last_sync_pointers)
+                try:
+                    self.put(self.bodies, BODY, (response_data_fp, save_response_fp))
+                except PipelineStopped:
+                    response_data_fp.close()
+                    raise
+
+                sync_result = self.get(self.sync_results)
+                if sync_result is None or not sync_result.more_data_to_sync:
+                    break
+                last_sync_pointers = sync_result.last_sync_pointers
+
+            self.put(self.bodies, END)
+        except PipelineStopped:
+            pass
+        except Exception:
+            try:
+                self.put(self.bodies, ERROR, sys.exc_info())
+            except PipelineStopped:
+                pass
+
+    def decode(self):
+        """
+        Decode stage. Reads and decodes each response, passing packets to the
+        output stage in batches, and each `SyncResult` to the fetch stage.
+        """
+
+        try:
+            while True:
+                kind, value = self.get(self.bodies)
+                if kind != BODY:
+                    self.put(self.packets, kind, value)
+                    break
+                self.put(self.packets, PAGE_END, self.decode_body(*value))
+        except PipelineStopped:
+            pass
+        except Exception:
+            try:
+                self.put(self.packets, ERROR, sys.exc_info())
+            except PipelineStopped:
+                pass
+        finally:
+            self.sync_results.put(None)
+
+    def decode_body(self, response_data_fp, save_response_fp):
+        """
+        Read and decode a single response, returning its `SyncResult`.
+        """
+
+        sync_result = None
+        batch = []
+        packets = self.sync.decode_response(
+            response_data_fp, save_response_fp, self.request_types
+        )
+        try:
+            for packet in packets:
+                if isinstance(packet, SyncResult):
+                    sync_result = packet
+                    self.sync_results.put(sync_result)
+                    if self.wanted_types is not None \
+                            and SyncResult.packet_type not in self.wanted_types:
+                        continue
+
+                batch.append(packet)
+                if len(batch) >= self.batch_size:
+                    self.put(self.packets, PACKETS, batch)
+                    batch = []
+        finally:
+            # Close the response, if the pipeline stopped part way through.
+            packets.close()
+
+        if batch:
+            self.put(self.packets, PACKETS, batch)
+
+        if sync_result is None:
+            raise Exception('Response has no SyncResult')
+        return sync_result
@@ -0,0 +1,506 @@
+"""
+Keeping many accounts fresh, without overloading the sync API.
+
+`FleetScheduler` syncs accounts repeatedly, as `BatchSync` syncs them once,
+to the same per-account sinks. Rather than cycling through every account in
+turn, it keeps a heap of accounts ordered by when each is next due:
+
+    Activity
+        Each account has an estimated `rate` of new packets per second - a
+        moving average over its recent syncs, counting every page while
+        the server sets `more_data_to_sync`. An account is next due once
+        it's expected to have `target_packet_count` new packets, between
+        `min_interval` and `max_interval` seconds after its last successful
+        sync.
+    Staleness
+        Accounts are synced in order of due time - so once the scheduler
+        falls behind, the accounts longest past their due time go first.
+        Failed syncs are retried with exponential backoff.
+
+Requests are limited in two ways:
+
+    Concurrency
+        An `AIMDController` sets how many accounts sync at a time. After
+        each window of requests, concurrency is increased by one if latency
+        and errors are within their targets, or halved if not. It starts
+        low, doubling until a target is first exceeded.
+    Rate
+        A `TokenBucket` limits requests per second across all accounts,
+        allowing short bursts.
+
+Example:
+    >>> scheduler = FleetScheduler('/var/lib/mfpsync', request_rate=20)
+    >>> scheduler.run(load_accounts(open('accounts.json')))
+"""
+
+import heapq
+import itertools
+import os
+import Queue
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+
+from mfpsync import Sync
+from mfpsync.batch import AccountResult, BatchSync, describe_exception
+from mfpsync.codec.objects import SyncResult
+
+# Interval in seconds at which the scheduler checks for finished syncs and
+# accounts coming due, when neither happens sooner.
+POLL_INTERVAL = 1.0
+
+class TokenBucket(object):
+    """
+    Limits an event to `rate` per second on average, allowing bursts of up to
+    `burst` events. Thread-safe.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else max(1.0, rate))
+        self.tokens = self.burst
+        self.updated_at = time.time()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Take a token, first waiting for one if none are available. Returns
+        the number of seconds waited.
+
+        A waiting caller reserves its token, leaving the bucket in debt - so
+        callers are served in order, and the rate holds however many wait.
+        """
+
+        with self.lock:
+            now = time.time()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+        if wait:
+            time.sleep(wait)
+        return wait
+
+class AIMDController(object):
+    """
+    Sets a concurrency limit between `minimum` and `maximum` from the latency
+    and errors of requests, with additive increase and multiplicative
+    decrease.
+
+    Requests are assessed in windows of at least `limit` requests, started
+    since the limit last changed - so each change is judged by requests made
+    under it. Until the first window exceeding a target, the limit doubles
+    after each window rather than increasing by `increase_step`, so it
+    quickly reaches the server's capacity from a cold start.
+
+    The limit is only increased after windows in which it was reached, as
+    reported by `set_limited` - otherwise low latency only shows the server
+    copes with fewer requests than the limit allows.
+    """
+
+    # Number of requests added to the limit after a window within targets.
+    increase_step = 1.0
+
+    # Factor the limit is multiplied by after a window exceeding a target.
+    decrease_factor = 0.5
+
+    # Fraction of requests in a window that may fail.
+    max_error_rate = 0.05
+
+    # If `latency_target` is unset, the highest acceptable mean latency as a
+    # multiple of the lowest seen.
+    latency_tolerance = 2.0
+
+    # Fewest requests in a window.
+    min_window_size = 4
+
+    def __init__(self, minimum=1, maximum=32, latency_target=None):
+        """
+        `latency_target` is the highest acceptable mean latency of a window
+        in seconds. If omitted, it's relative to the lowest mean latency seen
+        - see `latency_tolerance`.
+        """
+
+        self.minimum = minimum
+        self.maximum = maximum
+        self.latency_target = latency_target
+
+        # Start at the minimum, as the baseline latency is measured unloaded.
+        self.limit = float(minimum)
+        self.baseline_latency = None
+        self.is_slow_start = True
+
+        # Totals across all windows.
+        self.request_count = 0
+        self.error_count = 0
+
+        # Mean latency of successful requests in the last window, or `None`.
+        self.latency = None
+
+        self.window_count = 0
+        self.window_error_count = 0
+        self.window_latency = 0.0
+        self.window_start_time = time.time()
+        self.window_is_limited = False
+        self.lock = threading.Lock()
+
+    @property
+    def concurrency(self):
+        """
+        Return the current concurrency limit, as an `int`.
+        """
+
+        return int(self.limit)
+
+    def set_limited(self):
+        """
+        Report that a request was held back by the limit. Thread-safe.
+        """
+
+        with self.lock:
+            self.window_is_limited = True
+
+    def record(self, start_time, latency, is_error=False):
+        """
+        Record a request started at `start_time` and taking `latency`
+        seconds, which failed if `is_error` is set. Thread-safe.
+        """
+
+        with self.lock:
+            self.request_count += 1
+            if is_error:
+                self.error_count += 1
+            if start_time < self.window_start_time:
+                return
+
+            self.window_count += 1
+            if is_error:
+                self.window_error_count += 1
+            else:
+                self.window_latency += latency
+
+            if self.window_count >= max(self.min_window_size, self.concurrency):
+                self.adjust()
+
+    def adjust(self):
+        """
+        Adjust the limit from the current window, and start a new window.
+        """
+
+        success_count = self.window_count - self.window_error_count
+        self.latency = self.window_latency / success_count if success_count else None
+        if self.latency is not None:
+            self.baseline_latency = min(self.baseline_latency or self.latency, self.latency)
+
+        latency_target = self.latency_target
+        if latency_target is None and self.baseline_latency is not None:
+            latency_target = self.baseline_latency * self.latency_tolerance
+
+        is_congested = (
+            float(self.window_error_count) / self.window_count > self.max_error_rate or
+            (self.latency is not None and self.latency > latency_target)
+        )
+        limit = self.limit
+        if is_congested:
+            limit = max(self.minimum, limit * self.decrease_factor)
+            self.is_slow_start = False
+        elif not self.window_is_limited:
+            pass
+        elif self.is_slow_start:
+            limit = min(self.maximum, limit * 2)
+        else:
+            limit = min(self.maximum, limit + self.increase_step)
+
+        self.window_count = 0
+        self.window_error_count = 0
+        self.window_latency = 0.0
+        self.window_is_limited = False
+        if limit != self.limit:
+            self.limit = limit
+            self.window_start_time = time.time()
+
+class ScheduledSync(Sync):
+    """
+    `Sync` whose requests are rate limited by a `FleetScheduler`, and
+    recorded by its `AIMDController`. If `state` is given, the packets the
+    server sends are counted in its `server_packet_count`.
+    """
+
+    def __init__(self, username, password, scheduler, state=None):
+        super(ScheduledSync, self).__init__(username, password)
+        self.scheduler = scheduler
+        self.state = state
+
+    def decode_response(self, response_data_fp, save_response_fp=None, types=None):
+        packets = super(ScheduledSync, self).decode_response(
+            response_data_fp, save_response_fp, types
+        )
+        if self.state is None:
+            return packets
+        return self.count_packets(packets)
+
+    def count_packets(self, packets):
+        """
+        Yield `packets`, adding the packet count of each `SyncResult` to
+        `self.state`.
+        """
+
+        for packet in packets:
+            if packet.__class__ is SyncResult:
+                self.state.server_packet_count += packet.expected_packet_count
+            yield packet
+
+    def post_http(self, url, headers, body):
+        self.scheduler.token_bucket.acquire()
+
+        start_time = time.time()
+        try:
+            response = super(ScheduledSync, self).post_http(url, headers, body)
+        except Exception:
+            self.scheduler.controller.record(start_time, time.time() - start_time, True)
+            raise
+        self.scheduler.controller.record(start_time, time.time() - start_time)
+        return response
+
+class AccountState(object):
+    """
+    Scheduling state of a single account.
+    """
+
+    def __init__(self, account):
+        self.account = account
+
+        # Estimated new packets per second, or `None` until the account has
+        # been synced twice.
+        self.rate = None
+
+        # Times of the last successful sync, and the last attempt, or `None`.
+        self.last_success = None
+        self.last_attempt = None
+
+        # Number of consecutive failed syncs.
+        self.failure_count = 0
+
+        # Number of packets the server sent in the current or last sync,
+        # besides `SyncResult` packets - whether or not of the wanted types.
+        self.server_packet_count = 0
+
+        # `AccountResult` of the last sync, or `None`.
+        self.result = None
+
+    def __repr__(self):
+        return '<AccountState {!r} rate={!r}>'.format(self.account.name, self.rate)
+
+class FleetScheduler(BatchSync):
+    """
+    Keeps a list of accounts synced, each to its own sink in
+    `output_directory`. See the module documentation.
+    """
+
+    # Seconds between syncs of the busiest accounts.
+    min_interval = 60.0
+
+    # Seconds between syncs of the quietest accounts - the staleness any
+    # account may reach while the scheduler keeps up.
+    max_interval = 3600.0
+
+    # Number of new packets an account is expected to have when it's next
+    # due.
+    target_packet_count = 1.0
+
+    # Weight of the latest sync in each account's estimated `rate`.
+    rate_weight = 0.3
+
+    # Seconds before a failed sync is retried, doubled with each consecutive
+    # failure up to `max_interval`.
+    retry_delay = 30.0
+
+    def __init__(self, output_directory, format='ndjson', types=None,
+                 compress=False, pipeline=False, min_concurrency=1,
+                 max_concurrency=32, request_rate=10.0, burst=None,
+                 latency_target=None):
+        """
+        `format`, `types`, `compress` and `pipeline` are as for `BatchSync`.
+        Concurrency is kept between `min_concurrency` and `max_concurrency`,
+        requests to `request_rate` per second with bursts of up to `burst`.
+        `latency_target` is as for `AIMDController`.
+        """
+
+        super(FleetScheduler, self).__init__(
+            output_directory, concurrency=max_concurrency, format=format,
+            types=types, compress=compress, pipeline=pipeline
+        )
+
+        self.controller = AIMDController(min_concurrency, max_concurrency, latency_target)
+        self.token_bucket = TokenBucket(request_rate, burst)
+
+        # `(state, result)` tuples of finished syncs.
+        self.results = Queue.Queue()
+
+        # List of `AccountState` objects, set by `run`, and a dict mapping
+        # their accounts to them.
+        self.states = []
+        self.account_states = {}
+
+        self.running_count = 0
+        self.start_time = None
+        self.stopped = threading.Event()
+
+        # Optional function called with the scheduler every `status_interval`
+        # seconds while running.
+        self.status_callback = None
+        self.status_interval = 60.0
+
+    def get_sync(self, account):
+        sync = ScheduledSync(
+            account.username, account.password, self, self.account_states.get(account)
+        )
+        sync.compress = self.compress
+        sync.connection_pool = self.connection_pool
+        return sync
+
+    def get_interval(self, state):
+        """
+        Return the number of seconds after a successful sync that `state` is
+        next due. Accounts without an estimated rate are due soon, to
+        estimate one.
+        """
+
+        if state.rate is None:
+            return self.min_interval
+        if state.rate <= 0:
+            return self.max_interval
+        return min(self.max_interval, max(self.min_interval, self.target_packet_count / state.rate))
+
+    def update(self, state, result, now):
+        """
+        Update `state` from the `AccountResult` of a finished sync, and its
+        `server_packet_count`, returning the time it's next due.
+        """
+
+        state.result = result
+        state.last_attempt = now
+
+        if result.error is not None:
+            state.failure_count += 1
+            return now + min(
+                self.max_interval, self.retry_delay * 2 ** (state.failure_count - 1)
+            )
+
+        if state.last_success is not None:
+            rate = state.server_packet_count / max(now - state.last_success, 1e-3)
+            if state.rate is None:
+                state.rate = rate
+            else:
+                state.rate += self.rate_weight * (rate - state.rate)
+        state.last_success = now
+        state.failure_count = 0
+        return now + self.get_interval(state)
+
+    def get_max_staleness(self, now=None):
+        """
+        Return the most seconds since any account's last successful sync, or
+        since the scheduler started for accounts never synced.
+        """
+
+        if now is None:
+            now = time.time()
+        return max([
+            now - (state.last_success or self.start_time) for state in self.states
+        ] or [0.0])
+
+    def stop(self):
+        """
+        Stop `run`, once running syncs finish. Thread-safe.
+        """
+
+        self.stopped.set()
+
+    def run(self, accounts, duration=None):
+        """
+        Sync `accounts` until `stop` is called, or for `duration` seconds.
+        Returns a list of `AccountState` objects in the same order.
+        """
+
+        if not os.path.isdir(self.output_directory):
+            os.makedirs(self.output_directory)
+
+        self.start_time = time.time()
+        end_time = self.start_time + duration if duration is not None else None
+        self.states = [AccountState(account) for account in accounts]
+        self.account_states = {state.account: state for state in self.states}
+
+        # Heap of `(due_time, number, state)` tuples. Numbers break ties
+        # between accounts due at the same time.
+        numbers = itertools.count()
+        heap = [(self.start_time, next(numbers), state) for state in self.states]
+
+        pool = ThreadPool(self.controller.maximum)
+        self.running_count = 0
+        self.stopped.clear()
+        status_time = self.start_time + self.status_interval
+        try:
+            while not self.stopped.is_set():
+                now = time.time()
+                if end_time is not None and now >= end_time:
+                    break
+
+                while heap and heap[0][0] <= now:
+                    if self.running_count >= self.controller.concurrency:
+                        self.controller.set_limited()
+                        break
+                    state = heapq.heappop(heap)[2]
+                    state.server_packet_count = 0
+                    pool.apply_async(self.run_sync, (state,))
+                    self.running_count += 1
+
+                if self.status_callback is not None and now >= status_time:
+                    self.status_callback(self)
+                    status_time = now + self.status_interval
+
+                timeout = POLL_INTERVAL
+                if heap and self.running_count < self.controller.concurrency:
+                    timeout = min(timeout, max(0.0, heap[0][0] - now))
+                if end_time is not None:
+                    timeout = min(timeout, max(0.0, end_time - now))
+
+                try:
+                    state, result = self.results.get(timeout=timeout)
+                except Queue.Empty:
+                    continue
+                self.finish(heap, numbers, state, result)
+        finally:
+            # Let running syncs finish, so their sinks are left consistent.
+            pool.close()
+            pool.join()
+            while self.running_count:
+                self.finish(heap, numbers, *self.results.get())
+            self.connection_pool.clear()
+
+        return self.states
+
+    def run_sync(self, state):
+        """
+        Sync `state`'s account on a pool thread, then queue its `(state,
+        result)` for `run`. Always queues a result - a failed one if the sync
+        raises - as `run` counts the syncs running by their results.
+        """
+
+        result = AccountResult(state.account)
+        result.error = 'Sync interrupted'
+        try:
+            result = self.sync_account(state.account)
+        except Exception:
+            result.error = describe_exception()
+        finally:
+            self.results.put((state, result))
+
+    def finish(self, heap, numbers, state, result):
+        """
+        Handle a finished sync, queueing the account to sync again.
+        """
+
+        self.running_count -= 1
+        due_time = self.update(state, result, time.time())
+        heapq.heappush(heap, (due_time, next(numbers), state))
@@ -0,0 +1,232 @@
+"""
+Splitting saved sync responses into shards, for decoding across machines.
+
+`split_captures` cuts one or more responses saved via `Sync.save_response_fp`
+into shard files on packet boundaries, and writes a JSON manifest describing
+them. Each shard can then be decoded independently with `decode_shard`, and
+the decoded shards checked and joined with `merge_shards`.
+
+Example:
+    $ mfpsync split -n 8 -o shards/ response-*.bin
+    $ mfpsync decode-shard shards/manifest.json 0 > decoded-0.json
+    ...
+    $ mfpsync merge shards/manifest.json decoded-*.json > packets.json
+
+The manifest records each shard's source byte ranges and its packet counts by
+type, along with the metadata of every `SyncResult` - so the packet count can
+be checked across all shards when merging.
+"""
+
+from collections import OrderedDict
+import json
+import os.path
+
+from mfpsync.codec import Codec, map_file
+from mfpsync.codec import objects
+from mfpsync.codec.index import PacketIndex
+
+MANIFEST_VERSION = 1
+
+# Size of the pieces shard files are written in.
+COPY_SIZE = 1024 * 1024
+
+# Dict mapping `packet_type`s to the names of the classes registered for them.
+_TYPE_NAMES = {
+    packet_type: packet_class.__name__
+    for packet_type, packet_class in Codec(None).packet_type_classes.iteritems()
+}
+
+def get_type_name(packet_type):
+    """
+    Return the name of the class registered for `packet_type`.
+
+    Packets are counted by their registered class, as known from the header -
+    even if decoded as an `UnknownPacket`, as classes without `fields` are.
+    """
+
+    return _TYPE_NAMES.get(packet_type, objects.UnknownPacket.__name__)
+
+def split_captures(filenames, shard_count, directory):
+    """
+    Split the saved responses `filenames` into up to `shard_count` shard
+    files of roughly equal size, written to `directory` along with a
+    `manifest.json`. Returns the manifest.
+
+    Shards may span several responses, and are cut on packet boundaries.
+    Throws a `ValueError` if `shard_count` is less than 1.
+    """
+
+    if shard_count < 1:
+        raise ValueError('Invalid shard count {}'.format(shard_count))
+
+    indexes = [PacketIndex(map_file(filename)) for filename in filenames]
+    total_length = sum(
+        index.starts[-1] + index.lengths[-1]
+        for index in indexes
+        if len(index)
+    )
+    shard_length = max(1, -(-total_length // shard_count))
+
+    # `sync_results` lists the metadata of every `SyncResult`.
+    sync_results = []
+    for capture_number, index in enumerate(indexes):
+        for packet in index.filter(objects.SyncResult.packet_type):
+            sync_result = packet.decode()
+            sync_results.append(OrderedDict((
+                ('capture', capture_number),
+                ('packet_start', sync_result.packet_start),
+                ('expected_packet_count', sync_result.expected_packet_count),
+                ('more_data_to_sync', sync_result.more_data_to_sync),
+                ('last_sync_pointers', sync_result.last_sync_pointers)
+            )))
+
+    shards = []
+    shard = None
+    for capture_number, index in enumerate(indexes):
+        for start, length, packet_type in zip(index.starts, index.lengths, index.types):
+            if shard is None or shard['length'] >= shard_length:
+                shard = new_shard(len(shards))
+                shards.append(shard)
+
+            ranges = shard['ranges']
+            if ranges and ranges[-1][0] == capture_number and ranges[-1][2] == start:
+                ranges[-1][2] = start + length
+            else:
+                ranges.append([capture_number, start, start + length])
+
+            type_name = get_type_name(packet_type)
+            shard['length'] += length
+            shard['packet_count'] += 1
+            shard['packet_types'][type_name] = shard['packet_types'].get(type_name, 0) + 1
+
+    for shard in shards:
+        with open(os.path.join(directory, shard['filename']), 'wb') as fp:
+            for capture_number, start, end in shard['ranges']:
+                data = indexes[capture_number].data
+                for position in xrange(start, end, COPY_SIZE):
+                    fp.write(data[position:min(position + COPY_SIZE, end)])
+
+    manifest = OrderedDict((
+        ('version', MANIFEST_VERSION),
+        ('captures', [
+            OrderedDict((
+                ('filename', os.path.abspath(filename)),
+                ('packet_count', len(index))
+            ))
+            for filename, index in zip(filenames, indexes)
+        ]),
+        ('expected_packet_count', sum(
+            sync_result['expected_packet_count']
+            for sync_result in sync_results
+        ) if sync_results else None),
+        ('sync_results', sync_results),
+        ('shards', shards)
+    ))
+
+    with open(os.path.join(directory, 'manifest.json'), 'w') as fp:
+        json.dump(manifest, fp, indent=4)
+
+    return manifest
+
+def new_shard(shard_number):
+    """
+    Return the manifest entry for a new, empty shard.
+    """
+
+    return OrderedDict((
+        ('number', shard_number),
+        ('filename', 'shard-{:04d}.bin'.format(shard_number)),
+        ('length', 0),
+        ('ranges', []),
+        ('packet_count', 0),
+        ('packet_types', {})
+    ))
+
+def load_manifest(path):
+    """
+    Return the manifest at `path`, with its path recorded as `path`.
+    """
+
+    with open(path) as fp:
+        manifest = json.load(fp, object_pairs_hook=OrderedDict)
+
+    if manifest.get('version') != MANIFEST_VERSION:
+        raise ValueError('Unsupported manifest version {!r}'.format(manifest.get('version')))
+
+    manifest['path'] = path
+    return manifest
+
+def decode_shard(manifest, shard_number):
+    """
+    Return an iterator yielding the decoded packets of shard `shard_number`.
+    Throws an `Exception` once decoded if the packet counts differ from the
+    manifest.
+
+    The shard's `SyncResult` packets are not checked against its packet count,
+    as their packets may span several shards - see `merge_shards`.
+    """
+
+    shard = manifest['shards'][shard_number]
+    codec = Codec.from_file(os.path.join(
+        os.path.dirname(manifest['path']), shard['filename']
+    ))
+
+    packet_types = {}
+    while codec.position < codec.length:
+        packet = codec.read_packet()
+        type_name = get_type_name(packet.packet_type)
+        packet_types[type_name] = packet_types.get(type_name, 0) + 1
+        yield packet
+
+    check_packet_types(shard, packet_types)
+
+def merge_shards(manifest, decoded_shards):
+    """
+    Return an iterator yielding the decoded packets of every shard, in order.
+    `decoded_shards` is a list of iterables of decoded packets - one per
+    shard, as output by `decode_shard` and parsed from JSON, e.g. by
+    `mfpsync.output.read_packets`. Each is iterated once, as the packets are
+    yielded.
+
+    The shards' packet counts in the manifest are checked against the
+    `SyncResult` packets' `expected_packet_count` up front. Each shard's
+    packets are then checked against its packet counts once they've all been
+    yielded. Throws an `Exception` if any counts differ.
+    """
+
+    shards = manifest['shards']
+    if len(decoded_shards) != len(shards):
+        raise Exception('Expected {} shards, received {}'.format(
+            len(shards), len(decoded_shards)
+        ))
+
+    packet_count = sum(
+        shard['packet_count'] - shard['packet_types'].get(objects.SyncResult.__name__, 0)
+        for shard in shards
+    )
+    expected_packet_count = manifest['expected_packet_count']
+    if expected_packet_count is not None and packet_count != expected_packet_count:
+        raise Exception('Expected {} objects, received {}'.format(
+            expected_packet_count, packet_count
+        ))
+
+    for shard, packets in zip(shards, decoded_shards):
+        packet_types = {}
+        for packet in packets:
+            type_name = packet['type']
+            if type_name == objects.UnknownPacket.__name__:
+                type_name = get_type_name(packet['data']['packet_type'])
+            packet_types[type_name] = packet_types.get(type_name, 0) + 1
+            yield packet
+        check_packet_types(shard, packet_types)
+
+def check_packet_types(shard, packet_types):
+    """
+    Check a dict of packet counts by type name against the manifest entry
+    `shard`. Throws an `Exception` if they differ.
+    """
+
+    if packet_types != shard['packet_types']:
+        raise Exception('Shard {} expected packets {!r}, received {!r}'.format(
+            shard['number'], dict(shard['packet_types']), packet_types
+        ))
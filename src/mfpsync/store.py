@@ -0,0 +1,658 @@
+"""
+Persistent SQLite store of synced entities.
+
+`Store` ingests packets from `AllPackets` into normalised tables - foods,
+food entries, exercises, exercise entries, measurements and user properties -
+along with the `last_sync_pointers` to resume from. Each page of packets is
+written in a single transaction, together with its sync pointers, so an
+interrupted sync resumes from the last complete page.
+
+Example:
+    >>> store = Store('mfp.sqlite')
+    >>> store.ingest(AllPackets(Sync(username, password), store.last_sync_pointers))
+    >>> store.connection.execute('SELECT COUNT(*) FROM food_entries').fetchone()
+    (48120,)
+"""
+
+from collections import OrderedDict
+import datetime
+import sqlite3
+
+from mfpsync.codec import objects
+from mfpsync.codec.objects import (
+    DeleteItem, Exercise, ExerciseEntry, Food, FoodEntry, MeasurementValue,
+    Nutrients, UserPropertyUpdate, unfrozen_class
+)
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS foods (
+    master_food_id INTEGER PRIMARY KEY,
+    owner_user_master_id INTEGER NOT NULL,
+    original_master_id INTEGER NOT NULL,
+    description TEXT NOT NULL,
+    brand TEXT NOT NULL,
+    flags INTEGER NOT NULL,
+    grams REAL NOT NULL,
+    type INTEGER NOT NULL,
+    {nutrient_columns},
+    is_deleted INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS food_portions (
+    master_food_id INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    amount REAL NOT NULL,
+    gram_weight REAL NOT NULL,
+    description TEXT NOT NULL,
+    fraction_int INTEGER NOT NULL,
+    PRIMARY KEY (master_food_id, position)
+);
+
+CREATE TABLE IF NOT EXISTS food_entries (
+    master_food_entry_id INTEGER PRIMARY KEY,
+    master_food_id INTEGER NOT NULL,
+    date TEXT NOT NULL,
+    meal_name TEXT NOT NULL,
+    quantity REAL NOT NULL,
+    weight_index INTEGER NOT NULL,
+    is_deleted INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE INDEX IF NOT EXISTS food_entries_date ON food_entries (date);
+
+CREATE TABLE IF NOT EXISTS exercises (
+    master_exercise_id INTEGER PRIMARY KEY,
+    owner_user_master_id INTEGER NOT NULL,
+    original_master_exercise_id INTEGER NOT NULL,
+    exercise_type INTEGER NOT NULL,
+    description TEXT NOT NULL,
+    flags INTEGER NOT NULL,
+    mets REAL NOT NULL,
+    is_deleted INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS exercise_entries (
+    master_exercise_entry_id INTEGER PRIMARY KEY,
+    master_exercise_id INTEGER NOT NULL,
+    date TEXT NOT NULL,
+    quantity INTEGER NOT NULL,
+    sets INTEGER NOT NULL,
+    weight INTEGER NOT NULL,
+    calories INTEGER NOT NULL,
+    is_deleted INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE INDEX IF NOT EXISTS exercise_entries_date ON exercise_entries (date);
+
+CREATE TABLE IF NOT EXISTS measurements (
+    master_measurement_id INTEGER PRIMARY KEY,
+    type_name TEXT NOT NULL,
+    entry_date TEXT NOT NULL,
+    value REAL NOT NULL,
+    is_deleted INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS user_properties (
+    name TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS deleted_items (
+    item_type INTEGER NOT NULL,
+    master_id INTEGER NOT NULL,
+    status INTEGER NOT NULL,
+    PRIMARY KEY (item_type, master_id)
+);
+
+CREATE TABLE IF NOT EXISTS sync_pointers (
+    name TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+'''.format(nutrient_columns=',\n    '.join(
+    '{} REAL NOT NULL'.format(name)
+    for name in Nutrients.nutrient_names
+))
+
+# Daily aggregates. Each entry's contribution is kept in an `*_totals` table,
+# and triggers add it to, or subtract it from, the per-day totals as it's
+# inserted or deleted. Edits delete the old contribution before inserting the
+# new one, so queries over a date range cost time in proportion to the days,
+# not the entries.
+#
+# The triggers avoid `INSERT OR IGNORE`, as the conflict clause of the outer
+# `INSERT OR REPLACE` would override it.
+AGGREGATE_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS food_entry_totals (
+    master_food_entry_id INTEGER PRIMARY KEY,
+    date TEXT NOT NULL,
+    meal_name TEXT NOT NULL,
+    {nutrient_columns}
+);
+
+CREATE TABLE IF NOT EXISTS daily_nutrients (
+    date TEXT NOT NULL,
+    meal_name TEXT NOT NULL,
+    entry_count INTEGER NOT NULL,
+    {nutrient_columns},
+    PRIMARY KEY (date, meal_name)
+);
+
+CREATE TRIGGER IF NOT EXISTS food_entry_totals_insert
+AFTER INSERT ON food_entry_totals
+BEGIN
+    INSERT INTO daily_nutrients (date, meal_name, entry_count, {nutrient_names})
+    SELECT NEW.date, NEW.meal_name, 0, {nutrient_zeros}
+    WHERE NOT EXISTS (
+        SELECT 1 FROM daily_nutrients WHERE date = NEW.date AND meal_name = NEW.meal_name
+    );
+    UPDATE daily_nutrients SET entry_count = entry_count + 1, {nutrient_additions}
+    WHERE date = NEW.date AND meal_name = NEW.meal_name;
+END;
+
+CREATE TRIGGER IF NOT EXISTS food_entry_totals_delete
+AFTER DELETE ON food_entry_totals
+BEGIN
+    UPDATE daily_nutrients SET entry_count = entry_count - 1, {nutrient_subtractions}
+    WHERE date = OLD.date AND meal_name = OLD.meal_name;
+    DELETE FROM daily_nutrients
+    WHERE date = OLD.date AND meal_name = OLD.meal_name AND entry_count = 0;
+END;
+
+CREATE TABLE IF NOT EXISTS exercise_entry_totals (
+    master_exercise_entry_id INTEGER PRIMARY KEY,
+    date TEXT NOT NULL,
+    calories INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS daily_exercise (
+    date TEXT PRIMARY KEY,
+    entry_count INTEGER NOT NULL,
+    calories INTEGER NOT NULL
+);
+
+CREATE TRIGGER IF NOT EXISTS exercise_entry_totals_insert
+AFTER INSERT ON exercise_entry_totals
+BEGIN
+    INSERT INTO daily_exercise (date, entry_count, calories)
+    SELECT NEW.date, 0, 0
+    WHERE NOT EXISTS (SELECT 1 FROM daily_exercise WHERE date = NEW.date);
+    UPDATE daily_exercise SET entry_count = entry_count + 1, calories = calories + NEW.calories
+    WHERE date = NEW.date;
+END;
+
+CREATE TRIGGER IF NOT EXISTS exercise_entry_totals_delete
+AFTER DELETE ON exercise_entry_totals
+BEGIN
+    UPDATE daily_exercise SET entry_count = entry_count - 1, calories = calories - OLD.calories
+    WHERE date = OLD.date;
+    DELETE FROM daily_exercise WHERE date = OLD.date AND entry_count = 0;
+END;
+'''.format(
+    nutrient_columns=',\n    '.join(
+        '{} REAL NOT NULL'.format(name)
+        for name in Nutrients.nutrient_names
+    ),
+    nutrient_names=', '.join(Nutrients.nutrient_names),
+    nutrient_zeros=', '.join('0' for _ in Nutrients.nutrient_names),
+    nutrient_additions=', '.join(
+        '{0} = {0} + NEW.{0}'.format(name)
+        for name in Nutrients.nutrient_names
+    ),
+    nutrient_subtractions=', '.join(
+        '{0} = {0} - OLD.{0}'.format(name)
+        for name in Nutrients.nutrient_names
+    )
+)
+
+# `food_entry_totals` rows for entries already stored, used when the
+# aggregate tables are added to an existing store. Entries whose portion is
+# missing, or whose food has no weight, aren't counted.
+REBUILD_FOOD_ENTRY_TOTALS_SQL = '''
+INSERT INTO food_entry_totals (master_food_entry_id, date, meal_name, {nutrient_names})
+SELECT
+    food_entries.master_food_entry_id, food_entries.date, food_entries.meal_name,
+    {scaled_nutrients}
+FROM food_entries
+JOIN foods ON foods.master_food_id = food_entries.master_food_id
+JOIN food_portions ON food_portions.master_food_id = food_entries.master_food_id
+    AND food_portions.position = food_entries.weight_index
+WHERE food_entries.is_deleted = 0 AND foods.grams != 0
+'''.format(
+    nutrient_names=', '.join(Nutrients.nutrient_names),
+    scaled_nutrients=', '.join(
+        'foods.{} * food_entries.quantity * food_portions.gram_weight / foods.grams'.format(name)
+        for name in Nutrients.nutrient_names
+    )
+)
+
+REBUILD_EXERCISE_ENTRY_TOTALS_SQL = '''
+INSERT INTO exercise_entry_totals (master_exercise_entry_id, date, calories)
+SELECT master_exercise_entry_id, date, calories
+FROM exercise_entries
+WHERE is_deleted = 0
+'''
+
+# Dict mapping `DeleteItem.item_type`s to the `(table, key_column)` of the
+# deleted item. Item types are assumed to match the `packet_type` of the
+# deleted item's packet.
+DELETE_ITEM_TABLES = {
+    objects.PACKET_TYPE_FOOD: ('foods', 'master_food_id'),
+    objects.PACKET_TYPE_FOOD_ENTRY: ('food_entries', 'master_food_entry_id'),
+    objects.PACKET_TYPE_EXERCISE: ('exercises', 'master_exercise_id'),
+    objects.PACKET_TYPE_EXERCISE_ENTRY: ('exercise_entries', 'master_exercise_entry_id'),
+    objects.PACKET_TYPE_MEASUREMENT_VALUE: ('measurements', 'master_measurement_id')
+}
+
+# Dict mapping `DeleteItem.item_type`s to the `(table, key_column)` of the
+# deleted item's contribution to the daily aggregates.
+DELETE_ITEM_TOTALS_TABLES = {
+    objects.PACKET_TYPE_FOOD_ENTRY: ('food_entry_totals', 'master_food_entry_id'),
+    objects.PACKET_TYPE_EXERCISE_ENTRY: ('exercise_entry_totals', 'master_exercise_entry_id')
+}
+
+def decode_date(date_string):
+    """
+    Return a `datetime.date` for a stored `YYYY-MM-DD` date string.
+    """
+
+    year, month, day = date_string.split('-')
+    return datetime.date(int(year), int(month), int(day))
+
+def get_upsert_sql(table, columns):
+    """
+    Return an `INSERT OR REPLACE` statement for `columns` of `table`.
+    """
+
+    return 'INSERT OR REPLACE INTO {} ({}) VALUES ({})'.format(
+        table, ', '.join(columns), ', '.join('?' * len(columns))
+    )
+
+class Batch(object):
+    """
+    Rows waiting to be written to a single table, by `executemany`.
+
+    Upserted rows are keyed, so only the last version of each row is written.
+    A batch holds either upserts or deletes - switching between them flushes
+    the batch, so upserts and deletes of the same row apply in order.
+    """
+
+    def __init__(self, connection, upsert_sql, clear_sql=None):
+        """
+        `upsert_sql` writes a row. If given, `clear_sql` is run with each key
+        before its rows are written - for tables holding several rows per key.
+        """
+
+        self.connection = connection
+        self.upsert_sql = upsert_sql
+        self.clear_sql = clear_sql
+        self.rows = OrderedDict()
+        self.deletes = OrderedDict()
+
+    def __len__(self):
+        return len(self.rows) + sum(len(params) for params in self.deletes.itervalues())
+
+    def upsert(self, key, rows):
+        """
+        Write the list of `rows` for `key`, replacing any pending rows for it.
+        """
+
+        if self.deletes:
+            self.flush()
+        self.rows.pop(key, None)
+        self.rows[key] = rows
+
+    def delete(self, sql, params):
+        """
+        Run the delete statement `sql` with `params`.
+        """
+
+        if self.rows:
+            self.flush()
+        self.deletes.setdefault(sql, []).append(params)
+
+    def flush(self):
+        """
+        Write the pending rows or deletes.
+        """
+
+        if self.rows:
+            if self.clear_sql is not None:
+                self.connection.executemany(self.clear_sql, ((key,) for key in self.rows))
+            self.connection.executemany(self.upsert_sql, (
+                row
+                for rows in self.rows.itervalues()
+                for row in rows
+            ))
+            self.rows.clear()
+
+        for sql, params in self.deletes.iteritems():
+            self.connection.executemany(sql, params)
+        self.deletes.clear()
+
+    def clear(self):
+        """
+        Discard the pending rows and deletes.
+        """
+
+        self.rows.clear()
+        self.deletes.clear()
+
+class Store(object):
+    """
+    SQLite store of synced entities. See the module docstring.
+
+    Entities deleted by a `DeleteItem` packet are removed if `is_destroyed`
+    is set, and otherwise marked with `is_deleted`. Every `DeleteItem` is
+    recorded in the `deleted_items` table.
+
+    Daily totals are maintained as entries are added, edited and deleted -
+    per-date, per-meal nutrients in `daily_nutrients`, and per-date exercise
+    calories in `daily_exercise`. See `get_daily_nutrients` and
+    `get_daily_exercise`.
+    """
+
+    # Number of pending rows written at once with `executemany`.
+    batch_size = 1000
+
+    def __init__(self, path):
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(SCHEMA)
+
+        # Stores created before the aggregates were added need their entries'
+        # contributions filling in.
+        has_aggregates = self.connection.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'daily_nutrients'"
+        ).fetchone() is not None
+        self.connection.executescript(AGGREGATE_SCHEMA)
+        if not has_aggregates:
+            self.rebuild_aggregates()
+
+        self.batches = OrderedDict((
+            ('foods', Batch(self.connection, get_upsert_sql('foods', (
+                'master_food_id', 'owner_user_master_id', 'original_master_id',
+                'description', 'brand', 'flags', 'grams', 'type'
+            ) + Nutrients.nutrient_names))),
+            ('food_portions', Batch(self.connection, get_upsert_sql('food_portions', (
+                'master_food_id', 'position', 'amount', 'gram_weight', 'description',
+                'fraction_int'
+            )), clear_sql='DELETE FROM food_portions WHERE master_food_id = ?')),
+            ('food_entries', Batch(self.connection, get_upsert_sql('food_entries', (
+                'master_food_entry_id', 'master_food_id', 'date', 'meal_name',
+                'quantity', 'weight_index'
+            )))),
+            ('exercises', Batch(self.connection, get_upsert_sql('exercises', (
+                'master_exercise_id', 'owner_user_master_id',
+                'original_master_exercise_id', 'exercise_type', 'description',
+                'flags', 'mets'
+            )))),
+            ('exercise_entries', Batch(self.connection, get_upsert_sql('exercise_entries', (
+                'master_exercise_entry_id', 'master_exercise_id', 'date', 'quantity',
+                'sets', 'weight', 'calories'
+            )))),
+            ('measurements', Batch(self.connection, get_upsert_sql('measurements', (
+                'master_measurement_id', 'type_name', 'entry_date', 'value'
+            )))),
+            ('user_properties', Batch(self.connection, get_upsert_sql('user_properties', (
+                'name', 'value'
+            )))),
+            ('deleted_items', Batch(self.connection, get_upsert_sql('deleted_items', (
+                'item_type', 'master_id', 'status'
+            )))),
+            ('food_entry_totals', Batch(self.connection, get_upsert_sql('food_entry_totals', (
+                'master_food_entry_id', 'date', 'meal_name'
+            ) + Nutrients.nutrient_names), clear_sql=(
+                'DELETE FROM food_entry_totals WHERE master_food_entry_id = ?'
+            ))),
+            ('exercise_entry_totals', Batch(self.connection, get_upsert_sql('exercise_entry_totals', (
+                'master_exercise_entry_id', 'date', 'calories'
+            )), clear_sql=(
+                'DELETE FROM exercise_entry_totals WHERE master_exercise_entry_id = ?'
+            )))
+        ))
+
+        # Dict mapping packet classes to the methods adding them.
+        self.packet_adders = {
+            Food: self.add_food,
+            FoodEntry: self.add_food_entry,
+            Exercise: self.add_exercise,
+            ExerciseEntry: self.add_exercise_entry,
+            MeasurementValue: self.add_measurement,
+            UserPropertyUpdate: self.add_user_properties,
+            DeleteItem: self.add_delete_item
+        }
+
+    def close(self):
+        self.connection.close()
+
+    @property
+    def last_sync_pointers(self):
+        """
+        Return the `last_sync_pointers` of the last ingested page, or an
+        empty dict for a full sync.
+        """
+
+        return dict(self.connection.execute('SELECT name, value FROM sync_pointers'))
+
+    def ingest(self, all_packets):
+        """
+        Ingest every page of an `AllPackets` object, one transaction per
+        page. Returns the number of packets ingested.
+        """
+
+        packet_count = 0
+        for page in all_packets.pages():
+            packet_count += self.ingest_page(page, all_packets)
+        return packet_count
+
+    def ingest_page(self, packets, all_packets):
+        """
+        Ingest the iterable `packets` of a single page, and the page's
+        `last_sync_pointers` from `all_packets.sync_result`, in one
+        transaction. Returns the number of packets ingested.
+
+        If an exception is thrown, the transaction is rolled back, and the
+        page's pending rows discarded.
+        """
+
+        packet_count = 0
+        try:
+            with self.connection:
+                for packet in packets:
+                    self.add_packet(packet)
+                    packet_count += 1
+                self.flush()
+
+                if all_packets.sync_result is not None:
+                    self.connection.execute('DELETE FROM sync_pointers')
+                    self.connection.executemany(
+                        'INSERT INTO sync_pointers (name, value) VALUES (?, ?)',
+                        all_packets.sync_result.last_sync_pointers.iteritems()
+                    )
+        except BaseException:
+            for batch in self.batches.itervalues():
+                batch.clear()
+            raise
+        return packet_count
+
+    def add_packet(self, packet):
+        """
+        Add `packet` to the pending batches. Packets of other classes are
+        ignored.
+        """
+
+        add = self.packet_adders.get(unfrozen_class(packet))
+        if add is not None:
+            add(packet)
+
+    def flush(self):
+        """
+        Write all pending batches.
+        """
+
+        for batch in self.batches.itervalues():
+            batch.flush()
+
+    def upsert(self, table, key, rows):
+        """
+        Write the list of `rows` for `key` to `table`.
+        """
+
+        batch = self.batches[table]
+        batch.upsert(key, rows)
+        if len(batch) >= self.batch_size:
+            batch.flush()
+
+    def delete(self, table, sql, params):
+        """
+        Run the delete statement `sql` on `table`, with `params`.
+        """
+
+        batch = self.batches[table]
+        batch.delete(sql, params)
+        if len(batch) >= self.batch_size:
+            batch.flush()
+
+    def add_food(self, food):
+        self.upsert('foods', food.master_food_id, [(
+            food.master_food_id, food.owner_user_master_id, food.original_master_id,
+            food.description, food.brand, food.flags, food.grams, food.type
+        ) + tuple(food.nutrients.array)])
+        self.upsert('food_portions', food.master_food_id, [
+            (
+                food.master_food_id, position, portion.amount, portion.gram_weight,
+                portion.description, portion.fraction_int
+            )
+            for position, portion in enumerate(food.portions)
+        ])
+
+    def add_food_entry(self, entry):
+        self.add_food(entry.food)
+        self.upsert('food_entries', entry.master_food_id, [(
+            entry.master_food_id, entry.food.master_food_id, entry.date.isoformat(),
+            entry.meal_name, entry.quantity, entry.weight_index
+        )])
+
+        # Entries whose portion is missing, or whose food has no weight,
+        # aren't counted in the daily totals.
+        food = entry.food
+        totals = []
+        if 0 <= entry.weight_index < len(food.portions) and food.grams:
+            multiplier = entry.quantity * food.portions[entry.weight_index].gram_weight / food.grams
+            totals.append((
+                entry.master_food_id, entry.date.isoformat(), entry.meal_name
+            ) + tuple(value * multiplier for value in food.nutrients.array))
+        self.upsert('food_entry_totals', entry.master_food_id, totals)
+
+    def add_exercise(self, exercise):
+        self.upsert('exercises', exercise.master_exercise_id, [(
+            exercise.master_exercise_id, exercise.owner_user_master_id,
+            exercise.original_master_exercise_id, exercise.exercise_type,
+            exercise.description, exercise.flags, exercise.mets
+        )])
+
+    def add_exercise_entry(self, entry):
+        self.add_exercise(entry.exercise)
+        self.upsert('exercise_entries', entry.master_exercise_entry_id, [(
+            entry.master_exercise_entry_id, entry.exercise.master_exercise_id,
+            entry.date.isoformat(), entry.quantity, entry.sets, entry.weight,
+            entry.calories
+        )])
+        self.upsert('exercise_entry_totals', entry.master_exercise_entry_id, [(
+            entry.master_exercise_entry_id, entry.date.isoformat(), entry.calories
+        )])
+
+    def add_measurement(self, measurement):
+        self.upsert('measurements', measurement.master_measurement_id, [(
+            measurement.master_measurement_id, measurement.type_name,
+            measurement.entry_date.isoformat(), measurement.value
+        )])
+
+    def add_user_properties(self, update):
+        for name, value in update.properties.iteritems():
+            self.upsert('user_properties', name, [(name, value)])
+
+    def add_delete_item(self, delete_item):
+        self.upsert('deleted_items', (delete_item.item_type, delete_item.master_id), [(
+            delete_item.item_type, delete_item.master_id, delete_item.status
+        )])
+
+        # Deleted entries no longer count towards the daily totals, whether
+        # removed or marked as deleted.
+        if delete_item.item_type in DELETE_ITEM_TOTALS_TABLES:
+            table, key_column = DELETE_ITEM_TOTALS_TABLES[delete_item.item_type]
+            self.delete(table, 'DELETE FROM {} WHERE {} = ?'.format(table, key_column), (
+                delete_item.master_id,
+            ))
+
+        try:
+            table, key_column = DELETE_ITEM_TABLES[delete_item.item_type]
+        except KeyError:
+            return
+
+        if delete_item.is_destroyed:
+            self.delete(table, 'DELETE FROM {} WHERE {} = ?'.format(table, key_column), (
+                delete_item.master_id,
+            ))
+            if table == 'foods':
+                self.delete('food_portions', 'DELETE FROM food_portions WHERE master_food_id = ?', (
+                    delete_item.master_id,
+                ))
+        else:
+            self.delete(table, 'UPDATE {} SET is_deleted = 1 WHERE {} = ?'.format(table, key_column), (
+                delete_item.master_id,
+            ))
+
+    def rebuild_aggregates(self):
+        """
+        Recalculate the daily totals from the stored entries, using the
+        latest stored version of each entry's food.
+        """
+
+        with self.connection:
+            for table in ('food_entry_totals', 'daily_nutrients',
+                          'exercise_entry_totals', 'daily_exercise'):
+                self.connection.execute('DELETE FROM {}'.format(table))
+            self.connection.execute(REBUILD_FOOD_ENTRY_TOTALS_SQL)
+            self.connection.execute(REBUILD_EXERCISE_ENTRY_TOTALS_SQL)
+
+    def get_daily_nutrients(self, start_date, end_date, meal_name=None):
+        """
+        Return a list of `(date, entry_count, nutrients)` tuples for each date
+        with food entries between `start_date` and `end_date` inclusive,
+        ordered by date. `nutrients` is an `OrderedDict` of nutrient totals,
+        in `Nutrients.nutrient_names` order. If `meal_name` is given, only
+        that meal is totalled.
+        """
+
+        sql = 'SELECT date, SUM(entry_count), {} FROM daily_nutrients WHERE date BETWEEN ? AND ?'.format(
+            ', '.join('SUM({})'.format(name) for name in Nutrients.nutrient_names)
+        )
+        params = [start_date.isoformat(), end_date.isoformat()]
+        if meal_name is not None:
+            sql += ' AND meal_name = ?'
+            params.append(meal_name)
+        sql += ' GROUP BY date ORDER BY date'
+
+        return [
+            (
+                decode_date(row[0]), row[1],
+                OrderedDict(zip(Nutrients.nutrient_names, row[2:]))
+            )
+            for row in self.connection.execute(sql, params)
+        ]
+
+    def get_daily_exercise(self, start_date, end_date):
+        """
+        Return a list of `(date, entry_count, calories)` tuples for each date
+        with exercise entries between `start_date` and `end_date` inclusive,
+        ordered by date.
+        """
+
+        return [
+            (decode_date(date), entry_count, calories)
+            for date, entry_count, calories in self.connection.execute(
+                'SELECT date, entry_count, calories FROM daily_exercise '
+                'WHERE date BETWEEN ? AND ? ORDER BY date',
+                (start_date.isoformat(), end_date.isoformat())
+            )
+        ]
@@ -0,0 +1,329 @@
+"""
+Columnar tables of sync packets, for analysis with NumPy.
+
+Example:
+    >>> tables = collect_tables(AllPackets(Sync(username, password)))
+    >>> entries = tables.food_entries
+    >>> entries.scaled_nutrients()[:, entries.nutrient_index('calories')].sum()
+    1581234.5
+
+Requires NumPy, which is an optional dependency: `pip install mfpsync[tables]`.
+"""
+
+from array import array
+import datetime
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from mfpsync.codec.objects import (
+    ExerciseEntry, Food, FoodEntry, MeasurementValue, unfrozen_class
+)
+
+# Day number of 1970-01-01, the `datetime64` epoch, as a proleptic Gregorian
+# ordinal.
+_EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+
+class Categories(object):
+    """
+    Assigns integer codes to repeated string values, such as meal names.
+    """
+
+    def __init__(self):
+        self.names = []
+        self.codes = {}
+
+    def get_code(self, name):
+        """
+        Return the code for `name`, assigning one if it's new.
+        """
+
+        try:
+            return self.codes[name]
+        except KeyError:
+            code = self.codes[name] = len(self.names)
+            self.names.append(name)
+            return code
+
+class Table(object):
+    """
+    Base class for columnar tables. Rows are appended to `array.array`
+    columns, which are converted to NumPy arrays by `build()`.
+
+    `columns` is a tuple of `(name, array_typecode, numpy_dtype)` tuples.
+    Python 2's `array` has no 64-bit integer typecode - `'l'` is a C `long`,
+    only 32 bits on some platforms - so `int64` columns have a `None`
+    typecode, and are collected in lists instead. Columns named in
+    `date_columns` hold proleptic Gregorian ordinals while collecting, and
+    are built as `datetime64[D]` arrays.
+    """
+
+    columns = ()
+    date_columns = ()
+
+    def __init__(self):
+        if numpy is None:
+            raise ImportError('mfpsync.tables requires NumPy')
+
+        self.arrays = {
+            name: array(typecode) if typecode is not None else []
+            for name, typecode, _ in self.columns
+        }
+        self.is_built = False
+
+    def __len__(self):
+        name = self.columns[0][0]
+        if self.is_built:
+            return len(getattr(self, name))
+        return len(self.arrays[name])
+
+    def append(self, packet):
+        """
+        Append a row for `packet`.
+        """
+
+        raise NotImplementedError
+
+    def build(self):
+        """
+        Convert the collected columns to NumPy arrays, set as attributes named
+        after the columns. Returns the table.
+        """
+
+        for name, typecode, dtype in self.columns:
+            values = self.arrays[name]
+            if typecode is None:
+                column = numpy.array(values, dtype=dtype)
+            elif values:
+                # `array` and NumPy typecodes both name C types, so the
+                # buffer is read as the type it was written with.
+                column = numpy.frombuffer(values, dtype=numpy.dtype(typecode)).astype(dtype)
+            else:
+                column = numpy.zeros(0, dtype=dtype)
+            if name in self.date_columns:
+                column = (column - _EPOCH_ORDINAL).astype('datetime64[D]')
+            setattr(self, name, column)
+
+        self.arrays = None
+        self.is_built = True
+        return self
+
+class FoodEntryTable(Table):
+    """
+    Table of `FoodEntry` packets.
+
+    `nutrients` is an `(N, 17)` `float32` matrix of each entry's food
+    nutrients, in `Food.nutrient_names` order. `meal_name` holds codes into
+    `meal_names`.
+    """
+
+    columns = (
+        ('master_food_id', None, 'int64'),
+        ('food_master_food_id', 'i', 'int64'),
+        ('date', 'i', 'int64'),
+        ('meal_name', 'i', 'int64'),
+        ('quantity', 'f', 'float32'),
+        ('weight_index', 'i', 'int64'),
+        ('grams', 'f', 'float32'),
+        ('gram_weight', 'f', 'float32'),
+        ('nutrients', 'f', 'float32'),
+    )
+    date_columns = ('date',)
+
+    nutrient_names = Food.nutrient_names
+
+    def __init__(self):
+        super(FoodEntryTable, self).__init__()
+        self.meal_categories = Categories()
+
+    def append(self, packet):
+        arrays = self.arrays
+        food = packet.food
+        arrays['master_food_id'].append(packet.master_food_id)
+        arrays['food_master_food_id'].append(food.master_food_id)
+        arrays['date'].append(packet.date.toordinal())
+        arrays['meal_name'].append(self.meal_categories.get_code(packet.meal_name))
+        arrays['quantity'].append(packet.quantity)
+        arrays['weight_index'].append(packet.weight_index)
+        arrays['grams'].append(food.grams)
+
+        # Entries referring to a missing portion get a NaN weight, so their
+        # scaled nutrients are NaN rather than raising an `IndexError`.
+        if 0 <= packet.weight_index < len(food.portions):
+            arrays['gram_weight'].append(food.portions[packet.weight_index].gram_weight)
+        else:
+            arrays['gram_weight'].append(float('nan'))
+
+        arrays['nutrients'].extend(food.nutrients.array)
+
+    def build(self):
+        super(FoodEntryTable, self).build()
+        self.nutrients = self.nutrients.reshape(-1, len(self.nutrient_names))
+        self.meal_names = list(self.meal_categories.names)
+        return self
+
+    def nutrient_index(self, name):
+        """
+        Return the column index of nutrient `name` within `nutrients`.
+        """
+
+        return self.nutrient_names.index(name)
+
+    def multipliers(self):
+        """
+        Return the per-entry multiplier applied to food nutrients - the
+        vectorised equivalent of `FoodEntry.nutrients`'s
+        `quantity * portion.gram_weight / food.grams`.
+        """
+
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            return (
+                self.quantity.astype('float64') * self.gram_weight / self.grams
+            )
+
+    def scaled_nutrients(self):
+        """
+        Return an `(N, 17)` `float64` matrix of nutrients for each entry, as
+        `FoodEntry.nutrients` computes one entry at a time.
+        """
+
+        return self.nutrients * self.multipliers()[:, numpy.newaxis]
+
+    def totals_by_date(self):
+        """
+        Return a `(dates, totals)` tuple - the sorted unique entry dates, and
+        an `(len(dates), 17)` matrix of scaled nutrient totals for each.
+        """
+
+        dates, indexes = numpy.unique(self.date, return_inverse=True)
+        totals = numpy.zeros((len(dates), len(self.nutrient_names)))
+        numpy.add.at(totals, indexes, numpy.nan_to_num(self.scaled_nutrients()))
+        return dates, totals
+
+class ExerciseEntryTable(Table):
+    """
+    Table of `ExerciseEntry` packets.
+    """
+
+    columns = (
+        ('master_exercise_entry_id', None, 'int64'),
+        ('master_exercise_id', 'i', 'int64'),
+        ('date', 'i', 'int64'),
+        ('quantity', 'i', 'int64'),
+        ('sets', 'i', 'int64'),
+        ('weight', 'i', 'int64'),
+        ('calories', 'i', 'int64'),
+        ('mets', 'f', 'float32'),
+    )
+    date_columns = ('date',)
+
+    def append(self, packet):
+        arrays = self.arrays
+        arrays['master_exercise_entry_id'].append(packet.master_exercise_entry_id)
+        arrays['master_exercise_id'].append(packet.exercise.master_exercise_id)
+        arrays['date'].append(packet.date.toordinal())
+        arrays['quantity'].append(packet.quantity)
+        arrays['sets'].append(packet.sets)
+        arrays['weight'].append(packet.weight)
+        arrays['calories'].append(packet.calories)
+        arrays['mets'].append(packet.exercise.mets)
+
+    def totals_by_date(self):
+        """
+        Return a `(dates, calories)` tuple - the sorted unique entry dates,
+        and the total exercise calories for each.
+        """
+
+        dates, indexes = numpy.unique(self.date, return_inverse=True)
+        return dates, numpy.bincount(indexes, weights=self.calories, minlength=len(dates))
+
+class MeasurementTable(Table):
+    """
+    Table of `MeasurementValue` packets. `type_name` holds codes into
+    `type_names`.
+    """
+
+    columns = (
+        ('master_measurement_id', None, 'int64'),
+        ('type_name', 'i', 'int64'),
+        ('entry_date', 'i', 'int64'),
+        ('value', 'f', 'float32'),
+    )
+    date_columns = ('entry_date',)
+
+    def __init__(self):
+        super(MeasurementTable, self).__init__()
+        self.type_categories = Categories()
+
+    def append(self, packet):
+        arrays = self.arrays
+        arrays['master_measurement_id'].append(packet.master_measurement_id)
+        arrays['type_name'].append(self.type_categories.get_code(packet.type_name))
+        arrays['entry_date'].append(packet.entry_date.toordinal())
+        arrays['value'].append(packet.value)
+
+    def build(self):
+        super(MeasurementTable, self).build()
+        self.type_names = list(self.type_categories.names)
+        return self
+
+    def series(self, type_name):
+        """
+        Return a `(dates, values)` tuple for the measurement `type_name`,
+        sorted by date.
+        """
+
+        if type_name not in self.type_names:
+            return numpy.zeros(0, dtype='datetime64[D]'), numpy.zeros(0, dtype='float32')
+
+        mask = self.type_name == self.type_names.index(type_name)
+        order = numpy.argsort(self.entry_date[mask], kind='mergesort')
+        return self.entry_date[mask][order], self.value[mask][order]
+
+class Tables(object):
+    """
+    Collects packets into a `FoodEntryTable`, `ExerciseEntryTable` and
+    `MeasurementTable`. Other packet types are ignored.
+    """
+
+    def __init__(self):
+        self.food_entries = FoodEntryTable()
+        self.exercise_entries = ExerciseEntryTable()
+        self.measurements = MeasurementTable()
+        self.tables_by_class = {
+            FoodEntry: self.food_entries,
+            ExerciseEntry: self.exercise_entries,
+            MeasurementValue: self.measurements
+        }
+
+    def extend(self, packets):
+        """
+        Append rows for each packet in the iterable `packets`.
+        """
+
+        tables_by_class = self.tables_by_class
+        for packet in packets:
+            table = tables_by_class.get(unfrozen_class(packet))
+            if table is not None:
+                table.append(packet)
+
+    def build(self):
+        """
+        Convert the collected columns to NumPy arrays. Returns the tables.
+        """
+
+        for table in self.tables_by_class.itervalues():
+            table.build()
+        return self
+
+def collect_tables(packets):
+    """
+    Return built `Tables` for the iterable `packets`, such as the result of
+    `Sync.get_packets()` or `AllPackets`.
+    """
+
+    tables = Tables()
+    tables.extend(packets)
+    return tables.build()
@@ -0,0 +1,181 @@
+"""
+Sample packets of every type, and captures encoding them, for tests.
+"""
+
+import cStringIO
+import datetime
+import uuid
+
+from mfpsync.codec import Codec, _PACKET_HEADER
+from mfpsync.codec import objects
+from mfpsync.codec.fields import COUNT
+
+# `packet_type` of the raw packets in `get_capture`, which has no fields so
+# is decoded as an `UnknownPacket`.
+UNKNOWN_PACKET_TYPE = objects.WaterEntry.packet_type
+
+def get_food(number):
+    food = objects.Food()
+    food.master_food_id = 1000 + number
+    food.owner_user_master_id = 7
+    food.original_master_id = -1
+    food.description = u'Caf\xe9 latte {}'.format(number)
+    food.brand = 'Brand'
+    food.flags = 0x3
+    food.nutrients = objects.Nutrients([
+        number + value * 0.5 for value in xrange(len(objects.Nutrients.nutrient_names))
+    ])
+    food.grams = 100.0
+    food.type = number % 2
+
+    for portion_number in xrange(number % 3 + 1):
+        portion = objects.FoodPortion()
+        portion.amount = 1.5
+        portion.gram_weight = 50.0 * (portion_number + 1)
+        portion.description = 'cup'
+        portion.fraction_int = portion_number
+        food.portions.append(portion)
+    return food
+
+def get_exercise(number):
+    exercise = objects.Exercise()
+    exercise.master_exercise_id = 2000 + number
+    exercise.owner_user_master_id = 7
+    exercise.original_master_exercise_id = 0
+    exercise.exercise_type = 1
+    exercise.description = 'Running'
+    exercise.flags = 0x1
+    exercise.mets = 8.0
+    return exercise
+
+def get_packets(number):
+    """
+    Return a list of sample packets of every type with fields, other than
+    `SyncResult` and `SyncRequest`. Values vary with `number`, but some
+    repeat between numbers - as in real responses.
+    """
+
+    food_entry = objects.FoodEntry()
+    food_entry.master_food_id = 2 ** 40 + number
+    food_entry.food = get_food(number % 3)
+    food_entry.date = datetime.date(2016, 2, 28) + datetime.timedelta(days=number % 3)
+    food_entry.meal_name = ('Breakfast', 'Lunch', u'D\xeener')[number % 3]
+    food_entry.quantity = 2.0
+    food_entry.weight_index = 0
+
+    exercise_entry = objects.ExerciseEntry()
+    exercise_entry.master_exercise_entry_id = 2 ** 33 + number
+    exercise_entry.exercise = get_exercise(number % 2)
+    exercise_entry.date = datetime.date(2016, 3, 1)
+    exercise_entry.quantity = 30
+    exercise_entry.sets = 0
+    exercise_entry.weight = 0
+    exercise_entry.calories = 300 + number
+
+    measurement_types = objects.MeasurementTypes()
+    measurement_types.descriptions = {1: 'Weight', 2: 'Neck', -number: 'Other'}
+
+    measurement = objects.MeasurementValue()
+    measurement.master_measurement_id = -2 ** 35 - number
+    measurement.type_name = 'Weight'
+    measurement.entry_date = datetime.date(1970, 1, 1) + datetime.timedelta(days=number)
+    measurement.value = 70.25
+
+    meal = objects.MealIngredients()
+    meal.master_food_id = 3000 + number
+    for ingredient_number in xrange(number % 2 + 1):
+        ingredient = objects.MealIngredient()
+        ingredient.master_ingredient_id = ingredient_number
+        ingredient.master_food_id = 1000 + ingredient_number
+        ingredient.fraction_int = 1
+        ingredient.quantity = 0.5
+        ingredient.weight_index = -1
+        meal.ingredients.append(ingredient)
+
+    properties = objects.UserPropertyUpdate()
+    properties.properties = {'units': 'metric', u'n\xe4me': unicode(number)}
+
+    delete_item = objects.DeleteItem()
+    delete_item.item_type = 4
+    delete_item.master_id = 2 ** 62 + number
+    delete_item.status = 2
+
+    return [
+        get_food(number), get_exercise(number), food_entry, exercise_entry,
+        measurement_types, measurement, meal, properties, delete_item
+    ]
+
+def get_sync_request():
+    sync_request = objects.SyncRequest()
+    sync_request.username = 'user'
+    sync_request.password = u'p\xe4ss'
+    sync_request.installation_uuid = uuid.UUID('12345678-1234-5678-1234-567812345678')
+    sync_request.last_sync_pointers = {'diary': '1', 'food': ''}
+    return sync_request
+
+def encode_raw_packet(packet_type, body):
+    """
+    Return a packet of type `packet_type` with the raw bytes `body`.
+    """
+
+    return _PACKET_HEADER.pack(
+        objects.BinaryPacket.MAGIC, _PACKET_HEADER.size + len(body), 1, packet_type
+    ) + body
+
+def get_capture(count=4):
+    """
+    Return a sync response encoding a `SyncResult`, then `count` lots of
+    `get_packets`, each followed by a raw packet of type
+    `UNKNOWN_PACKET_TYPE`.
+    """
+
+    body_fp = cStringIO.StringIO()
+    body_codec = Codec(body_fp)
+    packet_count = 0
+    for number in xrange(count):
+        for packet in get_packets(number):
+            packet.write_packet_to_codec(body_codec)
+            packet_count += 1
+        body_fp.write(encode_raw_packet(UNKNOWN_PACKET_TYPE, 'raw {}'.format(number)))
+        packet_count += 1
+
+    sync_result = objects.SyncResult()
+    sync_result.error_message = 'none'
+    sync_result.master_id = 7
+    sync_result.flags = 0x1
+    sync_result.expected_packet_count = packet_count
+    sync_result.last_sync_pointers = {'diary': '42', 'food': '43'}
+
+    fp = cStringIO.StringIO()
+    sync_result.write_packet_to_codec(Codec(fp))
+    return fp.getvalue() + body_fp.getvalue()
+
+def get_values(value):
+    """
+    Return `value` as nested primitives, for comparing decoded packets. Objects
+    become a `(class name, dict of field values)` tuple - their fields rather
+    than `to_dict`, which leaves some out.
+    """
+
+    if isinstance(value, objects.UnknownPacket):
+        return ('UnknownPacket', value.packet_type, objects.to_primitive(value.bytes))
+    if isinstance(value, objects.BinaryObject):
+        return (objects.unfrozen_class(value).__name__, {
+            field.name: get_values(getattr(value, field.name))
+            for field in value.fields
+            if not field.flags & COUNT
+        })
+    if isinstance(value, objects.Nutrients):
+        return list(value.array)
+    if isinstance(value, (list, tuple)):
+        return [get_values(item) for item in value]
+    if isinstance(value, dict):
+        return {key: get_values(item) for key, item in value.iteritems()}
+    return value
+
+def decode(data):
+    """
+    Return the values of the packets in `data`, decoded by a plain `Codec`.
+    """
+
+    return get_values(list(Codec(cStringIO.StringIO(data)).read_packets()))
@@ -0,0 +1,233 @@
+"""
+Local stand-in for the sync API, for tests.
+"""
+
+import BaseHTTPServer
+import cStringIO
+import datetime
+import gzip
+import socket
+import SocketServer
+import threading
+import time
+
+from mfpsync.codec import Codec
+from mfpsync.codec.objects import MeasurementValue, SyncResult
+
+class StandInServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """
+    HTTP/1.1 server on a free local port, calling `respond` with the
+    `StandInHandler` and body of each request. Counts connections and
+    requests.
+
+    Example:
+        >>> server = StandInServer(lambda handler, body: handler.send_body('OK'))
+        >>> server.start()
+        >>> urllib2.urlopen(server.url, 'data').read()
+        'OK'
+        >>> server.stop()
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, respond):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0), StandInHandler)
+        self.respond = respond
+        self.connection_count = 0
+        self.request_count = 0
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{}/iphone_api/synchronize'.format(self.server_address[1])
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+class StandInHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        with self.server.lock:
+            self.server.connection_count += 1
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        with self.server.lock:
+            self.server.request_count += 1
+        self.server.respond(self, body)
+
+    def send_body(self, data, status=200, headers=(), chunk_size=None):
+        """
+        Send a response with body `data`, in chunks of `chunk_size` bytes if
+        given.
+        """
+
+        self.send_response(status)
+        for name, value in headers:
+            self.send_header(name, value)
+        if chunk_size is None:
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+            return
+
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        for offset in xrange(0, len(data), chunk_size):
+            chunk = data[offset:offset + chunk_size]
+            self.wfile.write('{:x}\r\n{}\r\n'.format(len(chunk), chunk))
+        self.wfile.write('0\r\n\r\n')
+
+    def drop(self):
+        """
+        Close the connection without responding.
+        """
+
+        self.close_connection = 1
+
+    def log_message(self, format, *args):
+        pass
+
+class ScriptedServer(object):
+    """
+    TCP server on a free local port, answering each connection's first request
+    with the next of `scripts`, then closing the connection. A script is a
+    list of strings, sent `delay` seconds apart so the client reads them
+    separately, and numbers of further seconds to pause. Connections are
+    wrapped by the server-side `ssl.SSLContext` `ssl_context`, if given.
+
+    Example:
+        >>> server = ScriptedServer([['HTTP/1.1 200 OK\\r\\n', 'Content-Length: 0\\r\\n\\r\\n']])
+        >>> server.start()
+    """
+
+    def __init__(self, scripts, delay=0.01, ssl_context=None):
+        self.scripts = scripts
+        self.delay = delay
+        self.ssl_context = ssl_context
+        self.requests = []
+
+        self.sock = socket.socket()
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.listen(5)
+        self.sock.settimeout(10)
+        self.server_address = self.sock.getsockname()
+
+    @property
+    def url(self):
+        scheme = 'https' if self.ssl_context is not None else 'http'
+        return '{}://127.0.0.1:{}/iphone_api/synchronize'.format(scheme, self.server_address[1])
+
+    def start(self):
+        thread = threading.Thread(target=self.serve)
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        self.sock.close()
+
+    def serve(self):
+        for script in self.scripts:
+            try:
+                connection, _ = self.sock.accept()
+            except socket.error:
+                return
+            try:
+                connection.settimeout(10)
+                connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                if self.ssl_context is not None:
+                    connection = self.ssl_context.wrap_socket(connection, server_side=True)
+
+                request = ''
+                while '\r\n\r\n' not in request:
+                    data = connection.recv(4096)
+                    if not data:
+                        break
+                    request += data
+                self.requests.append(request)
+
+                for item in script:
+                    if isinstance(item, basestring):
+                        connection.sendall(item)
+                        time.sleep(self.delay)
+                    else:
+                        time.sleep(item)
+            except socket.error:
+                pass
+            finally:
+                connection.close()
+
+def encode_packets(packets):
+    """
+    Return the sync API encoding of `packets`.
+    """
+
+    fp = cStringIO.StringIO()
+    codec = Codec(fp)
+    for packet in packets:
+        packet.write_packet_to_codec(codec)
+    return fp.getvalue()
+
+def get_pages(page_count, packet_count):
+    """
+    Return a list of `page_count` canned responses, each with a `SyncResult`
+    and `packet_count` `MeasurementValue` packets. Each page's sync pointers
+    are `{'page': NUMBER}`, numbering the next page.
+    """
+
+    pages = []
+    for page_number in xrange(page_count):
+        sync_result = SyncResult()
+        sync_result.expected_packet_count = packet_count
+        sync_result.last_sync_pointers = {'page': str(page_number + 1)}
+        sync_result.more_data_to_sync = page_number + 1 < page_count
+
+        packets = [sync_result]
+        for number in xrange(packet_count):
+            measurement = MeasurementValue()
+            measurement.master_measurement_id = page_number * packet_count + number
+            measurement.type_name = 'Weight'
+            measurement.entry_date = datetime.date(2014, 1, 1)
+            measurement.value = 70.5
+            packets.append(measurement)
+        pages.append(encode_packets(packets))
+    return pages
+
+def read_sync_request(body):
+    """
+    Return the `SyncRequest` in the multipart POST `body` of a request.
+    """
+
+    data = body.split('\r\n\r\n', 1)[1].rsplit('\r\n--', 1)[0]
+    return next(iter(Codec(cStringIO.StringIO(data)).read_packets()))
+
+def serve_pages(pages, chunk_size=None):
+    """
+    Return a `respond` function for `StandInServer`, serving each of the
+    canned responses `pages` in turn by their sync pointers - gzipped if the
+    client accepts it, and in chunks of `chunk_size` bytes if given.
+    """
+
+    def respond(handler, body):
+        sync_request = read_sync_request(body)
+        data = pages[int(sync_request.last_sync_pointers.get('page', 0))]
+
+        headers = []
+        if 'gzip' in handler.headers.get('Accept-Encoding', ''):
+            fp = cStringIO.StringIO()
+            with gzip.GzipFile(fileobj=fp, mode='wb') as gzip_fp:
+                gzip_fp.write(data)
+            data = fp.getvalue()
+            headers.append(('Content-Encoding', 'gzip'))
+        handler.send_body(data, headers=headers, chunk_size=chunk_size)
+
+    return respond
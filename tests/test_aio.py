@@ -0,0 +1,364 @@
+import httplib
+import os
+import shutil
+import socket
+import ssl
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+import urllib2
+
+from mfpsync import Sync
+from mfpsync.aio import (
+    AsyncAllPackets, AsyncSync, BodyStream, EventLoop, Return, SocketTransport, Task, gather
+)
+from mfpsync.http import HttpRequestParams
+from tests.standin import (
+    ScriptedServer, StandInServer, get_pages, read_sync_request, serve_pages
+)
+
+class ThreadRecordingSync(Sync):
+    """
+    `Sync` recording the names of the threads responses are decoded on.
+    """
+
+    def __init__(self, username, password):
+        super(ThreadRecordingSync, self).__init__(username, password)
+        self.thread_names = []
+
+    def decode_response(self, *args, **kwargs):
+        self.thread_names.append(threading.current_thread().name)
+        return super(ThreadRecordingSync, self).decode_response(*args, **kwargs)
+
+class AsyncSyncTest(unittest.TestCase):
+    def setUp(self):
+        self.loop = EventLoop()
+        self.addCleanup(self.loop.close)
+        self.transport = SocketTransport(self.loop)
+        self.addCleanup(self.transport.clear)
+
+    def start_server(self, respond):
+        server = StandInServer(respond)
+        server.start()
+        self.addCleanup(server.stop)
+
+        self.addCleanup(setattr, HttpRequestParams, 'url', HttpRequestParams.url)
+        HttpRequestParams.url = server.url
+        return server
+
+    def read_all(self, sync):
+        all_packets = AsyncAllPackets(AsyncSync(sync, self.loop, self.transport))
+        return self.loop.run_until_complete(all_packets.read_all())
+
+    def test_reuses_connection(self):
+        server = self.start_server(serve_pages(get_pages(3, 10)))
+        packets = self.read_all(Sync('username', 'password'))
+
+        self.assertEqual(len(packets), 33)
+        self.assertEqual(server.request_count, 3)
+        self.assertEqual(server.connection_count, 1)
+
+    def test_chunked_body(self):
+        self.start_server(serve_pages(get_pages(2, 500), chunk_size=1000))
+        for compress in (False, True):
+            sync = Sync('username', 'password')
+            sync.compress = compress
+            packets = self.read_all(sync)
+            self.assertEqual(len(packets), 1002)
+            self.assertEqual(packets[-1].master_measurement_id, 999)
+
+    def test_retries_stale_connection_once(self):
+        respond = serve_pages(get_pages(2, 10))
+
+        def respond_and_close(handler, body):
+            respond(handler, body)
+            # Close the connection without telling the client, as a server
+            # does once a connection has been idle too long.
+            handler.close_connection = 1
+
+        server = self.start_server(respond_and_close)
+        packets = self.read_all(Sync('username', 'password'))
+        self.assertEqual(len(packets), 22)
+        self.assertEqual(server.request_count, 2)
+        self.assertEqual(server.connection_count, 2)
+
+    def test_doesnt_retry_more_than_once(self):
+        server = self.start_server(lambda handler, body: handler.drop())
+        key = ('http', '127.0.0.1', server.server_address[1])
+        for _ in xrange(3):
+            connection = self.loop.run_until_complete(self.transport.connect(key))
+            self.transport.release_connection(connection)
+
+        with self.assertRaises(httplib.HTTPException):
+            self.read_all(Sync('username', 'password'))
+        self.assertEqual(server.request_count, 2)
+
+    def test_limits_buffered_body(self):
+        self.addCleanup(setattr, BodyStream, 'max_buffered', BodyStream.max_buffered)
+        BodyStream.max_buffered = 1024
+        self.start_server(serve_pages(get_pages(2, 500), chunk_size=300))
+
+        sync = Sync('username', 'password')
+        sync.compress = False
+        packets = self.read_all(sync)
+        self.assertEqual(len(packets), 1002)
+
+    def test_decodes_large_responses_in_executor(self):
+        self.start_server(serve_pages(get_pages(2, 10)))
+
+        sync = ThreadRecordingSync('username', 'password')
+        client = AsyncSync(sync, self.loop, self.transport)
+        client.executor_threshold = 0
+        packets = self.loop.run_until_complete(AsyncAllPackets(client).read_all())
+
+        self.assertEqual(len(packets), 22)
+        self.assertEqual(len(sync.thread_names), 2)
+        self.assertNotIn(threading.current_thread().name, sync.thread_names)
+
+    def test_more_large_responses_than_executor_threads(self):
+        slow_page, = get_pages(1, 2000)
+        fast_pages = get_pages(2, 10)
+
+        def respond(handler, body):
+            sync_request = read_sync_request(body)
+            page_number = int(sync_request.last_sync_pointers.get('page', 0))
+            if sync_request.username == 'slow':
+                # A large page, trickled over a second.
+                data = slow_page
+                piece_size = len(data) // 10 + 1
+                delay = 0.1
+            else:
+                # Small pages, each needing a new connection - and so a host
+                # name lookup - while the slow pages are being received.
+                time.sleep(0.1)
+                data = fast_pages[page_number]
+                piece_size = len(data)
+                delay = 0
+
+            handler.send_response(200)
+            handler.send_header('Content-Length', str(len(data)))
+            handler.send_header('Connection', 'close')
+            handler.end_headers()
+            for offset in xrange(0, len(data), piece_size):
+                handler.wfile.write(data[offset:offset + piece_size])
+                handler.wfile.flush()
+                time.sleep(delay)
+            handler.close_connection = 1
+
+        self.start_server(respond)
+        self.loop.default_executor_size = 1
+        self.transport.timeout = 0.5
+
+        clients = []
+        for username in ('slow', 'slow', 'fast'):
+            sync = Sync(username, 'password')
+            sync.compress = False
+            clients.append(AsyncAllPackets(AsyncSync(sync, self.loop, self.transport)))
+        results = self.loop.run_until_complete(
+            gather(self.loop, [client.read_all() for client in clients])
+        )
+
+        self.assertEqual([len(packets) for packets in results], [2001, 2001, 22])
+
+class SocketTransportTest(unittest.TestCase):
+    def setUp(self):
+        self.loop = EventLoop()
+        self.addCleanup(self.loop.close)
+        self.transport = SocketTransport(self.loop)
+        self.addCleanup(self.transport.clear)
+
+    def start_server(self, scripts, **kwargs):
+        server = ScriptedServer(scripts, **kwargs)
+        server.start()
+        self.addCleanup(server.stop)
+        return server
+
+    def get(self, server):
+        """
+        Return the `HttpResponse` and body of a GET request to `server`.
+        """
+
+        def get():
+            response = yield self.transport.request('GET', server.url, {})
+            yield response.body.wait_complete()
+            raise Return((response, response.body.read()))
+
+        return self.loop.run_until_complete(Task(self.loop, get()))
+
+    def test_body_split_across_reads(self):
+        server = self.start_server([[
+            'HTTP/1.1 200 OK\r\nContent-Le', 'ngth: 11\r', '\n\r', '\nhello', ' ', 'world'
+        ]])
+        response, body = self.get(server)
+        self.assertEqual(response.status, 200)
+        self.assertEqual(response.reason, 'OK')
+        self.assertEqual(body, 'hello world')
+        self.assertTrue(server.requests[0].startswith('GET /iphone_api/synchronize HTTP/1.1\r\n'))
+
+    def test_split_chunks(self):
+        server = self.start_server([[
+            'HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n',
+            '5', ';name=value\r', '\nhel', 'lo\r', '\n',
+            '6\r\n world\r\n', '0\r\nTrailer: ', 'value\r\n', '\r\n'
+        ]])
+        response, body = self.get(server)
+        self.assertEqual(body, 'hello world')
+
+    def test_missing_content_length(self):
+        server = self.start_server([
+            ['HTTP/1.1 200 OK\r\n\r\n', 'hello', ' world'],
+            ['HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nOK']
+        ])
+        _, body = self.get(server)
+        self.assertEqual(body, 'hello world')
+        # The body ends when the connection closes, so it isn't reused.
+        self.assertEqual(self.transport.idle_connections, {})
+        self.assertEqual(self.get(server)[1], 'OK')
+
+    def test_no_body(self):
+        server = self.start_server([['HTTP/1.1 204 No Content\r\n\r\n', 1]])
+        response, body = self.get(server)
+        self.assertEqual(response.status, 204)
+        self.assertEqual(body, '')
+
+    def test_closed_mid_body(self):
+        server = self.start_server([
+            ['HTTP/1.1 200 OK\r\nContent-Length: 11\r\n\r\n', 'hello'],
+            ['HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n', '5\r\nhello\r\n6\r\n w'],
+            ['HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n', '5\r\nhello\r\n']
+        ])
+        for _ in server.scripts:
+            with self.assertRaises(httplib.IncompleteRead):
+                self.get(server)
+        self.assertEqual(self.transport.idle_connections, {})
+
+    def test_bad_chunk(self):
+        server = self.start_server([
+            ['HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n', 'x\r\n'],
+            ['HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n', '5\r\nhelloXX']
+        ])
+        for _ in server.scripts:
+            with self.assertRaises(httplib.HTTPException):
+                self.get(server)
+
+    def test_partial_status_line(self):
+        server = self.start_server([['HTTP/1.1 20'], ['HTTP/1.1 OK\r\n\r\n']])
+        with self.assertRaises(httplib.IncompleteRead):
+            self.get(server)
+        with self.assertRaises(httplib.BadStatusLine):
+            self.get(server)
+
+    def test_interim_response(self):
+        server = self.start_server([[
+            'HTTP/1.1 100 Continue\r\n\r\n', 'HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nOK'
+        ]])
+        response, body = self.get(server)
+        self.assertEqual(response.status, 200)
+        self.assertEqual(body, 'OK')
+
+    def test_http_error(self):
+        server = self.start_server([[
+            'HTTP/1.1 503 Unavailable\r\nContent-Length: 9\r\n\r\n', 'try later'
+        ]])
+        with self.assertRaises(urllib2.HTTPError) as context:
+            self.get(server)
+        self.assertEqual(context.exception.code, 503)
+        self.assertEqual(context.exception.read(), 'try later')
+
+    def test_timeout_per_operation(self):
+        # A body that keeps arriving doesn't time out, however long it takes
+        # in total.
+        self.transport.timeout = 0.2
+        server = self.start_server([
+            ['HTTP/1.1 200 OK\r\nContent-Length: 5\r\n\r\n'] + ['x', 0.1] * 5,
+            ['HTTP/1.1 200 OK\r\nContent-Length: 5\r\n\r\n', 'x', 1]
+        ])
+        self.assertEqual(self.get(server)[1], 'xxxxx')
+        with self.assertRaises(socket.timeout):
+            self.get(server)
+
+    def test_tls(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        cert_path = os.path.join(directory, 'cert.pem')
+        key_path = os.path.join(directory, 'key.pem')
+        try:
+            subprocess.check_call([
+                'openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1',
+                '-subj', '/CN=127.0.0.1', '-addext', 'subjectAltName=IP:127.0.0.1',
+                '-keyout', key_path, '-out', cert_path
+            ], stdout=open(os.devnull, 'w'), stderr=subprocess.STDOUT)
+        except (OSError, subprocess.CalledProcessError):
+            self.skipTest('openssl is needed to make a certificate')
+
+        server_context = ssl.SSLContext(ssl.PROTOCOL_SSLv23)
+        server_context.load_cert_chain(cert_path, key_path)
+        server = self.start_server([[
+            'HTTP/1.1 200 OK\r\nContent-Length: 11\r\n\r\n', 'hello', ' world'
+        ]], ssl_context=server_context)
+
+        self.transport.ssl_context = ssl.create_default_context(cafile=cert_path)
+        response, body = self.get(server)
+        self.assertEqual(body, 'hello world')
+
+class BodyStreamTest(unittest.TestCase):
+    def setUp(self):
+        self.loop = EventLoop()
+        self.addCleanup(self.loop.close)
+        self.body = BodyStream(self.loop)
+        self.body.max_buffered = 8
+
+    def test_reads(self):
+        self.body.feed('hello')
+        self.body.feed(' world')
+        self.assertEqual(self.body.read(3), 'hel')
+        self.assertEqual(self.body.read(4), 'lo w')
+        self.body.feed_eof()
+        self.assertEqual(self.body.read(), 'orld')
+        self.assertEqual(self.body.read(10), '')
+
+    def test_waits_for_reader(self):
+        self.assertTrue(self.body.feed('hello').done())
+        fed = self.body.feed(' world')
+        self.assertFalse(fed.done())
+
+        thread = threading.Thread(target=self.body.read, args=(8,))
+        thread.start()
+        thread.join()
+        self.loop.run_until_complete(fed)
+
+    def test_wait_complete(self):
+        fed = self.body.feed('hello world')
+        complete = self.body.wait_complete()
+        self.assertFalse(complete.done())
+        # The body is no longer limited, so can be read in full on the loop.
+        self.loop.run_until_complete(fed)
+        self.body.feed_eof()
+        self.loop.run_until_complete(complete)
+        self.assertEqual(self.body.read(), 'hello world')
+
+    def test_error(self):
+        self.body.feed('hello')
+        complete = self.body.wait_complete()
+        try:
+            raise httplib.IncompleteRead('hello', 6)
+        except httplib.IncompleteRead:
+            self.body.set_exc_info(sys.exc_info())
+        with self.assertRaises(httplib.IncompleteRead):
+            self.body.read()
+        with self.assertRaises(httplib.IncompleteRead):
+            self.loop.run_until_complete(complete)
+
+    def test_close(self):
+        self.body.feed('hello')
+        fed = self.body.feed(' world')
+        self.body.close()
+        self.loop.run_until_complete(fed)
+        self.assertEqual(self.body.read(), '')
+        self.assertTrue(self.body.feed('more').done())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from mfpsync.batch import FileSink
+from mfpsync.codec.objects import Food, SyncResult
+
+class Page(object):
+    """
+    Stand-in for `AllPackets`, as of a single page.
+    """
+
+    def __init__(self, page_number):
+        self.sync_result = SyncResult()
+        self.sync_result.last_sync_pointers = {'page': str(page_number)}
+        self.last_sync_pointers = self.sync_result.last_sync_pointers
+
+def get_foods(*master_food_ids):
+    foods = []
+    for master_food_id in master_food_ids:
+        food = Food()
+        food.master_food_id = master_food_id
+        foods.append(food)
+    return foods
+
+class FileSinkTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.filename = os.path.join(self.directory, 'account.ndjson')
+        self.pointers_filename = os.path.join(self.directory, 'account.pointers.json')
+
+    def get_sink(self):
+        return FileSink(self.filename, self.pointers_filename, 'ndjson')
+
+    def get_food_ids(self):
+        with open(self.filename) as fp:
+            return [json.loads(line)['data']['master_food_id'] for line in fp]
+
+    def test_failed_page_is_discarded(self):
+        sink = self.get_sink()
+        sink.write_page(get_foods(1, 2), Page(1))
+
+        def failing_page():
+            for food in get_foods(3, 4):
+                yield food
+            raise IOError('Connection reset')
+
+        with self.assertRaises(IOError):
+            sink.write_page(failing_page(), Page(2))
+        sink.close()
+        self.assertEqual(self.get_food_ids(), [1, 2])
+        self.assertEqual(sink.last_sync_pointers, {'page': '1'})
+
+        # Resuming appends from the last checkpoint.
+        sink = self.get_sink()
+        sink.write_page(get_foods(3, 4), Page(2))
+        sink.finish(Page(2))
+        sink.close()
+        self.assertEqual(self.get_food_ids(), [1, 2, 3, 4])
+        self.assertEqual(sink.last_sync_pointers, {'page': '2'})
+
+    def test_unclosed_page_is_discarded(self):
+        sink = self.get_sink()
+        sink.write_page(get_foods(1, 2), Page(1))
+
+        # A killed process leaves a page part written, and the sink unclosed.
+        def killed_page():
+            for food in get_foods(3, 4):
+                yield food
+            sink.fp.write('{"type": "Fo')
+            sink.fp.flush()
+            raise KeyboardInterrupt
+
+        with self.assertRaises(KeyboardInterrupt):
+            sink.write_page(killed_page(), Page(2))
+        with open(self.filename) as fp:
+            self.assertEqual(len(fp.read().splitlines()), 5)
+
+        sink = self.get_sink()
+        self.assertEqual(self.get_food_ids(), [1, 2])
+        self.assertEqual(sink.last_sync_pointers, {'page': '1'})
+        sink.write_page(get_foods(3, 4), Page(2))
+        sink.finish(Page(2))
+        sink.close()
+        self.assertEqual(self.get_food_ids(), [1, 2, 3, 4])
+
+    def test_legacy_pointers(self):
+        with open(self.filename, 'w') as fp:
+            fp.write('{"type": "Food", "data": {"master_food_id": 1}}\n')
+        with open(self.pointers_filename, 'w') as fp:
+            json.dump({'page': '1'}, fp)
+
+        sink = self.get_sink()
+        self.assertEqual(sink.last_sync_pointers, {'page': '1'})
+        sink.write_page(get_foods(2), Page(2))
+        sink.close()
+        self.assertEqual(self.get_food_ids(), [1, 2])
+
+if __name__ == '__main__':
+    unittest.main()
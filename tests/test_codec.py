@@ -0,0 +1,242 @@
+import cStringIO
+import datetime
+import unittest
+
+from mfpsync import codec
+from mfpsync.codec import BufferCodec, Codec, StreamCodec, get_packet_types
+from mfpsync.codec.cache import StringTable
+from mfpsync.codec.objects import (
+    DeleteItem, ExerciseEntry, FoodEntry, MealIngredients, MeasurementValue, SyncResult
+)
+
+from tests.packets import decode, get_capture, get_packets, get_values
+
+class BufferCodecTest(unittest.TestCase):
+    def test_matches_codec(self):
+        data = get_capture()
+        expected = decode(data)
+        for buffer_data in (data, bytearray(data), memoryview(data)):
+            packets = list(BufferCodec(buffer_data).read_packets())
+            self.assertEqual(get_values(packets), expected)
+
+    def test_offset(self):
+        data = get_capture()
+        packets = list(BufferCodec('padding' + data, len('padding')).read_packets())
+        self.assertEqual(get_values(packets), decode(data))
+        self.assertEqual(packets[1].packet_start, len('padding') + packets[0].packet_length)
+
+    def test_truncated(self):
+        data = get_capture()
+        codec = BufferCodec(data[:-1])
+        with self.assertRaises(Exception):
+            list(codec.read_packets())
+
+class TrickleReader(object):
+    """
+    File object returning at most `read_size` bytes per read, as a socket
+    may.
+    """
+
+    def __init__(self, data, read_size):
+        self.fp = cStringIO.StringIO(data)
+        self.read_size = read_size
+
+    def read(self, size=-1):
+        if size < 0:
+            size = self.read_size
+        return self.fp.read(min(size, self.read_size))
+
+class StreamCodecTest(unittest.TestCase):
+    def test_matches_codec(self):
+        data = get_capture()
+        expected = decode(data)
+        for read_size in (1, 7, 4096):
+            tee_fp = cStringIO.StringIO()
+            codec = StreamCodec(TrickleReader(data, read_size), tee_fp)
+            packets = [get_values(packet) for packet in codec.read_packets()]
+            self.assertEqual(packets, expected)
+            self.assertEqual(tee_fp.getvalue(), data)
+            self.assertEqual(codec.position, len(data))
+
+    def test_truncated(self):
+        data = get_capture()
+        codec = StreamCodec(TrickleReader(data[:-1], 7))
+        with self.assertRaises(Exception):
+            list(codec.read_packets())
+
+class TypeFilterTest(unittest.TestCase):
+    def get_codecs(self, data):
+        return [
+            Codec(cStringIO.StringIO(data)), BufferCodec(data),
+            StreamCodec(TrickleReader(data, 7))
+        ]
+
+    def test_matches_codec(self):
+        data = get_capture()
+        expected = decode(data)
+        for types in ((FoodEntry,), (DeleteItem, MeasurementValue.packet_type), (SyncResult,), ()):
+            packet_types = get_packet_types(types)
+            for codec_ in self.get_codecs(data):
+                packets = list(codec_.read_packets(types))
+                self.assertEqual(get_values(packets), [
+                    values for values, packet_type in zip(expected, self.get_types(data))
+                    if packet_type in packet_types
+                ])
+                self.assertEqual(codec_.packet_count, len(expected) - 1)
+
+    def test_checks_packet_count(self):
+        data = get_capture()
+        for codec_ in self.get_codecs(data[:-1]):
+            with self.assertRaises(Exception):
+                list(codec_.read_packets([FoodEntry]))
+
+    def get_types(self, data):
+        return [
+            packet.packet_type
+            for packet in Codec(cStringIO.StringIO(data)).read_packets()
+        ]
+
+def get_attribute(obj, name):
+    """
+    Return the attribute `name` of `obj`, which may be dotted - mapped over
+    the items of arrays.
+    """
+
+    field_name, _, sub_name = name.partition('.')
+    value = getattr(obj, field_name)
+    if not sub_name:
+        return value
+    if isinstance(value, (list, tuple)):
+        return [get_attribute(item, sub_name) for item in value]
+    return get_attribute(value, sub_name)
+
+class ProjectionTest(unittest.TestCase):
+    projections = {
+        FoodEntry: ('date', 'food.nutrients', 'food.portions.gram_weight', 'quantity'),
+        ExerciseEntry: ('exercise.mets', 'calories'),
+        MeasurementValue: ('master_measurement_id',),
+        MealIngredients: ('ingredients',),
+        DeleteItem: ('status',)
+    }
+
+    def test_matches_codec(self):
+        data = get_capture()
+        expected = list(Codec(cStringIO.StringIO(data)).read_packets())
+        for codec_ in (
+            Codec(cStringIO.StringIO(data)), BufferCodec(data),
+            StreamCodec(TrickleReader(data, 7))
+        ):
+            codec_.projections = self.projections
+            packets = list(codec_.read_packets())
+            self.assertEqual(len(packets), len(expected))
+
+            for packet, expected_packet in zip(packets, expected):
+                self.assertIs(packet.__class__, expected_packet.__class__)
+                names = self.projections.get(packet.__class__)
+                if names is None:
+                    self.assertEqual(get_values(packet), get_values(expected_packet))
+                    continue
+                for name in names:
+                    self.assertEqual(
+                        get_values(get_attribute(packet, name)),
+                        get_values(get_attribute(expected_packet, name)), name
+                    )
+
+    def test_leaves_defaults(self):
+        codec_ = BufferCodec(get_capture())
+        codec_.projections = self.projections
+        entry = next(packet for packet in codec_.read_packets() if isinstance(packet, FoodEntry))
+        self.assertEqual(entry.meal_name, '')
+        self.assertEqual(entry.food.description, '')
+        self.assertEqual(entry.food.portions[0].description, '')
+
+    def test_projected_reader(self):
+        # Readers reading trailing fields leave the codec after the object.
+        for packet in get_packets(1):
+            packet_class = packet.__class__
+            names = self.projections.get(packet_class)
+            if names is None:
+                continue
+            fp = cStringIO.StringIO()
+            packet.write_body_to_codec(Codec(fp))
+
+            codec_ = BufferCodec(fp.getvalue())
+            obj = codec_.read_object(packet_class, packet_class.get_projected_reader(names))
+            self.assertEqual(codec_.position, len(fp.getvalue()))
+            for name in names:
+                self.assertEqual(
+                    get_values(get_attribute(obj, name)), get_values(get_attribute(packet, name))
+                )
+
+class StringTableTest(unittest.TestCase):
+    def test_matches_codec(self):
+        data = get_capture()
+        expected = decode(data)
+        for string_table in (StringTable(), StringTable(max_size=2, max_length=4)):
+            for codec_ in (Codec(cStringIO.StringIO(data)), BufferCodec(data)):
+                codec_.string_table = string_table
+                self.assertEqual(get_values(list(codec_.read_packets())), expected)
+
+    def test_shares_strings(self):
+        codec_ = BufferCodec(get_capture(count=6))
+        codec_.string_table = StringTable()
+        entries = [packet for packet in codec_.read_packets() if isinstance(packet, FoodEntry)]
+        self.assertEqual(entries[0].meal_name, entries[3].meal_name)
+        self.assertIs(entries[0].meal_name, entries[3].meal_name)
+        self.assertIsInstance(entries[0].meal_name, unicode)
+        self.assertGreater(codec_.string_table.hits, 0)
+
+class DateTest(unittest.TestCase):
+    def setUp(self):
+        self.codec = Codec(None)
+
+    def check_dates(self, dates):
+        for date in dates:
+            date_string = date.isoformat()
+            expected = datetime.datetime.strptime(date_string, '%Y-%m-%d').date()
+            self.assertEqual(self.codec.decode_date(date_string), expected)
+
+            timestamp = datetime.datetime.combine(date, datetime.time(23, 59, 58))
+            timestamp_string = timestamp.isoformat(' ')
+            self.assertEqual(
+                self.codec.decode_timestamp(timestamp_string),
+                datetime.datetime.strptime(timestamp_string, '%Y-%m-%d %H:%M:%S')
+            )
+
+    def test_matches_datetime(self):
+        self.check_dates([
+            datetime.date(1970, 1, 1), datetime.date(1969, 12, 31),
+            datetime.date(1900, 2, 28), datetime.date(1900, 3, 1),
+            datetime.date(2000, 2, 29), datetime.date(2016, 2, 29),
+            datetime.date(2016, 3, 1), datetime.date(2100, 3, 1),
+            datetime.date(1, 1, 1), datetime.date(9999, 12, 31)
+        ])
+
+    def test_after_cache_clears(self):
+        start = datetime.date(2015, 1, 1)
+        dates = [
+            start + datetime.timedelta(days=day)
+            for day in xrange(codec._date_cache.max_size + 10)
+        ]
+        for _ in xrange(2):
+            self.check_dates(dates)
+            self.assertLessEqual(len(codec._date_cache), codec._date_cache.max_size)
+            self.assertLessEqual(len(codec._timestamp_cache), codec._timestamp_cache.max_size)
+
+    def test_invalid(self):
+        for date_string in (
+            '2015-02-29', '2016/02/29', '2016-13-01', '20160-2-29',
+            '2016-+1-29', '2016-02- 9', ' 016-02-29', '2016-02-29x', '2016-02'
+        ):
+            with self.assertRaises(ValueError):
+                self.codec.decode_date(date_string)
+            self.assertNotIn(date_string, codec._date_cache)
+        for timestamp_string in (
+            '2016-02-29T12:00:00', '2016-02-29 -1:00:00', '2016-02-29 12: 0:00',
+            '2016-02-29 12:00:00.5'
+        ):
+            with self.assertRaises(ValueError):
+                self.codec.decode_timestamp(timestamp_string)
+
+if __name__ == '__main__':
+    unittest.main()
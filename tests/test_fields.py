@@ -0,0 +1,160 @@
+import cStringIO
+import datetime
+import struct
+import unittest
+
+from mfpsync.codec import BufferCodec, Codec
+from mfpsync.codec import fields, objects
+
+from tests.packets import get_food, get_packets, get_sync_request, get_values
+
+def get_samples():
+    """
+    Return a dict mapping every class in `mfpsync.codec.objects` that has
+    `fields` to a list of sample objects.
+    """
+
+    samples = {}
+    packets = get_packets(0) + get_packets(1) + [get_sync_request()]
+    for packet in packets:
+        samples.setdefault(packet.__class__, []).append(packet)
+
+    sync_result = objects.SyncResult()
+    sync_result.error_message = 'error'
+    sync_result.expected_packet_count = 123456
+    sync_result.last_sync_pointers = {'diary': '1', 'food': '2'}
+    samples[objects.SyncResult] = [sync_result, objects.SyncResult()]
+
+    samples[objects.FoodPortion] = get_food(2).portions
+    samples[objects.MealIngredient] = get_packets(1)[6].ingredients
+    return samples
+
+def get_field_classes():
+    return set(
+        value
+        for value in vars(objects).itervalues()
+        if isinstance(value, type) and issubclass(value, objects.BinaryObject)
+        and value.fields is not None
+    )
+
+def encode_string(value):
+    value = value.encode('utf8')
+    return struct.pack('>h', len(value)) + value
+
+class CompiledMethodsTest(unittest.TestCase):
+    def encode(self, obj):
+        fp = cStringIO.StringIO()
+        obj.write_body_to_codec(Codec(fp))
+        return fp.getvalue()
+
+    def test_samples_cover_classes(self):
+        self.assertEqual(set(get_samples()), get_field_classes())
+
+    def test_round_trip(self):
+        for cls, samples in get_samples().iteritems():
+            for sample in samples:
+                data = self.encode(sample)
+                for codec in (
+                    Codec(cStringIO.StringIO(data + 'tail')),
+                    BufferCodec(data + 'tail')
+                ):
+                    obj = cls.__new__(cls)
+                    obj.read_body_from_codec(codec)
+                    self.assertEqual(get_values(obj), get_values(sample), cls.__name__)
+                    self.assertEqual(codec.position, len(data), cls.__name__)
+
+                    codec.position = 0
+                    cls.skip_body_in_codec(codec)
+                    self.assertEqual(codec.position, len(data), cls.__name__)
+
+    def test_truncated(self):
+        for cls, samples in get_samples().iteritems():
+            data = self.encode(samples[0])
+            obj = cls.__new__(cls)
+            with self.assertRaises(EOFError):
+                obj.read_body_from_codec(BufferCodec(data[:-1]))
+            with self.assertRaises(EOFError):
+                cls.skip_body_in_codec(BufferCodec(data[:-1]))
+
+    def test_sync_result_layout(self):
+        # The map's item count comes before `expected_packet_count`, not
+        # immediately before the map.
+        sync_result = objects.SyncResult()
+        sync_result.status_code = 1
+        sync_result.error_message = 'error'
+        sync_result.master_id = 7
+        sync_result.flags = 3
+        sync_result.expected_packet_count = 9
+        sync_result.last_sync_pointers = {'diary': '1'}
+
+        self.assertEqual(self.encode(sync_result), ''.join([
+            struct.pack('>h', 1), encode_string('error'), encode_string(''),
+            struct.pack('>lhhl', 7, 3, 1, 9),
+            encode_string('diary'), encode_string('1')
+        ]))
+
+    def test_food_entry_layout(self):
+        entry = get_packets(1)[2]
+        food = entry.food
+
+        self.assertEqual(self.encode(entry), ''.join([
+            struct.pack('>q', entry.master_food_id),
+            struct.pack('>lll', 1001, 7, -1),
+            encode_string(food.description), encode_string('Brand'),
+            struct.pack('>l', 3),
+            struct.pack('>17f', *food.nutrients.array),
+            struct.pack('>fh', 100.0, 1),
+            struct.pack('>h', 2),
+            struct.pack('>ff', 1.5, 50.0), encode_string('cup'), struct.pack('>h', 0),
+            struct.pack('>ff', 1.5, 100.0), encode_string('cup'), struct.pack('>h', 1),
+            '2016-02-29', encode_string('Lunch'), struct.pack('>fl', 2.0, 0)
+        ]))
+
+    def test_meal_ingredients_layout(self):
+        meal = get_packets(0)[6]
+        self.assertEqual(self.encode(meal), ''.join([
+            struct.pack('>ll', 3000, 1),
+            struct.pack('>lllfh', 0, 1000, 1, 0.5, -1)
+        ]))
+
+class FormatTest(unittest.TestCase):
+    def check_dates(self, dates):
+        for date in dates:
+            self.assertEqual(fields.format_date(date), '{:04d}-{:02d}-{:02d}'.format(
+                date.year, date.month, date.day
+            ))
+            self.assertEqual(fields.format_date(date), date.isoformat())
+
+            timestamp = datetime.datetime.combine(date, datetime.time(23, 59, 58))
+            self.assertEqual(fields.format_timestamp(timestamp), timestamp.isoformat(' '))
+
+    def test_matches_datetime(self):
+        self.check_dates([
+            datetime.date(1970, 1, 1), datetime.date(1969, 12, 31),
+            datetime.date(1900, 2, 28), datetime.date(1900, 3, 1),
+            datetime.date(2000, 2, 29), datetime.date(2016, 2, 29),
+            datetime.date(2016, 3, 1), datetime.date(2100, 3, 1),
+            datetime.date(9999, 12, 31)
+        ])
+
+    def test_after_cache_clears(self):
+        start = datetime.date(2015, 1, 1)
+        dates = [
+            start + datetime.timedelta(days=day)
+            for day in xrange(fields._date_strings.max_size + 10)
+        ]
+        for _ in xrange(2):
+            self.check_dates(dates)
+            self.assertLessEqual(len(fields._date_strings), fields._date_strings.max_size)
+            self.assertLessEqual(
+                len(fields._timestamp_strings), fields._timestamp_strings.max_size
+            )
+
+    def test_converted_primitives(self):
+        measurement = get_packets(0)[5]
+        measurement.entry_date = datetime.date(2016, 2, 29)
+        self.assertEqual(measurement.to_dict()['entry_date'], '2016-02-29')
+        self.assertEqual(objects.to_primitive(datetime.datetime(1970, 1, 1)), '1970-01-01 00:00:00')
+
+if __name__ == '__main__':
+    unittest.main()
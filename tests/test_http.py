@@ -0,0 +1,163 @@
+import cStringIO
+import gzip
+import httplib
+import random
+import socket
+import time
+import unittest
+import urllib2
+import zlib
+
+from mfpsync import Sync
+from mfpsync.http import ConnectionPool, DecompressingReader, HttpRequestParams
+from tests.standin import StandInServer
+
+class ConnectionPoolTest(unittest.TestCase):
+    def start_server(self, respond):
+        server = StandInServer(respond)
+        server.start()
+        self.addCleanup(server.stop)
+        return server
+
+    def test_reuses_connection(self):
+        server = self.start_server(lambda handler, body: handler.send_body(body))
+        pool = ConnectionPool()
+        for number in xrange(3):
+            response = pool.request('POST', server.url, {}, str(number))
+            self.assertEqual(response.read(), str(number))
+
+        self.assertEqual(server.request_count, 3)
+        self.assertEqual(server.connection_count, 1)
+
+    def test_retries_stale_connection_once(self):
+        def respond(handler, body):
+            handler.send_body(body)
+            # Close the connection without telling the client, as a server
+            # does once a connection has been idle too long.
+            handler.close_connection = 1
+
+        server = self.start_server(respond)
+        pool = ConnectionPool()
+        self.assertEqual(pool.request('POST', server.url, {}, 'first').read(), 'first')
+        self.assertEqual(pool.request('POST', server.url, {}, 'second').read(), 'second')
+        self.assertEqual(server.request_count, 2)
+        self.assertEqual(server.connection_count, 2)
+
+    def test_doesnt_retry_more_than_once(self):
+        server = self.start_server(lambda handler, body: handler.drop())
+        pool = ConnectionPool(max_size=4)
+        key = ('http', '127.0.0.1', server.server_address[1])
+        for _ in xrange(4):
+            connection = pool.new_connection(key)
+            connection.connect()
+            pool.release_connection(key, connection)
+
+        with self.assertRaises(httplib.BadStatusLine):
+            pool.request('POST', server.url, {}, 'data')
+        self.assertEqual(server.request_count, 2)
+
+    def test_doesnt_retry_new_connection(self):
+        server = self.start_server(lambda handler, body: handler.drop())
+        with self.assertRaises(httplib.BadStatusLine):
+            ConnectionPool().request('POST', server.url, {}, 'data')
+        self.assertEqual(server.request_count, 1)
+
+    def test_doesnt_retry_timeout(self):
+        def respond(handler, body):
+            if body == 'slow':
+                time.sleep(0.5)
+            handler.send_body(body)
+
+        server = self.start_server(respond)
+        pool = ConnectionPool()
+        pool.request('POST', server.url, {}, 'first').read()
+        key = ('http', '127.0.0.1', server.server_address[1])
+        pool.idle_connections[key][-1][0].sock.settimeout(0.1)
+
+        # The server received the request, so it mustn't be sent again.
+        with self.assertRaises(socket.timeout):
+            pool.request('POST', server.url, {}, 'slow')
+        self.assertEqual(server.request_count, 2)
+
+    def test_http_error_keeps_connection(self):
+        server = self.start_server(lambda handler, body: handler.send_body('Nope', status=503))
+        pool = ConnectionPool()
+        for _ in xrange(2):
+            with self.assertRaises(urllib2.HTTPError) as context:
+                pool.request('POST', server.url, {}, 'data')
+            self.assertEqual(context.exception.code, 503)
+            self.assertEqual(context.exception.read(), 'Nope')
+        self.assertEqual(server.connection_count, 1)
+
+class SyncHttpErrorTest(unittest.TestCase):
+    def test_raises_http_error(self):
+        # Regression test - non-2xx responses raised an `AttributeError`, as
+        # `urllib2.HTTPError` was given a response without `readline`.
+        server = StandInServer(lambda handler, body: handler.send_body('Down', status=500))
+        server.start()
+        self.addCleanup(server.stop)
+        self.addCleanup(setattr, HttpRequestParams, 'url', HttpRequestParams.url)
+        HttpRequestParams.url = server.url
+
+        sync = Sync('username', 'password')
+        sync.connection_pool = ConnectionPool()
+        with self.assertRaises(urllib2.HTTPError) as context:
+            list(sync.get_packets())
+        self.assertEqual(context.exception.code, 500)
+        self.assertEqual(context.exception.read(), 'Down')
+        self.assertEqual(context.exception.readline(), '')
+
+class DecompressingReaderTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        # Several MB of moderately compressible data.
+        rng = random.Random(0)
+        words = [''.join(chr(rng.randint(97, 122)) for _ in xrange(8)) for _ in xrange(256)]
+        cls.data = ' '.join(rng.choice(words) for _ in xrange(600000))
+
+    def compress(self, content_encoding):
+        if content_encoding == 'gzip':
+            fp = cStringIO.StringIO()
+            with gzip.GzipFile(fileobj=fp, mode='wb') as gzip_fp:
+                gzip_fp.write(self.data)
+            return fp.getvalue()
+        if content_encoding == 'deflate':
+            return zlib.compress(self.data)
+        compressor = zlib.compressobj(6, zlib.DEFLATED, -zlib.MAX_WBITS)
+        return compressor.compress(self.data) + compressor.flush()
+
+    def test_read_all(self):
+        for content_encoding in ('gzip', 'deflate', 'raw deflate'):
+            compressed_data = self.compress(content_encoding)
+            tee_fp = cStringIO.StringIO()
+            reader = DecompressingReader(
+                cStringIO.StringIO(compressed_data), content_encoding.split()[-1], tee_fp
+            )
+            self.assertEqual(reader.read(), self.data)
+            self.assertEqual(reader.read(), '')
+            self.assertEqual(tee_fp.getvalue(), compressed_data)
+
+    def test_read_in_pieces(self):
+        reader = DecompressingReader(cStringIO.StringIO(self.compress('gzip')), 'gzip')
+        pieces = []
+        sizes = [1, 10, 100, 16384, 50000]
+        for number in xrange(2000):
+            pieces.append(reader.read(sizes[number % len(sizes)]))
+        pieces.append(reader.read())
+        self.assertEqual(''.join(pieces), self.data)
+
+    def test_streams_from_server(self):
+        compressed_data = self.compress('gzip')
+        server = StandInServer(lambda handler, body: handler.send_body(
+            compressed_data, headers=[('Content-Encoding', 'gzip')], chunk_size=65536
+        ))
+        server.start()
+        self.addCleanup(server.stop)
+
+        response = ConnectionPool().request('POST', server.url, {}, 'data')
+        reader = DecompressingReader(response, response.headers['Content-Encoding'])
+        self.assertEqual(reader.read(10), self.data[:10])
+        self.assertEqual(reader.read(), self.data[10:])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+import cStringIO
+import unittest
+
+from mfpsync.codec import Codec
+from mfpsync.codec.index import PacketIndex
+from mfpsync.codec.objects import DeleteItem, FoodEntry, SyncResult, UnknownPacket
+
+from tests.packets import decode, get_capture, get_values
+
+class PacketIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.data = get_capture()
+        self.packets = list(Codec(cStringIO.StringIO(self.data)).read_packets())
+
+    def test_matches_codec(self):
+        index = PacketIndex(self.data)
+        index.validate()
+        self.assertEqual(len(index), len(self.packets))
+        self.assertEqual(get_values([packet.decode() for packet in index]), decode(self.data))
+
+        for lazy_packet, packet in zip(index, self.packets):
+            self.assertEqual(lazy_packet.packet_start, packet.packet_start)
+            self.assertEqual(lazy_packet.packet_length, packet.packet_length)
+            self.assertIs(lazy_packet.__class__, packet.__class__)
+
+    def test_decodes_lazily(self):
+        index = PacketIndex(self.data)
+        entry = index[3]
+        self.assertIsInstance(entry, FoodEntry)
+        self.assertFalse(entry.is_decoded)
+        self.assertEqual(entry.date, self.packets[3].date)
+        self.assertTrue(entry.is_decoded)
+        self.assertEqual(get_values(index[-1].decode()), get_values(self.packets[-1]))
+        self.assertIsInstance(index[-1], UnknownPacket)
+
+    def test_filter(self):
+        index = PacketIndex(self.data)
+        self.assertEqual(
+            get_values([packet.decode() for packet in index.filter(FoodEntry, DeleteItem)]),
+            get_values([
+                packet for packet in self.packets if isinstance(packet, (FoodEntry, DeleteItem))
+            ])
+        )
+
+        counts = index.count_types()
+        self.assertEqual(counts[SyncResult.packet_type], 1)
+        self.assertEqual(counts[FoodEntry.packet_type], 4)
+        self.assertEqual(sum(counts.itervalues()), len(self.packets))
+        self.assertEqual(get_values(index.sync_result), get_values(self.packets[0]))
+
+    def test_validates_count(self):
+        index = PacketIndex(self.data[:-1])
+        self.assertEqual(len(index), len(self.packets) - 1)
+        with self.assertRaises(Exception):
+            index.validate()
+
+    def test_validates_pages(self):
+        # Two pages, each with its own `SyncResult`.
+        index = PacketIndex(self.data + get_capture(count=2))
+        index.validate()
+        with self.assertRaises(Exception):
+            PacketIndex(self.data + get_capture(count=2)[:-1]).validate()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+import cStringIO
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+import mfpsync
+from mfpsync import main, output
+
+from tests.packets import get_capture
+
+class MainTest(unittest.TestCase):
+    def setUp(self):
+        self.calls = []
+        commands = dict(main.COMMANDS)
+        for name in commands:
+            main.COMMANDS[name] = lambda argv, name=name: self.calls.append((name, argv))
+        self.addCleanup(main.COMMANDS.update, commands)
+
+    def test_runs_subcommand(self):
+        main.main(['replay', 'response.bin'])
+        self.assertEqual(self.calls, [('replay', ['response.bin'])])
+
+    def test_runs_explicit_sync(self):
+        main.main(['sync', 'replay', 'password'])
+        self.assertEqual(self.calls, [('sync', ['replay', 'password'])])
+
+    def test_syncs_by_default(self):
+        original_sync_command = main.sync_command
+        main.sync_command = lambda argv: self.calls.append(('default', argv))
+        self.addCleanup(setattr, main, 'sync_command', original_sync_command)
+
+        main.main(['username', 'password'])
+        self.assertEqual(self.calls, [('default', ['username', 'password'])])
+
+    def test_defers_subsystem_imports(self):
+        # Run in a fresh interpreter, as other tests import everything.
+        modules = subprocess.check_output(
+            [sys.executable, '-c', 'import sys, mfpsync.main; print sorted(sys.modules)'],
+            env=dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+        )
+        for name in (
+            'mfpsync.aio', 'mfpsync.batch', 'mfpsync.codec.cache', 'mfpsync.codec.parallel',
+            'mfpsync.pipeline', 'mfpsync.scheduler', 'mfpsync.shards', 'mfpsync.store',
+            'mfpsync.tables'
+        ):
+            self.assertNotIn(repr(name), modules)
+
+    def test_json_encoder(self):
+        from mfpsync.main import JSONEncoder
+        self.assertIs(JSONEncoder, output.JSONEncoder)
+
+    def test_all_packets(self):
+        from mfpsync.main import AllPackets
+        self.assertIs(AllPackets, mfpsync.AllPackets)
+
+class SyncCommandTest(unittest.TestCase):
+    def setUp(self):
+        # Keep argparse's usage errors out of the test output.
+        self.addCleanup(setattr, sys, 'stderr', sys.stderr)
+        sys.stderr = cStringIO.StringIO()
+
+    def test_store_rejects_output_options(self):
+        for options in (['-t', 'FoodEntry'], ['-P', 'pointers.json'], ['-f', 'ndjson']):
+            with self.assertRaises(SystemExit):
+                main.sync_command(['--store', 'mfp.sqlite'] + options + ['username', 'password'])
+
+class SplitCommandTest(unittest.TestCase):
+    def setUp(self):
+        self.addCleanup(setattr, sys, 'stderr', sys.stderr)
+        sys.stderr = cStringIO.StringIO()
+
+    def test_rejects_shard_count(self):
+        for shard_count in ('0', '-1'):
+            with self.assertRaises(SystemExit):
+                main.split_command(['-n', shard_count, '-o', 'shards', 'response.bin'])
+
+class ReplayCommandTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+
+        # Two pages written back to back, each with its own `SyncResult`.
+        self.filename = os.path.join(directory, 'response.bin')
+        with open(self.filename, 'wb') as fp:
+            fp.write(get_capture(count=5) + get_capture(count=3))
+
+    def replay(self, argv):
+        self.addCleanup(setattr, sys, 'stdout', sys.stdout)
+        sys.stdout = cStringIO.StringIO()
+        main.replay_command(argv)
+        return sys.stdout.getvalue()
+
+    def test_multi_page_capture(self):
+        output = self.replay([self.filename])
+        self.assertEqual(len(json.loads(output)), 2 + 8 * 10)
+        self.assertEqual(self.replay(['-j', '2', self.filename]), output)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,33 @@
+import unittest
+
+from mfpsync.codec.memo import BoundedCache
+
+class BoundedCacheTest(unittest.TestCase):
+    def test_caches_results(self):
+        calls = []
+        def function(key):
+            calls.append(key)
+            return [key]
+
+        cache = BoundedCache(function, max_size=2)
+        first = cache['a']
+        self.assertEqual(first, ['a'])
+        self.assertIs(cache['a'], first)
+        self.assertEqual(calls, ['a'])
+
+    def test_clears_when_full(self):
+        cache = BoundedCache(len, max_size=2)
+        self.assertEqual((cache['a'], cache['bb']), (1, 2))
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache['ccc'], 3)
+        self.assertEqual(cache, {'ccc': 3})
+
+    def test_doesnt_cache_exceptions(self):
+        cache = BoundedCache(int)
+        for _ in xrange(2):
+            with self.assertRaises(ValueError):
+                cache['x']
+        self.assertEqual(len(cache), 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+import pickle
+import unittest
+
+from mfpsync.codec import get_packet_types
+from mfpsync.codec.objects import Food, FoodPortion, Nutrients, UnknownPacket
+
+class FreezeTest(unittest.TestCase):
+    def test_freezes_nutrients(self):
+        food = Food()
+        food.nutrients = Nutrients(range(len(Nutrients.nutrient_names)))
+        food.freeze()
+
+        nutrients = food.nutrients
+        self.assertTrue(nutrients.is_frozen)
+        self.assertEqual(nutrients['iron'], 16.0)
+        self.assertEqual(nutrients, Nutrients(range(len(Nutrients.nutrient_names))))
+        with self.assertRaises(TypeError):
+            nutrients.array[0] = 1.0
+        with self.assertRaises(AttributeError):
+            nutrients.array = None
+        with self.assertRaises(AttributeError):
+            food.nutrients = Nutrients()
+
+class PickleTest(unittest.TestCase):
+    def get_food(self):
+        food = Food()
+        food.master_food_id = 123
+        food.description = 'Porridge'
+        food.nutrients = Nutrients(range(len(Nutrients.nutrient_names)))
+        portion = FoodPortion()
+        portion.description = 'bowl'
+        portion.gram_weight = 250.0
+        food.portions = [portion]
+        return food
+
+    def test_nutrients(self):
+        nutrients = Nutrients(range(len(Nutrients.nutrient_names)))
+        for protocol in (0, 1, 2):
+            copy = pickle.loads(pickle.dumps(nutrients, protocol))
+            self.assertEqual(copy, nutrients)
+            self.assertEqual(copy['iron'], 16.0)
+
+    def test_food(self):
+        food = self.get_food()
+        for protocol in (0, 1, 2):
+            copy = pickle.loads(pickle.dumps(food, protocol))
+            self.assertEqual(copy.to_primitive(), food.to_primitive())
+            self.assertEqual(copy.nutrients, food.nutrients)
+
+    def test_frozen_food(self):
+        food = self.get_food().freeze()
+        for protocol in (0, 1, 2):
+            copy = pickle.loads(pickle.dumps(food, protocol))
+            self.assertTrue(copy.is_frozen)
+            self.assertTrue(copy.nutrients.is_frozen)
+            self.assertEqual(copy.to_primitive(), food.to_primitive())
+
+class UnknownPacketTest(unittest.TestCase):
+    def test_class_packet_type(self):
+        self.assertIsNone(UnknownPacket.packet_type)
+        self.assertEqual(get_packet_types([UnknownPacket]), {None})
+
+        packet = UnknownPacket()
+        self.assertIsNone(packet.packet_type)
+        packet.packet_type = 99
+        self.assertEqual(packet.packet_type, 99)
+        self.assertIsNone(UnknownPacket.packet_type)
+        self.assertEqual(packet.to_primitive()['data']['packet_type'], 99)
+        self.assertEqual(pickle.loads(pickle.dumps(packet, 2)).packet_type, 99)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+import cStringIO
+import json
+import unittest
+
+from mfpsync import output
+from mfpsync.codec import BufferCodec
+from mfpsync.codec.objects import Food, MeasurementTypes, Nutrients
+from mfpsync.output import JSONEncoder, read_packets, write_packets
+
+from tests.packets import get_capture
+
+def get_foods():
+    foods = []
+    for master_food_id, description in ((1, 'Oats'), (2, 'Line one\nline two')):
+        food = Food()
+        food.master_food_id = master_food_id
+        food.description = description
+        foods.append(food)
+    return foods
+
+class WriterTest(unittest.TestCase):
+    def test_json_array(self):
+        fp = cStringIO.StringIO()
+        write_packets(get_foods(), fp, 'json')
+        data = fp.getvalue()
+
+        self.assertEqual(json.loads(data), json.loads(json.dumps(
+            [food.to_primitive() for food in get_foods()]
+        )))
+        self.assertTrue(data.startswith('[\n    {\n        "type": "Food", \n'))
+        self.assertTrue(data.endswith('\n    }\n]'))
+
+    def test_json_array_matches_dumps(self):
+        measurement_types = MeasurementTypes()
+        measurement_types.descriptions = {1: 'Weight', -2: u'N\xe4ck'}
+        food = Food()
+        food.nutrients = Nutrients([float('nan')] * len(Nutrients.nutrient_names))
+
+        packet_lists = [
+            [],
+            get_foods()[:1],
+            get_foods(),
+            [measurement_types, food],
+            list(BufferCodec(get_capture()).read_packets())
+        ]
+        for packets in packet_lists:
+            fp = cStringIO.StringIO()
+            write_packets(packets, fp, 'json')
+            self.assertEqual(fp.getvalue(), json.dumps(packets, indent=4, cls=JSONEncoder))
+
+    def test_append_indented_keys(self):
+        encoder = JSONEncoder(indent=2)
+        value = {True: [], None: {}, 1.5: [1, {'a': None}], 2: 'b'}
+        parts = []
+        encoder.append_indented(parts, value, 0)
+        self.assertEqual(''.join(parts), encoder.encode(value))
+
+    def test_ndjson(self):
+        fp = cStringIO.StringIO()
+        write_packets(get_foods(), fp, 'ndjson')
+        lines = fp.getvalue().splitlines()
+
+        self.assertEqual(len(lines), 2)
+        self.assertEqual(json.loads(lines[1])['data']['description'], 'Line one\nline two')
+
+class ReadPacketsTest(unittest.TestCase):
+    def setUp(self):
+        # Read in small pieces, so packets span several reads.
+        self.addCleanup(setattr, output, 'READ_SIZE', output.READ_SIZE)
+        output.READ_SIZE = 7
+
+    def read(self, data):
+        return list(read_packets(cStringIO.StringIO(data)))
+
+    def test_formats(self):
+        expected = json.loads(json.dumps([food.to_primitive() for food in get_foods()]))
+        for format in ('json', 'ndjson'):
+            fp = cStringIO.StringIO()
+            write_packets(get_foods(), fp, format)
+            packets = self.read(fp.getvalue())
+            self.assertEqual(packets, expected)
+            self.assertEqual(packets[0]['data'].keys()[0], 'master_food_id')
+
+    def test_empty(self):
+        for data in ('', '\n', '[]', ' [\n]\n'):
+            self.assertEqual(self.read(data), [])
+
+    def test_invalid(self):
+        for data in ('[{"a": 1} {"b": 2}]', '[{"a": 1}', '{"a": 1', '[{"a": 1}] {}'):
+            with self.assertRaises(ValueError):
+                self.read(data)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from mfpsync.codec import BufferCodec
+from mfpsync.codec.objects import FoodEntry, MeasurementValue
+from mfpsync.codec.parallel import ParallelDecoder, split_chunks
+
+from tests.packets import decode, get_capture, get_values
+
+class ParallelDecoderTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+
+        # Two pages, each with its own `SyncResult`.
+        self.pages = [get_capture(count=5), get_capture(count=3)]
+        self.data = ''.join(self.pages)
+        self.filename = os.path.join(directory, 'response.bin')
+        with open(self.filename, 'wb') as fp:
+            fp.write(self.data)
+
+    def decode_pages(self, types=None):
+        return [
+            packet
+            for page in self.pages
+            for packet in BufferCodec(page).read_packets(types)
+        ]
+
+    def test_matches_codec(self):
+        decoder = ParallelDecoder(self.filename, processes=2)
+        self.assertGreater(len(decoder.get_chunks()), 1)
+        expected = decode(self.pages[0]) + decode(self.pages[1])
+        self.assertEqual(get_values(list(decoder.read_packets())), expected)
+
+        unordered = get_values(list(decoder.read_packets(ordered=False)))
+        self.assertEqual(sorted(unordered), sorted(expected))
+
+    def test_types(self):
+        decoder = ParallelDecoder(self.filename, processes=2)
+        types = (FoodEntry, MeasurementValue)
+        self.assertEqual(
+            get_values(list(decoder.read_packets(types=types))),
+            get_values(self.decode_pages(types))
+        )
+
+    def test_primitives(self):
+        decoder = ParallelDecoder(self.filename, processes=2)
+        decoder.primitives = True
+        self.assertEqual(list(decoder.read_packets()), [
+            packet.to_primitive() for packet in self.decode_pages()
+        ])
+
+    def test_checks_packet_count(self):
+        with open(self.filename, 'ab') as fp:
+            fp.write(get_capture(count=1)[:-1])
+        with self.assertRaises(Exception):
+            list(ParallelDecoder(self.filename, processes=2).read_packets())
+
+    def test_split_chunks(self):
+        decoder = ParallelDecoder(self.filename, processes=2)
+        for chunk_count in (1, 3, 8, 1000):
+            chunks = split_chunks(decoder.index, chunk_count)
+            self.assertLessEqual(len(chunks), chunk_count)
+            self.assertEqual(chunks[0][0], 0)
+            self.assertEqual(chunks[-1][1], len(self.data))
+            for (_, end), (start, _) in zip(chunks, chunks[1:]):
+                self.assertEqual(end, start)
+                self.assertIn(start, decoder.index.starts)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+import time
+import unittest
+
+from mfpsync import Sync
+from mfpsync.http import HttpRequestParams
+from mfpsync import AllPackets
+from mfpsync.pipeline import PipelinedPackets
+from tests.standin import StandInServer, get_pages, read_sync_request, serve_pages
+
+class PipelinedPacketsTest(unittest.TestCase):
+    def start_server(self, respond):
+        server = StandInServer(respond)
+        server.start()
+        self.addCleanup(server.stop)
+
+        self.addCleanup(setattr, HttpRequestParams, 'url', HttpRequestParams.url)
+        HttpRequestParams.url = server.url
+        return server
+
+    def get_ids(self, packets):
+        return [
+            (packet.__class__.__name__, getattr(packet, 'master_measurement_id', None))
+            for packet in packets
+        ]
+
+    def test_matches_all_packets(self):
+        self.start_server(serve_pages(get_pages(3, 1000), chunk_size=4096))
+        for compress in (False, True):
+            sync = Sync('username', 'password')
+            sync.compress = compress
+            packets = PipelinedPackets(sync)
+            ids = self.get_ids(packets)
+            self.assertEqual(len(ids), 3003)
+            self.assertEqual(ids, self.get_ids(AllPackets(sync)))
+            self.assertEqual(packets.last_sync_pointers, {'page': '3'})
+
+    def test_stop_ends_stages(self):
+        respond = serve_pages(get_pages(3, 10))
+
+        def respond_slowly(handler, body):
+            # Hold later pages back, so the fetch stage is waiting on the
+            # network when the pipeline stops.
+            if read_sync_request(body).last_sync_pointers:
+                time.sleep(0.5)
+            respond(handler, body)
+
+        self.start_server(respond_slowly)
+        packets = PipelinedPackets(Sync('username', 'password'))
+        pages = packets.pages()
+        self.assertEqual(len(list(next(pages))), 11)
+        pages.close()
+
+        for thread in packets.threads:
+            thread.join(5)
+            self.assertFalse(thread.is_alive(), thread.name)
+
+if __name__ == '__main__':
+    unittest.main()
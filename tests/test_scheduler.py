@@ -0,0 +1,251 @@
+import cStringIO
+import shutil
+import tempfile
+import threading
+import unittest
+
+from mfpsync import scheduler
+from mfpsync.batch import Account, AccountResult
+from mfpsync.codec.objects import SyncResult
+from mfpsync.scheduler import (
+    AccountState, AIMDController, FleetScheduler, ScheduledSync, TokenBucket
+)
+from tests.standin import get_pages
+
+class FakeClock(object):
+    """
+    Stand-in for the `time` module. Time only moves when `advance` is called,
+    and `sleep` records how long it was asked to sleep - as if each caller
+    were a separate thread, waiting concurrently.
+    """
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+
+    def advance(self, seconds):
+        self.now += seconds
+
+class FakeClockTestCase(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.addCleanup(setattr, scheduler, 'time', scheduler.time)
+        scheduler.time = self.clock
+
+class TokenBucketTest(FakeClockTestCase):
+    def test_burst(self):
+        bucket = TokenBucket(10, burst=3)
+        self.assertEqual([bucket.acquire() for _ in xrange(3)], [0.0] * 3)
+        self.assertEqual(self.clock.sleeps, [])
+
+    def test_debt_keeps_order(self):
+        bucket = TokenBucket(10, burst=1)
+        waits = [bucket.acquire() for _ in xrange(4)]
+        # Each waiter reserves the next token, so is served after those
+        # before it.
+        for wait, expected in zip(waits, [0.0, 0.1, 0.2, 0.3]):
+            self.assertAlmostEqual(wait, expected)
+        self.assertEqual(self.clock.sleeps, waits[1:])
+
+        # The debt is paid off before any more tokens are available.
+        self.clock.advance(0.25)
+        self.assertAlmostEqual(bucket.acquire(), 0.15)
+
+    def test_refills_up_to_burst(self):
+        bucket = TokenBucket(10, burst=2)
+        bucket.acquire()
+        bucket.acquire()
+        self.clock.advance(60)
+        self.assertEqual([bucket.acquire() for _ in xrange(2)], [0.0, 0.0])
+        self.assertAlmostEqual(bucket.acquire(), 0.1)
+
+class AIMDControllerTest(FakeClockTestCase):
+    def record_window(self, controller, latency=0.1, error_count=0, is_limited=True):
+        """
+        Record a full window of requests started now, `error_count` of them
+        failing.
+        """
+
+        if is_limited:
+            controller.set_limited()
+        window_size = max(controller.min_window_size, controller.concurrency)
+        for number in xrange(window_size):
+            controller.record(self.clock.now, latency, number < error_count)
+        self.clock.advance(1)
+
+    def test_slow_start_doubles(self):
+        controller = AIMDController(1, 32, latency_target=1.0)
+        limits = []
+        for _ in xrange(6):
+            self.record_window(controller)
+            limits.append(controller.concurrency)
+        self.assertEqual(limits, [2, 4, 8, 16, 32, 32])
+
+    def test_increases_only_when_limited(self):
+        controller = AIMDController(1, 32, latency_target=1.0)
+        self.record_window(controller, is_limited=False)
+        self.assertEqual(controller.concurrency, 1)
+        self.record_window(controller)
+        self.assertEqual(controller.concurrency, 2)
+
+    def test_additive_increase_after_congestion(self):
+        controller = AIMDController(1, 32, latency_target=1.0)
+        for _ in xrange(3):
+            self.record_window(controller)
+        self.assertEqual(controller.concurrency, 8)
+
+        self.record_window(controller, latency=2.0)
+        self.assertEqual(controller.concurrency, 4)
+        self.assertFalse(controller.is_slow_start)
+
+        limits = []
+        for _ in xrange(3):
+            self.record_window(controller)
+            limits.append(controller.concurrency)
+        self.assertEqual(limits, [5, 6, 7])
+
+        self.record_window(controller, is_limited=False)
+        self.assertEqual(controller.concurrency, 7)
+
+    def test_halves_on_error_rate(self):
+        controller = AIMDController(1, 32, latency_target=1.0)
+        for _ in xrange(4):
+            self.record_window(controller)
+        self.assertEqual(controller.concurrency, 16)
+
+        # One failure in 16 is over the 5% allowed.
+        self.record_window(controller, error_count=1)
+        self.assertEqual(controller.concurrency, 8)
+        self.assertEqual(controller.error_count, 1)
+
+    def test_halves_on_relative_latency(self):
+        controller = AIMDController(1, 32)
+        for _ in xrange(3):
+            self.record_window(controller, latency=0.1)
+        self.assertEqual(controller.concurrency, 8)
+        self.assertAlmostEqual(controller.baseline_latency, 0.1)
+
+        # Within `latency_tolerance` of the baseline.
+        self.record_window(controller, latency=0.19)
+        self.assertEqual(controller.concurrency, 16)
+        self.record_window(controller, latency=0.21)
+        self.assertEqual(controller.concurrency, 8)
+
+    def test_clamps_to_range(self):
+        controller = AIMDController(2, 5, latency_target=1.0)
+        limits = []
+        for _ in xrange(3):
+            self.record_window(controller)
+            limits.append(controller.concurrency)
+        self.assertEqual(limits, [4, 5, 5])
+
+        for _ in xrange(3):
+            self.record_window(controller, latency=2.0)
+        self.assertEqual(controller.concurrency, 2)
+
+    def test_ignores_requests_started_before_window(self):
+        controller = AIMDController(1, 32, latency_target=1.0)
+        start_time = self.clock.now
+        self.clock.advance(1)
+        self.record_window(controller)
+        self.assertEqual(controller.concurrency, 2)
+
+        # Slow requests started under the old limit don't count against the
+        # new one.
+        for _ in xrange(10):
+            controller.record(start_time, 5.0, True)
+        self.assertEqual(controller.concurrency, 2)
+        self.assertEqual(controller.window_count, 0)
+        self.assertEqual(controller.request_count, 14)
+        self.assertEqual(controller.error_count, 10)
+
+        self.record_window(controller)
+        self.assertEqual(controller.concurrency, 4)
+
+class FleetSchedulerTest(unittest.TestCase):
+    def setUp(self):
+        self.scheduler = FleetScheduler('unused')
+        self.scheduler.min_interval = 60.0
+        self.scheduler.max_interval = 3600.0
+        self.scheduler.retry_delay = 30.0
+        self.state = AccountState(Account('user', 'password'))
+
+    def update(self, now, server_packet_count=0, error=None):
+        """
+        Update `self.state` from a sync finishing at `now`, returning the
+        number of seconds until it's next due.
+        """
+
+        result = AccountResult(self.state.account)
+        result.error = error
+        self.state.server_packet_count = server_packet_count
+        return self.scheduler.update(self.state, result, now) - now
+
+    def test_get_interval(self):
+        for rate, interval in [
+            (None, 60.0), (0.0, 3600.0), (10.0, 60.0), (1 / 600.0, 600.0), (1e-6, 3600.0)
+        ]:
+            self.state.rate = rate
+            self.assertAlmostEqual(self.scheduler.get_interval(self.state), interval)
+
+    def test_estimates_rate(self):
+        # Syncing once gives no rate, so the account is due soon.
+        self.assertEqual(self.update(0.0, 50), 60.0)
+        self.assertIsNone(self.state.rate)
+
+        self.assertAlmostEqual(self.update(600.0, 1), 600.0)
+        self.assertAlmostEqual(self.state.rate, 1 / 600.0)
+
+        # A moving average, weighted `rate_weight` towards the latest sync.
+        self.assertAlmostEqual(self.update(1200.0, 11), 1 / (0.7 / 600.0 + 0.3 * 11 / 600.0))
+        self.assertAlmostEqual(self.update(1300.0, 1000), 60.0)
+
+    def test_retry_backoff(self):
+        self.update(0.0)
+        delays = [self.update(now, error='Error') for now in xrange(1, 10)]
+        self.assertEqual(delays, [30.0, 60.0, 120.0, 240.0, 480.0, 960.0, 1920.0, 3600.0, 3600.0])
+        self.assertEqual(self.state.failure_count, 9)
+        self.assertEqual(self.state.last_success, 0.0)
+
+        # A success resets the backoff, and estimates the rate over the time
+        # since the last success.
+        self.assertAlmostEqual(self.update(3600.0, 3), 1200.0)
+        self.assertEqual(self.state.failure_count, 0)
+        self.assertAlmostEqual(self.update(3601.0, error='Error'), 30.0)
+
+    def test_counts_server_packets(self):
+        page, = get_pages(1, 2)
+        sync = ScheduledSync('user', 'password', self.scheduler, self.state)
+        for types in (None, [SyncResult]):
+            list(sync.decode_response(cStringIO.StringIO(page), types=types))
+        self.assertEqual(self.state.server_packet_count, 4)
+
+    def test_sync_account_raises(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        fleet_scheduler = FleetScheduler(directory, max_concurrency=2)
+
+        def sync_account(account):
+            raise ValueError('Callback failed')
+        fleet_scheduler.sync_account = sync_account
+
+        accounts = [Account('user{}'.format(number), 'password') for number in xrange(4)]
+        thread = threading.Thread(target=fleet_scheduler.run, args=(accounts, 0.5))
+        thread.daemon = True
+        thread.start()
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+
+        self.assertEqual(fleet_scheduler.running_count, 0)
+        for state in fleet_scheduler.states:
+            self.assertEqual(state.result.error, 'ValueError: Callback failed')
+            self.assertEqual(state.failure_count, 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+import cStringIO
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from mfpsync import shards
+from mfpsync.codec import BufferCodec
+from mfpsync.output import read_packets, write_packets
+
+from tests.packets import get_capture
+
+class ShardsTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+        self.captures = [get_capture(count=5), get_capture(count=2)]
+        self.filenames = []
+        for number, capture in enumerate(self.captures):
+            filename = os.path.join(self.directory, 'response-{}.bin'.format(number))
+            with open(filename, 'wb') as fp:
+                fp.write(capture)
+            self.filenames.append(filename)
+
+        shards.split_captures(self.filenames, 4, self.directory)
+        self.manifest = shards.load_manifest(os.path.join(self.directory, 'manifest.json'))
+
+    def get_expected(self):
+        fp = cStringIO.StringIO()
+        write_packets([
+            packet
+            for capture in self.captures
+            for packet in BufferCodec(capture).read_packets()
+        ], fp)
+        return json.loads(fp.getvalue())
+
+    def decode_shards(self, format):
+        outputs = []
+        for shard_number in xrange(len(self.manifest['shards'])):
+            fp = cStringIO.StringIO()
+            write_packets(shards.decode_shard(self.manifest, shard_number), fp, format)
+            outputs.append(fp.getvalue())
+        return outputs
+
+    def merge(self, outputs, format='json'):
+        decoded_shards = [read_packets(cStringIO.StringIO(output)) for output in outputs]
+        fp = cStringIO.StringIO()
+        write_packets(shards.merge_shards(self.manifest, decoded_shards), fp, format)
+        return json.loads(fp.getvalue())
+
+    def test_matches_codec(self):
+        self.assertEqual(len(self.manifest['shards']), 4)
+        for format in ('json', 'ndjson'):
+            self.assertEqual(self.merge(self.decode_shards(format)), self.get_expected())
+
+    def test_checks_shard_counts(self):
+        outputs = self.decode_shards('ndjson')
+        outputs[1] = ''.join(outputs[1].splitlines(True)[1:])
+        with self.assertRaises(Exception):
+            self.merge(outputs)
+
+    def test_checks_manifest_counts(self):
+        self.manifest['expected_packet_count'] += 1
+        with self.assertRaises(Exception):
+            self.merge(self.decode_shards('json'))
+
+    def test_rejects_shard_count(self):
+        for shard_count in (0, -1):
+            with self.assertRaises(ValueError):
+                shards.split_captures(self.filenames, shard_count, self.directory)
+
+    def test_type_names(self):
+        self.assertEqual(shards.get_type_name(5), 'FoodEntry')
+        self.assertEqual(shards.get_type_name(16), 'WaterEntry')
+        self.assertEqual(shards.get_type_name(999), 'UnknownPacket')
+
+if __name__ == '__main__':
+    unittest.main()
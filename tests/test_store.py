@@ -0,0 +1,183 @@
+import copy
+import cStringIO
+import datetime
+import unittest
+
+from mfpsync.codec import Codec
+from mfpsync.codec.objects import (
+    DeleteItem, ExerciseEntry, Food, FoodEntry, Nutrients, PACKET_TYPE_EXERCISE_ENTRY,
+    PACKET_TYPE_FOOD_ENTRY, SyncResult
+)
+from mfpsync.store import Store
+
+from tests.packets import get_capture
+
+class Page(object):
+    """
+    Stand-in for `AllPackets`, as of a single page.
+    """
+
+    def __init__(self, last_sync_pointers):
+        self.sync_result = SyncResult()
+        self.sync_result.last_sync_pointers = last_sync_pointers
+
+def get_food(master_food_id):
+    food = Food()
+    food.master_food_id = master_food_id
+    food.description = 'Food {}'.format(master_food_id)
+    return food
+
+class StoreTest(unittest.TestCase):
+    def setUp(self):
+        self.store = Store(':memory:')
+        self.addCleanup(self.store.close)
+
+    def get_food_ids(self):
+        return [
+            row[0] for row in
+            self.store.connection.execute('SELECT master_food_id FROM foods ORDER BY 1')
+        ]
+
+    def test_failed_page_is_discarded(self):
+        def failing_page():
+            yield get_food(1)
+            raise IOError('Connection reset')
+
+        with self.assertRaises(IOError):
+            self.store.ingest_page(failing_page(), Page({'page': '1'}))
+        self.assertEqual(self.get_food_ids(), [])
+        self.assertEqual(self.store.last_sync_pointers, {})
+
+        self.store.ingest_page([get_food(2)], Page({'page': '1'}))
+        self.assertEqual(self.get_food_ids(), [2])
+        self.assertEqual(self.store.last_sync_pointers, {'page': '1'})
+
+class AggregatesTest(unittest.TestCase):
+    start_date = datetime.date(1900, 1, 1)
+    end_date = datetime.date(2100, 1, 1)
+
+    def setUp(self):
+        self.store = Store(':memory:')
+        self.addCleanup(self.store.close)
+
+        # The entries expected to count towards the totals, by ID.
+        self.food_entries = {}
+        self.exercise_entries = {}
+
+    def ingest(self, packets):
+        self.store.ingest_page(packets, Page({}))
+        for packet in packets:
+            if isinstance(packet, FoodEntry):
+                self.food_entries[packet.master_food_id] = packet
+            elif isinstance(packet, ExerciseEntry):
+                self.exercise_entries[packet.master_exercise_entry_id] = packet
+            elif isinstance(packet, DeleteItem):
+                if packet.item_type == PACKET_TYPE_FOOD_ENTRY:
+                    self.food_entries.pop(packet.master_id, None)
+                elif packet.item_type == PACKET_TYPE_EXERCISE_ENTRY:
+                    self.exercise_entries.pop(packet.master_id, None)
+
+    def check_totals(self):
+        expected = {}
+        for entry in self.food_entries.itervalues():
+            count, totals = expected.get(entry.date, (0, dict.fromkeys(Nutrients.nutrient_names, 0.0)))
+            for name, value in entry.nutrients.iteritems():
+                totals[name] += value
+            expected[entry.date] = (count + 1, totals)
+
+        daily_nutrients = self.store.get_daily_nutrients(self.start_date, self.end_date)
+        self.assertEqual([date for date, _, _ in daily_nutrients], sorted(expected))
+        for date, count, totals in daily_nutrients:
+            self.assertEqual(count, expected[date][0])
+            self.assertEqual(totals.keys(), list(Nutrients.nutrient_names))
+            for name, value in totals.iteritems():
+                self.assertAlmostEqual(value, expected[date][1][name], places=3)
+
+        expected = {}
+        for entry in self.exercise_entries.itervalues():
+            count, calories = expected.get(entry.date, (0, 0))
+            expected[entry.date] = (count + 1, calories + entry.calories)
+        self.assertEqual(self.store.get_daily_exercise(self.start_date, self.end_date), [
+            (date, count, calories) for date, (count, calories) in sorted(expected.items())
+        ])
+
+    def check_rebuild(self):
+        daily_nutrients = self.store.get_daily_nutrients(self.start_date, self.end_date)
+        daily_exercise = self.store.get_daily_exercise(self.start_date, self.end_date)
+        self.store.rebuild_aggregates()
+        self.assertEqual(self.store.get_daily_exercise(self.start_date, self.end_date), daily_exercise)
+
+        rebuilt = self.store.get_daily_nutrients(self.start_date, self.end_date)
+        self.assertEqual(len(rebuilt), len(daily_nutrients))
+        for (date, count, totals), (rebuilt_date, rebuilt_count, rebuilt_totals) \
+                in zip(daily_nutrients, rebuilt):
+            self.assertEqual((rebuilt_date, rebuilt_count), (date, count))
+            for name in Nutrients.nutrient_names:
+                self.assertAlmostEqual(rebuilt_totals[name], totals[name], places=3)
+        self.check_totals()
+
+    def get_delete_item(self, entry, is_destroyed):
+        delete_item = DeleteItem()
+        delete_item.item_type = entry.packet_type
+        if isinstance(entry, ExerciseEntry):
+            delete_item.master_id = entry.master_exercise_entry_id
+        else:
+            delete_item.master_id = entry.master_food_id
+        delete_item.is_destroyed = is_destroyed
+        return delete_item
+
+    def get_packets(self):
+        return list(Codec(cStringIO.StringIO(get_capture(count=6))).read_packets())
+
+    def test_insert(self):
+        self.ingest(self.get_packets())
+        self.assertEqual(len(self.food_entries), 6)
+        self.check_totals()
+        self.check_rebuild()
+
+    def test_edit(self):
+        packets = self.get_packets()
+        self.ingest(packets)
+
+        edits = []
+        for packet in [packet for packet in packets if isinstance(packet, FoodEntry)][:2]:
+            entry = copy.copy(packet)
+            entry.date += datetime.timedelta(days=30)
+            entry.meal_name = 'Snacks'
+            entry.quantity = 3.0
+            edits.append(entry)
+        for packet in [packet for packet in packets if isinstance(packet, ExerciseEntry)][:1]:
+            entry = copy.copy(packet)
+            entry.calories = 1000
+            edits.append(entry)
+        self.ingest(edits)
+        self.check_totals()
+        self.assertEqual(
+            [count for _, count, _ in self.store.get_daily_nutrients(
+                self.start_date, self.end_date, 'Snacks'
+            )],
+            [1, 1]
+        )
+        self.check_rebuild()
+
+    def test_delete(self):
+        packets = self.get_packets()
+        self.ingest(packets)
+
+        # Both removed and marked-as-deleted entries leave the totals.
+        entries = [packet for packet in packets if isinstance(packet, (FoodEntry, ExerciseEntry))]
+        self.ingest([
+            self.get_delete_item(entry, number % 2 == 0)
+            for number, entry in enumerate(entries[:4])
+        ])
+        self.check_totals()
+        self.check_rebuild()
+
+        # Deleting everything leaves no totals.
+        self.ingest([self.get_delete_item(entry, True) for entry in entries])
+        self.assertEqual(self.store.get_daily_nutrients(self.start_date, self.end_date), [])
+        self.assertEqual(self.store.get_daily_exercise(self.start_date, self.end_date), [])
+        self.check_rebuild()
+
+if __name__ == '__main__':
+    unittest.main()
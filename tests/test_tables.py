@@ -0,0 +1,120 @@
+import cStringIO
+import datetime
+import unittest
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from mfpsync.codec import Codec
+from mfpsync.codec.cache import PacketCache
+from mfpsync.codec.objects import (
+    ExerciseEntry, Food, FoodEntry, FoodPortion, MeasurementValue, Nutrients
+)
+
+from tests.packets import get_capture
+
+def get_data():
+    """
+    Return an encoded response body, in which identical packets repeat.
+    """
+
+    fp = cStringIO.StringIO()
+    codec = Codec(fp)
+    for number in xrange(20):
+        food = Food()
+        food.master_food_id = number % 2
+        food.grams = 100.0
+        food.nutrients = Nutrients(range(len(Nutrients.nutrient_names)))
+        portion = FoodPortion()
+        portion.gram_weight = 50.0
+        food.portions = [portion]
+
+        entry = FoodEntry()
+        entry.master_food_id = number % 4
+        entry.food = food
+        entry.date = datetime.date(2014, 1, 1 + number % 4)
+        entry.meal_name = 'Breakfast'
+        entry.quantity = 2.0
+        entry.weight_index = 0
+        entry.write_packet_to_codec(codec)
+
+        measurement = MeasurementValue()
+        measurement.master_measurement_id = number % 3
+        measurement.type_name = 'Weight'
+        measurement.entry_date = datetime.date(2014, 1, 1)
+        measurement.value = 70.5
+        measurement.write_packet_to_codec(codec)
+    return fp.getvalue()
+
+@unittest.skipIf(numpy is None, 'needs numpy')
+class TablesTest(unittest.TestCase):
+    def collect_tables(self, packet_cache):
+        from mfpsync.tables import collect_tables
+
+        codec = Codec(cStringIO.StringIO(get_data()))
+        codec.packet_cache = packet_cache
+        return collect_tables(codec.read_packets())
+
+    def test_collects_cached_packets(self):
+        packet_cache = PacketCache()
+        tables = self.collect_tables(packet_cache)
+        self.assertGreater(packet_cache.hits, 0)
+        self.assertEqual(len(tables.food_entries), 20)
+        self.assertEqual(len(tables.measurements), 20)
+
+        uncached_tables = self.collect_tables(None)
+        self.assertTrue(numpy.array_equal(
+            tables.food_entries.scaled_nutrients(),
+            uncached_tables.food_entries.scaled_nutrients()
+        ))
+
+    def test_int64_columns(self):
+        from mfpsync.tables import collect_tables
+
+        packets = list(Codec(cStringIO.StringIO(get_capture())).read_packets())
+        tables = collect_tables(packets)
+
+        def of_class(cls):
+            return [packet for packet in packets if isinstance(packet, cls)]
+
+        food_entries = tables.food_entries
+        self.assertEqual(food_entries.master_food_id.dtype, numpy.int64)
+        self.assertEqual(
+            food_entries.master_food_id.tolist(),
+            [entry.master_food_id for entry in of_class(FoodEntry)]
+        )
+        self.assertEqual(
+            food_entries.date.tolist(), [entry.date for entry in of_class(FoodEntry)]
+        )
+
+        self.assertEqual(
+            tables.exercise_entries.master_exercise_entry_id.tolist(),
+            [entry.master_exercise_entry_id for entry in of_class(ExerciseEntry)]
+        )
+        self.assertEqual(
+            tables.exercise_entries.calories.tolist(),
+            [entry.calories for entry in of_class(ExerciseEntry)]
+        )
+
+        measurements = tables.measurements
+        self.assertEqual(
+            measurements.master_measurement_id.tolist(),
+            [measurement.master_measurement_id for measurement in of_class(MeasurementValue)]
+        )
+        self.assertEqual(
+            measurements.entry_date.tolist(),
+            [measurement.entry_date for measurement in of_class(MeasurementValue)]
+        )
+
+    def test_empty_tables(self):
+        from mfpsync.tables import collect_tables
+
+        tables = collect_tables([])
+        self.assertEqual(len(tables.food_entries), 0)
+        self.assertEqual(tables.food_entries.master_food_id.dtype, numpy.int64)
+        self.assertEqual(tables.measurements.entry_date.dtype, numpy.dtype('datetime64[D]'))
+
+if __name__ == '__main__':
+    unittest.main()